@@ -1,27 +1,42 @@
 import json
 import os
 import hashlib
-import matplotlib.pyplot as plt
-import matplotlib.dates as mdates
-from datetime import datetime
+from datetime import datetime, timedelta
 import glob
-import matplotlib.font_manager as fm
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from river_archive import BUNDLE_PATTERN, DAY_FILE_PATTERN, RiverArchive, read_source
+from download_manifest import sha256_file
+from db_connections import ConnectionManager
+from series_store import SeriesStore, date_ints_to_days, date_str_to_day, days_to_strings
+from anomaly_detector import ANOMALY_DDL, AnomalyDetector
+import numpy as np
 import warnings
 import sqlite3
+import threading
 
-# 彻底禁用所有matplotlib字体警告
-import warnings
-warnings.filterwarnings("ignore", category=UserWarning, module="matplotlib")
-warnings.filterwarnings("ignore", category=UserWarning, module="matplotlib.font_manager")
-warnings.filterwarnings("ignore", category=RuntimeWarning, module="matplotlib.font_manager")
-
-# 设置中文显示方案
-plt.rcParams['font.sans-serif'] = [
-    'SimHei', 'Microsoft YaHei', 'WenQuanYi Micro Hei',
-    'Heiti SC', 'STHeiti', 'Arial Unicode MS', 'sans-serif'
-]
-plt.rcParams['axes.unicode_minus'] = False
-plt.rcParams['font.family'] = 'sans-serif'
+
+def _pyplot():
+    """按需导入 pyplot（仅交互式绘图使用），返回 (plt, mdates)
+
+    导入 matplotlib 和解析字体需要较长时间，建库、导入等命令不需要绘图，因此不在模块导入时加载。
+    """
+    import matplotlib.pyplot as plt
+    import matplotlib.dates as mdates
+
+    # 彻底禁用所有matplotlib字体警告
+    warnings.filterwarnings("ignore", category=UserWarning, module="matplotlib")
+    warnings.filterwarnings("ignore", category=UserWarning, module="matplotlib.font_manager")
+    warnings.filterwarnings("ignore", category=RuntimeWarning, module="matplotlib.font_manager")
+
+    # 设置中文显示方案
+    plt.rcParams['font.sans-serif'] = [
+        'SimHei', 'Microsoft YaHei', 'WenQuanYi Micro Hei',
+        'Heiti SC', 'STHeiti', 'Arial Unicode MS', 'sans-serif'
+    ]
+    plt.rcParams['axes.unicode_minus'] = False
+    plt.rcParams['font.family'] = 'sans-serif'
+    return plt, mdates
 
 # 可选: 中文字体提示（仅在作为主程序运行时提示）
 FONT_HINT = (
@@ -34,151 +49,974 @@ FONT_HINT = (
 # 在文件顶部导入logging模块
 import logging
 
+# 数据库结构版本（PRAGMA user_version）
+#   0/1: 旧版单表 river_data（河流/站点名称逐行重复 + 多个冗余索引）
+#   2:   河流/站点维表 + 按 (station_id, date_int) 聚簇的 WITHOUT ROWID 观测表
+#   3:   增加按月/季/年汇总的 rollups 表
+#   4:   增加变更日志 ingest_log
+#   5:   增加入库时异常检测的 anomaly_state / anomalies 表
+SCHEMA_VERSION = 5
+
+SCHEMA_DDL = [
+    """
+    CREATE TABLE IF NOT EXISTS rivers (
+        id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL UNIQUE
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS stations (
+        id INTEGER PRIMARY KEY,
+        river_id INTEGER NOT NULL REFERENCES rivers(id),
+        name TEXT NOT NULL,
+        UNIQUE(river_id, name)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS observations (
+        station_id INTEGER NOT NULL,
+        date_int INTEGER NOT NULL,
+        z_value REAL,
+        q_value REAL,
+        PRIMARY KEY (station_id, date_int)
+    ) WITHOUT ROWID
+    """,
+    # 汇总表：每个站点按月/季/年的有效数据（水位、流量均为正数）统计
+    #   grain='month'  period=YYYYMM
+    #   grain='season' period=季节年*10+季节下标（SEASONS 顺序；12 月计入下一年的冬季）
+    #   grain='year'   period=YYYY
+    """
+    CREATE TABLE IF NOT EXISTS rollups (
+        station_id INTEGER NOT NULL,
+        grain TEXT NOT NULL,
+        period INTEGER NOT NULL,
+        n INTEGER NOT NULL,
+        z_sum REAL, z_min REAL, z_max REAL,
+        q_sum REAL, q_min REAL, q_max REAL,
+        last_date_int INTEGER,
+        PRIMARY KEY (station_id, grain, period)
+    ) WITHOUT ROWID
+    """,
+    # 数据代数：每次观测数据变化 +1，供各进程的内存缓存判断是否过期
+    """
+    CREATE TABLE IF NOT EXISTS meta (
+        key TEXT PRIMARY KEY,
+        value INTEGER NOT NULL
+    )
+    """,
+    # 变更日志：每个数据代数整体替换了哪些日期（date_ints 为 NULL 表示全量重建），
+    # 其他进程据此只重读变化的日期来刷新内存缓存
+    """
+    CREATE TABLE IF NOT EXISTS ingest_log (
+        generation INTEGER PRIMARY KEY,
+        date_ints TEXT,
+        logged_at TEXT
+    )
+    """,
+    # 导入台账
+    """
+    CREATE TABLE IF NOT EXISTS ingest_ledger (
+        source TEXT PRIMARY KEY,
+        mtime REAL,
+        size INTEGER,
+        sha256 TEXT,
+        rows INTEGER,
+        imported_at TEXT
+    )
+    """,
+]
+
+# 兼容视图：保留旧表的列，方便临时查询和外部脚本
+RIVER_DATA_VIEW_DDL = """
+CREATE VIEW IF NOT EXISTS river_data AS
+SELECT r.name AS river_name,
+       s.name AS station_name,
+       printf('%04d-%02d-%02d', o.date_int / 10000, o.date_int / 100 % 100, o.date_int % 100) AS date,
+       o.date_int,
+       o.z_value,
+       o.q_value
+FROM observations o
+JOIN stations s ON s.id = o.station_id
+JOIN rivers r ON r.id = s.river_id
+"""
+
+# 导入台账：记录每个数据源文件导入时的 mtime、大小与内容哈希
+LEDGER_UPSERT_SQL = (
+    "INSERT OR REPLACE INTO ingest_ledger (source, mtime, size, sha256, rows, imported_at) "
+    "VALUES (?, ?, ?, ?, ?, datetime('now', 'localtime'))"
+)
+
+BUMP_GENERATION_SQL = (
+    "INSERT INTO meta (key, value) VALUES ('data_generation', 1) "
+    "ON CONFLICT(key) DO UPDATE SET value = value + 1"
+)
+INGEST_LOG_SQL = "INSERT OR REPLACE INTO ingest_log (generation, date_ints, logged_at) VALUES (?, ?, datetime('now', 'localtime'))"
+# 变更日志保留的代数；落后更多的进程直接清空缓存
+INGEST_LOG_KEEP = 1000
+
+# 汇总：月度统计直接来自观测表，季度/年度统计由月度统计合并
+# （station_id IN (SELECT id FROM stations) 让 SQLite 逐站点按主键定位，而不是全表扫描）
+ROLLUP_COLUMNS = 'station_id, grain, period, n, z_sum, z_min, z_max, q_sum, q_min, q_max, last_date_int'
+ROLLUP_MONTH_SQL = f"""
+INSERT INTO rollups ({ROLLUP_COLUMNS})
+SELECT station_id, 'month', date_int / 100, COUNT(*), SUM(z_value), MIN(z_value), MAX(z_value),
+       SUM(q_value), MIN(q_value), MAX(q_value), MAX(date_int)
+FROM observations
+WHERE station_id IN (SELECT id FROM stations) AND date_int BETWEEN ? AND ?
+  AND z_value > 0 AND q_value > 0
+GROUP BY station_id, date_int / 100
+"""
+ROLLUP_MERGE_SQL = f"""
+INSERT INTO rollups ({ROLLUP_COLUMNS})
+SELECT station_id, ?, ?, SUM(n), SUM(z_sum), MIN(z_min), MAX(z_max),
+       SUM(q_sum), MIN(q_min), MAX(q_max), MAX(last_date_int)
+FROM rollups
+WHERE station_id IN (SELECT id FROM stations) AND grain = 'month' AND period IN ({{months}})
+GROUP BY station_id
+"""
+ROLLUP_DELETE_SQL = 'DELETE FROM rollups WHERE station_id IN (SELECT id FROM stations) AND grain=? AND period=?'
+
+INSERT_SQL = 'INSERT OR REPLACE INTO observations (station_id, date_int, z_value, q_value) VALUES (?, ?, ?, ?)'
+# 按主键逐站点定位删除某一天的数据，无需额外的日期索引
+DELETE_DAY_SQL = 'DELETE FROM observations WHERE station_id IN (SELECT id FROM stations) AND date_int=?'
+
+
+def date_to_int(date_str):
+    """'YYYY-MM-DD' -> YYYYMMDD 整数"""
+    return int(date_str.replace('-', ''))
+
+
+def int_to_datetime(date_int):
+    return datetime(date_int // 10000, date_int // 100 % 100, date_int % 100)
+
+
+def parse_day_rows(date_str, data):
+    """把一天的原始响应解析为数据库行 [(river, station, date_int, z, q)]。
+
+    日期只解析一次；Z/Q 为 '--' 或无法转换为数值的站点会被跳过。
+    返回 (rows, skipped)，结构无效时 rows 为 None。
+    """
+    if 'data' not in data or 'river_data' not in data['data']:
+        return None, 0
+    try:
+        date_int = int(datetime.strptime(date_str, '%Y-%m-%d').strftime('%Y%m%d'))
+    except ValueError:
+        date_int = None
+
+    rows = []
+    skipped = 0
+    for system in data['data']['river_data']:
+        for detail in system.get('river_detail', []):
+            z_str = detail.get('Z', '')
+            q_str = detail.get('Q', '')
+            if z_str == '--' or q_str == '--':
+                skipped += 1
+                continue
+            try:
+                rows.append((detail['river'], detail['river_name'], date_int, float(z_str), float(q_str)))
+            except (ValueError, KeyError, TypeError):
+                skipped += 1
+    return rows, skipped
+
+
+def parse_source(path, since=None):
+    """解析一个数据源文件（单日 JSON 或月度归档），返回 [(date_str, rows, skipped)]。
+
+    模块级函数，供进程池中的解析进程调用。
+    """
+    return [(date_str,) + parse_day_rows(date_str, data) for date_str, data in read_source(path, since)]
+
+
+def iter_parsed_sources(sources, since=None, workers=1):
+    """按顺序产出各数据源的解析结果 (path, [(date_str, rows, skipped)])，读取失败时为 (path, None)。
+
+    workers > 1 时用进程池并行解析，同时在途的任务不超过 workers*2 个，
+    保证解析进程不会远远跑在写入端前面，内存占用保持平稳。
+    """
+    if workers <= 1:
+        for path in sources:
+            try:
+                yield path, parse_source(path, since)
+            except (OSError, ValueError, EOFError) as e:
+                logger.error(f"读取 {os.path.basename(path)} 出错: {e}")
+                yield path, None
+        return
+
+    source_iter = iter(sources)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for path in source_iter:
+            pending.append((path, pool.submit(parse_source, path, since)))
+            if len(pending) >= workers * 2:
+                break
+        while pending:
+            path, future = pending.popleft()
+            next_path = next(source_iter, None)
+            if next_path is not None:
+                pending.append((next_path, pool.submit(parse_source, next_path, since)))
+            try:
+                yield path, future.result()
+            except (OSError, ValueError, EOFError) as e:
+                logger.error(f"读取 {os.path.basename(path)} 出错: {e}")
+                yield path, None
+
+
+# 季节定义（冬季跨年：12、1、2 月）
+SEASONS = ["春季", "夏季", "秋季", "冬季"]
+# 月份(1-12) -> SEASONS 下标，下标 0 占位
+SEASON_OF_MONTH = np.array([-1, 3, 3, 0, 0, 0, 1, 1, 1, 2, 2, 2, 3])
+
+
+def season_of_month(month_period):
+    """YYYYMM -> (季节周期, 该季节包含的三个 YYYYMM)"""
+    year, month = divmod(month_period, 100)
+    index = int(SEASON_OF_MONTH[month])
+    if index == 3:
+        season_year = year + 1 if month == 12 else year
+        months = [(season_year - 1) * 100 + 12, season_year * 100 + 1, season_year * 100 + 2]
+    else:
+        season_year = year
+        first = 3 + index * 3
+        months = [year * 100 + m for m in range(first, first + 3)]
+    return season_year * 10 + index, months
+
+
+def _format_change(avg, prev_avg):
+    diff = avg - prev_avg
+    pct = (diff / prev_avg) * 100 if prev_avg != 0 else 0
+    return f"{diff:+.2f}({pct:+.1f}%)"
+
+
+def trend_result(river_name, station_name, years, start_date, end_date, valid_count, season_sums, year_sums):
+    """由分组汇总值生成分析结果。
+
+    :param season_sums: 各季节（按 SEASONS 顺序）的 (count, z_sum, q_sum)
+    :param year_sums: 按年份升序的 (year, count, z_sum, q_sum)
+    """
+    results = {}
+    for season, (count, z_sum, q_sum) in zip(SEASONS, season_sums):
+        if count:
+            results[season] = {
+                'avg_level': round(float(z_sum / count), 2),
+                'avg_flow': round(float(q_sum / count), 2)
+            }
+
+    analysis_result = {
+        'river_name': river_name,
+        'station_name': station_name,
+        'years': years,
+        'start_date': start_date,
+        'end_date': end_date,
+        'valid_data_count': int(valid_count),
+        'seasonal_data': results,
+        'yearly_trends': []
+    }
+
+    # 分析年际变化
+    if years >= 2:
+        prev_avg_z = None
+        prev_avg_q = None
+        for year, count, z_sum, q_sum in year_sums:
+            if not count:
+                continue
+            avg_z = float(z_sum / count)
+            avg_q = float(q_sum / count)
+            trend = {
+                'year': int(year),
+                'avg_level': round(avg_z, 2),
+                'avg_flow': round(avg_q, 2)
+            }
+            if prev_avg_z is not None:
+                trend['level_change'] = _format_change(avg_z, prev_avg_z)
+                trend['flow_change'] = _format_change(avg_q, prev_avg_q)
+            analysis_result['yearly_trends'].append(trend)
+            prev_avg_z = avg_z
+            prev_avg_q = avg_q
+
+    return analysis_result
+
+
+# 站点比较：两个站点至少有这么多天同时有数据才计算相关系数
+MIN_OVERLAP_DAYS = 3
+
+
+def pairwise_correlation(x, y, min_periods=MIN_OVERLAP_DAYS):
+    """x 的每一列与 y 的每一列之间的 Pearson 相关系数（逐对只用两列都有值的日期）。
+
+    :param x: (天数, m) 数组，缺测为 NaN
+    :param y: (天数, n) 数组，行与 x 对齐
+    :return: (r (m, n)，重叠天数 (m, n))；重叠不足 min_periods 或方差为 0 时 r 为 NaN
+    """
+    mx, my = ~np.isnan(x), ~np.isnan(y)
+    x0, y0 = np.where(mx, x, 0.0), np.where(my, y, 0.0)
+    mx, my = mx.astype(np.float64), my.astype(np.float64)
+    n = mx.T @ my
+    sx, sy = x0.T @ my, mx.T @ y0
+    sxx, syy = (x0 * x0).T @ my, mx.T @ (y0 * y0)
+    sxy = x0.T @ y0
+    with np.errstate(invalid='ignore', divide='ignore'):
+        r = (n * sxy - sx * sy) / np.sqrt((n * sxx - sx * sx) * (n * syy - sy * sy))
+    r[n < min_periods] = np.nan
+    return np.clip(r, -1.0, 1.0), n.astype(np.int64)
+
+
+def lagged_correlation(values, max_lag):
+    """各列两两之间的滞后相关：corr[k][i, j] 为第 i 列在 t 日与第 j 列在 t + lag 日的相关系数，
+    lag 从 -max_lag 到 max_lag（k = lag + max_lag）。返回 (lags, corr (2 * max_lag + 1, n, n))
+    """
+    days, count = values.shape
+    max_lag = max(0, min(max_lag, days - 1))
+    lags = np.arange(-max_lag, max_lag + 1)
+    corr = np.full((len(lags), count, count), np.nan)
+    for lag in range(max_lag + 1):
+        r, _ = pairwise_correlation(values[:days - lag], values[lag:])
+        corr[max_lag + lag] = r
+        # 负滞后即交换两列的正滞后
+        corr[max_lag - lag] = r.T
+    return lags, corr
+
+
+def _matrix(values, digits=4):
+    """NaN -> None 的嵌套列表"""
+    return [[None if v != v else round(float(v), digits) for v in row] for row in values]
+
+
+def _column(values, digits=4):
+    return [None if v != v else round(float(v), digits) for v in values.tolist()]
+
+
 class RiverDataAnalyzer:
-    def __init__(self, data_dir='river_data', db_path=None):
+    # 待导入的数据源少于该数量时不启用进程池（日常增量导入通常只有一两个文件）
+    PARALLEL_MIN_SOURCES = 8
+
+    def __init__(self, data_dir='river_data', db_path=None, import_workers=1,
+                 read_pool_size=4, mmap_size_mb=256, cache_size_mb=32, series_cache_mb=128,
+                 anomaly_thresholds=None, anomaly_window_days=30, anomaly_zscore=4.0):
         self.data_dir = data_dir
         self.db_path = db_path or 'river_data.db'  # 数据库路径
+        # 读连接池 + 进程内唯一的写连接
+        self.db = ConnectionManager(self.db_path, pool_size=read_pool_size,
+                                    mmap_size_mb=mmap_size_mb, cache_size_mb=cache_size_mb)
+        # 站点时序的列式内存缓存
+        self.series_cache = SeriesStore(series_cache_mb)
+        # 初次/全量导入时的解析进程数，<=0 表示使用全部 CPU 核
+        self.import_workers = import_workers
         self.rivers = set()
+        # (河流, 站点) -> 站点 id
+        self._station_ids = {}
+        # 河流目录与缓存对应的数据代数（refresh() 据此判断其他进程是否写入过）
+        self._seen_generation = None
+        self._refresh_lock = threading.RLock()
+        # 入库时的流式异常检测（滚动统计保存在数据库中，各进程共享）
+        self.anomaly_detector = AnomalyDetector(anomaly_thresholds, anomaly_window_days, anomaly_zscore)
         self.init_database()
 
     def init_database(self):
         """初始化数据库连接和表结构"""
         conn = sqlite3.connect(self.db_path)
         self._init_database(conn)
+        # 已入库的河流立即可用，不必等待导入
+        self._refresh_rivers(conn)
+        self._seen_generation = self._data_generation(conn)
         conn.close()
 
-    def _get_connection(self):
-        """获取新的数据库连接"""
-        return sqlite3.connect(self.db_path)
-
     def _init_database(self, conn):
         cursor = conn.cursor()
-        # 创建数据表
+        legacy = cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type='table' AND name='river_data'"
+        ).fetchone()
+        for ddl in SCHEMA_DDL + ANOMALY_DDL:
+            cursor.execute(ddl)
+        conn.commit()
+
+        # 迁移: 旧版单表结构 -> 规范化结构
+        if legacy:
+            self._migrate_legacy(conn)
+        version = cursor.execute('PRAGMA user_version').fetchone()[0]
+        if version < 3:
+            # 旧库补建汇总表
+            self._update_rollups(conn)
+        if version < 5:
+            # 旧库按历史数据补建异常检测的滚动统计
+            self.anomaly_detector.rebuild(conn)
+        cursor.execute(RIVER_DATA_VIEW_DDL)
+        cursor.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+        conn.commit()
+
+    def _migrate_legacy(self, conn):
+        """把旧版 river_data 表的数据迁移到 rivers/stations/observations，然后删除旧表并整理文件"""
+        logger.info("正在把旧版 river_data 表迁移到新的数据库结构 ...")
+        cursor = conn.cursor()
+        # 确保旧数据具有 date_int
+        cols = [row[1] for row in cursor.execute('PRAGMA table_info(river_data)').fetchall()]
+        if 'date_int' not in cols:
+            cursor.execute('ALTER TABLE river_data ADD COLUMN date_int INTEGER')
+        cursor.execute('UPDATE river_data SET date_int = CAST(strftime("%Y%m%d", date) AS INTEGER) WHERE date IS NOT NULL AND (date_int IS NULL OR date_int = 0)')
+
+        cursor.execute('INSERT OR IGNORE INTO rivers (name) SELECT DISTINCT river_name FROM river_data WHERE river_name IS NOT NULL')
+        cursor.execute('''
+        INSERT OR IGNORE INTO stations (river_id, name)
+        SELECT DISTINCT r.id, d.station_name
+        FROM river_data d JOIN rivers r ON r.name = d.river_name
+        WHERE d.station_name IS NOT NULL
+        ''')
         cursor.execute('''
-        CREATE TABLE IF NOT EXISTS river_data (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            river_name TEXT,
-            station_name TEXT,
-            date TEXT,
-            date_int INTEGER,
-            z_value REAL,
-            q_value REAL,
-            UNIQUE(river_name, station_name, date)
-        );
+        INSERT OR REPLACE INTO observations (station_id, date_int, z_value, q_value)
+        SELECT s.id, d.date_int, d.z_value, d.q_value
+        FROM river_data d
+        JOIN rivers r ON r.name = d.river_name
+        JOIN stations s ON s.river_id = r.id AND s.name = d.station_name
+        WHERE d.date_int IS NOT NULL
+        ORDER BY s.id, d.date_int
         ''')
-        # 创建索引以加速查询
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_river ON river_data(river_name)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_station ON river_data(station_name)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_date ON river_data(date)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_date_int ON river_data(date_int)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_river_station_date ON river_data(river_name, station_name, date)')
+        migrated = cursor.rowcount
+        cursor.execute('DROP TABLE river_data')
         conn.commit()
+        # 释放旧表和冗余索引占用的空间
+        conn.execute('VACUUM')
+        logger.info(f"迁移完成，共 {migrated} 条观测数据")
+
+    def _resolve_workers(self, n_sources, workers=None):
+        workers = self.import_workers if workers is None else workers
+        if workers is None or workers <= 0:
+            workers = os.cpu_count() or 1
+        if n_sources < self.PARALLEL_MIN_SOURCES:
+            return 1
+        return min(workers, n_sources)
+
+    def _station_id(self, conn, river_name, station_name):
+        """获取（必要时创建）站点 id，结果缓存在内存中"""
+        key = (river_name, station_name)
+        station_id = self._station_ids.get(key)
+        if station_id is None:
+            conn.execute('INSERT OR IGNORE INTO rivers (name) VALUES (?)', (river_name,))
+            river_id = conn.execute('SELECT id FROM rivers WHERE name=?', (river_name,)).fetchone()[0]
+            conn.execute('INSERT OR IGNORE INTO stations (river_id, name) VALUES (?, ?)', (river_id, station_name))
+            station_id = conn.execute(
+                'SELECT id FROM stations WHERE river_id=? AND name=?', (river_id, station_name)
+            ).fetchone()[0]
+            self._station_ids[key] = station_id
+        return station_id
+
+    def _to_observations(self, conn, rows):
+        """(river, station, date_int, z, q) -> (station_id, date_int, z, q)"""
+        return [(self._station_id(conn, river, station), date_int, z, q) for river, station, date_int, z, q in rows]
 
-        # 迁移: 确保旧数据具有 date_int
+    def _ingest_parsed(self, conn, parsed, ledger_info, replace_days=True, insert_sql=INSERT_SQL,
+                       batch_size=5000, commit_rows=200000, own_transaction=True):
+        """单写入端：把各数据源的解析结果分批写入，并在同一事务中登记导入台账。
+
+        :param parsed: iter_parsed_sources 产出的 (path, days)
+        :param ledger_info: {path: (source, mtime, size, sha256)}
+        :param replace_days: 写入前先删除这些日期的旧数据，使更正过的文件覆盖旧值
+        :param own_transaction: False 时在调用方已开启的事务内写入，不分批提交，由调用方提交或回滚
+                                （全量重建使用，需配合 replace_days=False）
+        :return: 写入的行数
+        """
+        total = 0
+        pending = 0
+        batch = []
+        # 每个事务提交后，把替换的日期和已缓存站点的新数据合并进内存缓存
+        tracked = self.series_cache.station_ids() if replace_days else set()
+        replaced = set()
+        tracked_rows = []
+
+        def commit():
+            if replaced:
+                self._update_rollups(conn, replaced)
+                self.anomaly_detector.update(conn, replaced)
+                generation = self._bump_generation(conn, replaced)
+            conn.execute('COMMIT')
+            if replaced:
+                self._committed(generation)
+                self.series_cache.apply(generation, replaced, tracked_rows, tracked)
+                replaced.clear()
+                tracked_rows.clear()
+
+        if own_transaction:
+            conn.execute('BEGIN')
         try:
-            cursor.execute('PRAGMA table_info(river_data)')
-            cols = [row[1] for row in cursor.fetchall()]
-            if 'date_int' not in cols:
-                cursor.execute('ALTER TABLE river_data ADD COLUMN date_int INTEGER')
-                conn.commit()
-            cursor.execute('UPDATE river_data SET date_int = CAST(strftime("%Y%m%d", date) AS INTEGER) WHERE date IS NOT NULL AND (date_int IS NULL OR date_int = 0)')
-            conn.commit()
-        except Exception:
-            pass
+            for path, days in parsed:
+                if days is None:
+                    # 读取失败的数据源不登记台账，下次导入时重试
+                    continue
+                source_rows = 0
+                for date_str, rows, skipped in days:
+                    if rows is None:
+                        logger.error(f"{date_str} 数据结构无效")
+                        continue
+                    if skipped:
+                        logger.warning(f"{date_str} 跳过 {skipped} 条无效数据（Z/Q 为 '--' 或非数值）")
+                    observations = self._to_observations(conn, rows)
+                    if replace_days:
+                        if batch:
+                            conn.executemany(insert_sql, batch)
+                            batch = []
+                        date_int = date_to_int(date_str)
+                        conn.execute(DELETE_DAY_SQL, (date_int,))
+                        replaced.add(date_int)
+                        if tracked:
+                            tracked_rows.extend(obs for obs in observations if obs[0] in tracked)
+                    batch.extend(observations)
+                    source_rows += len(rows)
+                    if len(batch) >= batch_size:
+                        conn.executemany(insert_sql, batch)
+                        batch = []
+                source, mtime, size, digest = ledger_info[path]
+                conn.execute(LEDGER_UPSERT_SQL, (source, mtime, size, digest, source_rows))
+                total += source_rows
+                pending += source_rows
+                if own_transaction and pending >= commit_rows:
+                    if batch:
+                        conn.executemany(insert_sql, batch)
+                        batch = []
+                    commit()
+                    conn.execute('BEGIN')
+                    pending = 0
+            if batch:
+                conn.executemany(insert_sql, batch)
+            if own_transaction:
+                commit()
+        except BaseException:
+            if own_transaction:
+                self._rollback(conn)
+            raise
+        return total
+
+    def _rollback(self, conn):
+        """回滚写入事务；事务中新建的河流/站点随之撤销，丢弃内存中的站点 id 映射"""
+        if conn.in_transaction:
+            conn.execute('ROLLBACK')
+        self._station_ids.clear()
+
+    def _import_sources(self, conn, sources, ledger_info, replace_days=True, workers=None, insert_sql=INSERT_SQL,
+                        own_transaction=True):
+        workers = self._resolve_workers(len(sources), workers)
+        if workers > 1:
+            logger.info(f"并行解析 {len(sources)} 个数据源（{workers} 个进程）")
+        return self._ingest_parsed(conn, iter_parsed_sources(sources, workers=workers), ledger_info,
+                                   replace_days, insert_sql, own_transaction=own_transaction)
+
+    def _source_key(self, path):
+        """台账中的数据源键：相对数据目录的路径"""
+        return os.path.relpath(path, self.data_dir)
+
+    def _plan_import(self, conn):
+        """对照导入台账找出新增或变化的数据源。
+
+        mtime 和大小都没变的文件直接跳过（不读取内容）；任一变化时再计算哈希，
+        内容相同则只更新台账中的 mtime/大小。返回 (待导入路径, 台账信息)，路径按 sources() 的顺序排列。
+
+        同一天既有单日文件又在月度归档里时以单日文件为准：sources() 把月度归档排在当月单日文件之前，
+        重新导入某个月度归档时，当月的单日文件即使没变也一并重新导入，覆盖归档里的那几天。
+        """
+        ledger = {row[0]: row[1:] for row in conn.execute('SELECT source, mtime, size, sha256 FROM ingest_ledger')}
+        sources = RiverArchive(self.data_dir).sources()
+        ledger_info = {}
+        unchanged = {}
+        touched = []
+        for path in sources:
+            source = self._source_key(path)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entry = ledger.pop(source, None)
+            if entry and entry[0] == st.st_mtime and entry[1] == st.st_size:
+                unchanged[path] = (source, st.st_mtime, st.st_size, entry[2])
+                continue
+            digest = sha256_file(path)
+            if entry and entry[2] == digest:
+                touched.append((st.st_mtime, st.st_size, source))
+                unchanged[path] = (source, st.st_mtime, st.st_size, digest)
+                continue
+            ledger_info[path] = (source, st.st_mtime, st.st_size, digest)
+
+        months = {match.group(1) for match in map(BUNDLE_PATTERN.search, ledger_info) if match}
+        for path, info in unchanged.items():
+            match = DAY_FILE_PATTERN.search(path)
+            if match and match.group(1)[:7] in months:
+                ledger_info[path] = info
+        to_import = [path for path in sources if path in ledger_info]
+
+        if touched:
+            conn.executemany('UPDATE ingest_ledger SET mtime=?, size=? WHERE source=?', touched)
+        if ledger:
+            # 已不存在的数据源（例如单日文件被合并进月度归档）
+            conn.executemany('DELETE FROM ingest_ledger WHERE source=?', [(source,) for source in ledger])
+        return to_import, ledger_info
+
+    def ingest_day(self, date_str, data):
+        """把一天的原始响应直接写入数据库（同步时边下载边入库），返回写入的行数
+
+        该日期已有的数据会被整体替换。
+        """
+        rows, skipped = parse_day_rows(date_str, data)
+        if rows is None:
+            raise ValueError(f"{date_str} 数据结构无效")
+        if skipped:
+            logger.warning(f"{date_str} 跳过 {skipped} 条无效数据（Z/Q 为 '--' 或非数值）")
+        date_int = date_to_int(date_str)
+        with self.db.writer() as conn:
+            tracked = self.series_cache.station_ids()
+            conn.execute('BEGIN')
+            try:
+                observations = self._to_observations(conn, rows)
+                conn.execute(DELETE_DAY_SQL, (date_int,))
+                conn.executemany(INSERT_SQL, observations)
+                self._update_rollups(conn, [date_int])
+                self.anomaly_detector.update(conn, [date_int])
+                generation = self._bump_generation(conn, [date_int])
+                conn.execute('COMMIT')
+            except BaseException:
+                self._rollback(conn)
+                raise
+            self._committed(generation)
+            self.series_cache.apply(generation, {date_int}, observations, tracked)
+        self.rivers.update(row[0] for row in rows)
+        return len(rows)
+
+    def record_archived(self, path, previous, rows):
+        """边下载边入库时，归档文件写入后把它登记到导入台账，下次 load_data 不再重复导入。
+
+        只有写入前的文件已按台账完整导入（或此前不存在）时才登记，否则仍留给 load_data 导入。
+        :param path: 写入的归档文件（单日 JSON 或月度归档）
+        :param previous: 写入前该文件的 (mtime, 大小)，此前不存在为 None
+        :param rows: 这次写入的那一天已入库的行数
+        :return: 是否登记
+        """
+        source = self._source_key(path)
+        st = os.stat(path)
+        digest = sha256_file(path)
+        with self.db.writer() as conn:
+            entry = conn.execute('SELECT mtime, size, rows FROM ingest_ledger WHERE source=?', (source,)).fetchone()
+            if previous is None:
+                imported = 0
+            elif entry and (entry[0], entry[1]) == tuple(previous):
+                imported = entry[2]
+            else:
+                return False
+            conn.execute(LEDGER_UPSERT_SQL, (source, st.st_mtime, st.st_size, digest, imported + rows))
+        return True
+
+    def _update_rollups(self, conn, date_ints=None):
+        """重新计算写入日期所在月份的汇总，以及受影响的季度、年度汇总（在写入事务内调用）
+
+        date_ints 为空时根据全部观测重建汇总表。
+        """
+        if date_ints is None:
+            conn.execute('DELETE FROM rollups')
+            conn.execute(ROLLUP_MONTH_SQL, (0, 99999999))
+            months = [row[0] for row in conn.execute("SELECT DISTINCT period FROM rollups WHERE grain='month'")]
+        else:
+            months = sorted({date_int // 100 for date_int in date_ints})
+            for month in months:
+                conn.execute(ROLLUP_DELETE_SQL, ('month', month))
+                conn.execute(ROLLUP_MONTH_SQL, (month * 100 + 1, month * 100 + 31))
+
+        seasons = dict(season_of_month(month) for month in months)
+        for season, season_months in seasons.items():
+            self._merge_rollup(conn, 'season', season, season_months)
+        for year in sorted({month // 100 for month in months}):
+            self._merge_rollup(conn, 'year', year, [year * 100 + m for m in range(1, 13)])
+
+    def _merge_rollup(self, conn, grain, period, months):
+        conn.execute(ROLLUP_DELETE_SQL, (grain, period))
+        conn.execute(ROLLUP_MERGE_SQL.format(months=', '.join('?' * len(months))), (grain, period, *months))
+
+    def _data_generation(self, conn):
+        """数据库当前的数据代数"""
+        row = conn.execute("SELECT value FROM meta WHERE key='data_generation'").fetchone()
+        return row[0] if row else 0
+
+    def _bump_generation(self, conn, date_ints=None):
+        """数据代数 +1 并记录变更日志（在写入事务内调用），返回新的代数；date_ints 为空表示全量重建"""
+        conn.execute(BUMP_GENERATION_SQL)
+        generation = self._data_generation(conn)
+        logged = None if date_ints is None else ','.join(str(d) for d in sorted(date_ints))
+        conn.execute(INGEST_LOG_SQL, (generation, logged))
+        conn.execute('DELETE FROM ingest_log WHERE generation <= ?', (generation - INGEST_LOG_KEEP,))
+        return generation
+
+    def _committed(self, generation):
+        # 本进程的写入：河流目录已在写入时更新，紧接着上次看到的代数时无需再刷新
+        with self._refresh_lock:
+            if self._seen_generation == generation - 1:
+                self._seen_generation = generation
+
+    def data_generation(self):
+        """当前数据代数（观测数据每次变化 +1），可用于缓存键和 ETag"""
+        with self.db.reader() as conn:
+            return self._data_generation(conn)
+
+    def refresh(self):
+        """其他进程（例如同步 leader）写入后，刷新本进程的河流目录和站点时序缓存，返回当前数据代数
+
+        只读取一次数据代数，没有变化时立即返回。有变化时按变更日志只重读已缓存站点中被替换的日期；
+        日志不连续（全量重建、落后太多）时才清空缓存。
+        """
+        with self.db.reader() as conn:
+            generation = self._data_generation(conn)
+            if generation == self._seen_generation:
+                return generation
+            with self._refresh_lock:
+                # 在同一个读事务中读取日志和观测，看到的是一致的快照
+                conn.execute('BEGIN')
+                try:
+                    generation = self._data_generation(conn)
+                    if generation != self._seen_generation:
+                        self._catch_up(conn, self._seen_generation, generation)
+                        self._seen_generation = generation
+                finally:
+                    conn.execute('COMMIT')
+        return generation
+
+    def _catch_up(self, conn, seen, generation):
+        log = []
+        if seen is not None and generation > seen:
+            log = conn.execute(
+                'SELECT date_ints FROM ingest_log WHERE generation > ? AND generation <= ? ORDER BY generation',
+                (seen, generation)
+            ).fetchall()
+        if seen is None or len(log) != generation - seen or any(row[0] is None for row in log):
+            self.series_cache.invalidate(generation)
+        else:
+            replaced = {int(d) for row in log for d in row[0].split(',') if d}
+            tracked = self.series_cache.station_ids()
+            observations = []
+            if replaced:
+                lo, hi = min(replaced), max(replaced)
+                for station_id in tracked:
+                    rows = conn.execute(
+                        'SELECT date_int, z_value, q_value FROM observations '
+                        'WHERE station_id=? AND date_int BETWEEN ? AND ?',
+                        (station_id, lo, hi)
+                    ).fetchall()
+                    observations.extend((station_id, *row) for row in rows if row[0] in replaced)
+            self.series_cache.apply(generation, replaced, observations, tracked, base_generation=seen)
+        self._refresh_rivers(conn)
+
+    def _refresh_rivers(self, conn):
+        cursor = conn.execute('SELECT name FROM rivers')
+        self.rivers = set(row[0] for row in cursor.fetchall())
 
     # 修改 load_data 方法使用数据库
-    def load_data(self):
-        # 增量导入：仅导入库中最大日期之后的文件
-        conn = self._get_connection()
-        cursor = conn.cursor()
-        cursor.execute('SELECT MAX(date) FROM river_data')
-        row = cursor.fetchone()
-        max_date_in_db = row[0] if row and row[0] else None
+    def load_data(self, workers=None):
+        """增量导入：按导入台账只读取新增或内容变化的数据源，返回写入的行数
 
-        # 获取所有JSON文件
-        files = glob.glob(os.path.join(self.data_dir, '*.json'))
-        
-        # 加载数据到数据库
-        for file_path in sorted(files):
+        晚到或更正过的文件也会被导入，其中各日期的数据整体覆盖库中的旧值。
+        """
+        total = 0
+        with self.db.writer() as conn:
             try:
-                file_name = os.path.basename(file_path)
-                # 从文件名提取日期 (格式: river_data_YYYY-MM-DD.json)
-                date_str = file_name.replace('river_data_', '').replace('.json', '')
-                if max_date_in_db and date_str <= max_date_in_db:
-                    continue
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    
-                    # 检查数据结构是否正确
-                    if 'data' not in data or 'river_data' not in data['data']:
-                        logger.error(f"文件 {file_name} 结构无效")
-                        continue
-                    
-                    river_systems = data['data']['river_data']
-                    
-                    # 存储数据到数据库
-                    for system in river_systems:
-                        river_system = system['river_system']
-                        for detail in system['river_detail']:
-                            river_name = detail['river']
-                            station_name = detail['river_name']
-                            
-                            # 检查Z和Q是否为有效数值（非'--'）
-                            z_str = detail.get('Z', '')
-                            q_str = detail.get('Q', '')
-                            
-                            if z_str == '--' or q_str == '--':
-                                logger.warning(f"文件 {file_name} 跳过无效数据: {river_name}-{station_name} Z={z_str} Q={q_str}")
-                                continue
-                            
-                            try:
-                                z_value = float(z_str)
-                                q_value = float(q_str)
-                                # 插入数据库（含 date_int）
-                                try:
-                                    date_int = int(datetime.strptime(date_str, '%Y-%m-%d').strftime('%Y%m%d'))
-                                except Exception:
-                                    date_int = None
-                                cursor.execute(
-                                    'INSERT OR IGNORE INTO river_data (river_name, station_name, date, date_int, z_value, q_value) VALUES (?, ?, ?, ?, ?, ?)',
-                                    (river_name, station_name, date_str, date_int, z_value, q_value)
-                                )
-                            except (ValueError, KeyError) as e:
-                                logger.error(f"文件 {file_name} 数据解析错误: {e}")
-                    conn.commit()
+                to_import, ledger_info = self._plan_import(conn)
+                if to_import:
+                    total = self._import_sources(conn, to_import, ledger_info, workers=workers)
             except Exception as e:
                 # 异常处理代码
                 logger.error(f"加载数据时出错: {e}")
-        
-        # 刷新河流集合
-        cursor.execute('SELECT DISTINCT river_name FROM river_data')
-        self.rivers = set(row[0] for row in cursor.fetchall())
-        conn.close()
+
+            # 刷新河流集合
+            self._refresh_rivers(conn)
+        return total
+
+    def rebuild_database(self, workers=None):
+        """全量重建：清空观测表后批量导入全部归档，返回写入的行数
+
+        导入先写入无索引的临时表，最后按 (station_id, date_int) 排序一次性写入聚簇表，
+        相当于把主键 B 树的构建推迟到导入结束，页面也因此连续紧凑。
+        清空、导入、导入台账和汇总都在同一个事务中完成：中途失败或被中断时库中仍是重建前的数据，
+        不会留下已登记台账、观测却缺失的数据源。
+        同一站点同一天出现多次时（单日文件与月度归档重复）保留临时表中最后写入的一行，
+        即按 sources() 顺序靠后的数据源，单日文件优先于月度归档，与增量导入一致。
+        """
+        with self.db.writer() as conn:
+            conn.execute('BEGIN')
+            try:
+                conn.execute('DELETE FROM observations')
+                conn.execute('DELETE FROM ingest_ledger')
+                conn.execute('CREATE TEMP TABLE IF NOT EXISTS staging (station_id INTEGER, date_int INTEGER, z_value REAL, q_value REAL)')
+                conn.execute('DELETE FROM temp.staging')
+                to_import, ledger_info = self._plan_import(conn)
+                total = self._import_sources(conn, to_import, ledger_info, replace_days=False, workers=workers,
+                                             insert_sql='INSERT INTO temp.staging VALUES (?, ?, ?, ?)',
+                                             own_transaction=False)
+                conn.execute('''
+                INSERT OR REPLACE INTO observations (station_id, date_int, z_value, q_value)
+                SELECT station_id, date_int, z_value, q_value FROM temp.staging ORDER BY station_id, date_int, rowid
+                ''')
+                conn.execute('DROP TABLE temp.staging')
+                self._update_rollups(conn)
+                self.anomaly_detector.rebuild(conn)
+                generation = self._bump_generation(conn)
+                conn.execute('COMMIT')
+            except BaseException:
+                self._rollback(conn)
+                raise
+            self.series_cache.invalidate(generation)
+            conn.execute('ANALYZE')
+            self._refresh_rivers(conn)
+            self._seen_generation = generation
+        return total
 
     # 修改数据获取方法
     def get_data_by_river_and_station(self, river_name, station_name):
-        conn = self._get_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            'SELECT date, z_value, q_value FROM river_data WHERE river_name=? AND station_name=? ORDER BY date',
-            (river_name, station_name)
-        )
-        result = [(datetime.strptime(row[0], '%Y-%m-%d'), row[1], row[2]) for row in cursor.fetchall()]
-        conn.close()
-        return result
+        with self.db.reader() as conn:
+            rows = conn.execute(
+                '''
+                SELECT o.date_int, o.z_value, o.q_value
+                FROM observations o
+                JOIN stations s ON s.id = o.station_id
+                JOIN rivers r ON r.id = s.river_id
+                WHERE r.name=? AND s.name=?
+                ORDER BY o.date_int
+                ''',
+                (river_name, station_name)
+            ).fetchall()
+        return [(int_to_datetime(row[0]), row[1], row[2]) for row in rows]
+
+    def _lookup_station_id(self, conn, river_name, station_name):
+        """查询站点 id（不创建），不存在时返回 None"""
+        key = (river_name, station_name)
+        station_id = self._station_ids.get(key)
+        if station_id is None:
+            row = conn.execute(
+                'SELECT s.id FROM stations s JOIN rivers r ON r.id = s.river_id WHERE r.name=? AND s.name=?',
+                (river_name, station_name)
+            ).fetchone()
+            if row is None:
+                return None
+            station_id = self._station_ids[key] = row[0]
+        return station_id
+
+    def _load_station(self, conn, station_id, lo=0, hi=99999999):
+        """从数据库读取站点 [lo, hi] 范围内的观测，返回 (date_ints, z, q) 数组"""
+        rows = conn.execute(
+            'SELECT date_int, z_value, q_value FROM observations '
+            'WHERE station_id=? AND date_int BETWEEN ? AND ? ORDER BY date_int',
+            (station_id, lo, hi)
+        ).fetchall()
+        table = np.array(rows, dtype=np.float64).reshape(-1, 3)
+        return table[:, 0].astype(np.int64), table[:, 1], table[:, 2]
+
+    def get_series_arrays(self, river_name, station_name, start_date=None, end_date=None):
+        """按日期范围取站点时序，返回 (dates[datetime64[D]], levels, flows) 数组；站点不存在时返回 None
+
+        :param start_date: 'YYYY-MM-DD'，含当天；为空表示不限
+        :param end_date: 'YYYY-MM-DD'，含当天；为空表示不限
+
+        站点的完整历史以列式数组缓存在内存中（series_cache），范围用二分查找定位，
+        水位/流量返回缓存的只读视图。缓存关闭（SERIES_CACHE_MB=0）时直接在
+        (station_id, date_int) 主键上做范围扫描。
+        """
+        with self.db.reader() as conn:
+            station_id = self._lookup_station_id(conn, river_name, station_name)
+            if station_id is None:
+                return None
+            if not self.series_cache.budget_bytes:
+                lo = date_to_int(start_date) if start_date else 0
+                hi = date_to_int(end_date) if end_date else 99999999
+                date_ints, levels, flows = self._load_station(conn, station_id, lo, hi)
+                return date_ints_to_days(date_ints).astype('datetime64[D]'), levels, flows
+            generation = self._data_generation(conn)
+            if generation != self._seen_generation:
+                # 其他进程写入过：先按变更日志增量刷新缓存，而不是整体清空
+                generation = self.refresh()
+            series = self.series_cache.get(station_id, generation, lambda: self._load_station(conn, station_id))
+        days, levels, flows = series.slice(date_str_to_day(start_date) if start_date else None,
+                                           date_str_to_day(end_date) if end_date else None)
+        levels, flows = levels.view(), flows.view()
+        levels.flags.writeable = False
+        flows.flags.writeable = False
+        return days.astype('datetime64[D]'), levels, flows
+
+    def get_series(self, river_name, station_name, start_date=None, end_date=None):
+        """按日期范围查询站点时序，返回 (dates, levels, flows) 列表（日期为 'YYYY-MM-DD'）；站点不存在时返回 None"""
+        series = self.get_series_arrays(river_name, station_name, start_date, end_date)
+        if series is None:
+            return None
+        dates, levels, flows = series
+        return days_to_strings(dates), levels.tolist(), flows.tolist()
+
+    def get_aligned_series(self, stations, start_date=None, end_date=None):
+        """批量取多个站点的时序，对齐到共同的日期轴
+
+        :param stations: [(河流, 站点), ...]
+        :return: (dates[datetime64[D]], {(河流, 站点): (levels, flows)})；日期轴为各站点日期的并集，
+                 站点在某天没有数据时为 NaN；不存在的站点不在结果中
+
+        有内存缓存时一次遍历各站点缓存的列式数组；缓存关闭时用一条 SQL 按主键范围读出全部站点。
+        """
+        parts = {}
+        with self.db.reader() as conn:
+            station_ids = {}
+            for river_name, station_name in stations:
+                station_id = self._lookup_station_id(conn, river_name, station_name)
+                if station_id is not None:
+                    station_ids[(river_name, station_name)] = station_id
+            if not station_ids:
+                return np.empty(0, dtype='datetime64[D]'), {}
+
+            if not self.series_cache.budget_bytes:
+                lo = date_to_int(start_date) if start_date else 0
+                hi = date_to_int(end_date) if end_date else 99999999
+                ids = sorted(set(station_ids.values()))
+                rows = conn.execute(
+                    'SELECT station_id, date_int, z_value, q_value FROM observations '
+                    f"WHERE station_id IN ({', '.join('?' * len(ids))}) AND date_int BETWEEN ? AND ? "
+                    'ORDER BY station_id, date_int',
+                    (*ids, lo, hi)
+                ).fetchall()
+                table = np.array(rows, dtype=np.float64).reshape(-1, 4)
+                row_ids = table[:, 0].astype(np.int64)
+                days = date_ints_to_days(table[:, 1].astype(np.int64))
+                for key, station_id in station_ids.items():
+                    a, b = np.searchsorted(row_ids, [station_id, station_id + 1])
+                    parts[key] = (days[a:b], table[a:b, 2], table[a:b, 3])
+            else:
+                generation = self._data_generation(conn)
+                if generation != self._seen_generation:
+                    generation = self.refresh()
+                lo_day = date_str_to_day(start_date) if start_date else None
+                hi_day = date_str_to_day(end_date) if end_date else None
+                for key, station_id in station_ids.items():
+                    series = self.series_cache.get(station_id, generation,
+                                                   lambda: self._load_station(conn, station_id))
+                    parts[key] = series.slice(lo_day, hi_day)
+
+        axis = np.unique(np.concatenate([days for days, _, _ in parts.values()]))
+        aligned = {}
+        for key, (days, levels, flows) in parts.items():
+            idx = np.searchsorted(axis, days)
+            aligned_levels = np.full(len(axis), np.nan)
+            aligned_flows = np.full(len(axis), np.nan)
+            aligned_levels[idx] = levels
+            aligned_flows[idx] = flows
+            aligned[key] = (aligned_levels, aligned_flows)
+        return axis.astype('datetime64[D]'), aligned
 
     def get_river_names(self):
         """获取所有河流名称"""
+        # 其他进程同步入库的新河流
+        self.refresh()
         return sorted(list(self.rivers))
 
     def get_stations_by_river(self, river_name):
         """根据河流名称获取所有站点"""
-        conn = self._get_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT DISTINCT station_name FROM river_data WHERE river_name=?", (river_name,))
-        stations = [row[0] for row in cursor.fetchall()]
-        conn.close()
-        return sorted(stations)
+        with self.db.reader() as conn:
+            rows = conn.execute(
+                "SELECT s.name FROM stations s JOIN rivers r ON r.id = s.river_id WHERE r.name=?", (river_name,)
+            ).fetchall()
+        return sorted(row[0] for row in rows)
+
+    def _first_station(self, river_name):
+        """河流的第一个站点名称（未指定站点时绘图用），没有则返回 None"""
+        with self.db.reader() as conn:
+            row = conn.execute(
+                "SELECT s.name FROM stations s JOIN rivers r ON r.id = s.river_id WHERE r.name=? LIMIT 1",
+                (river_name,)
+            ).fetchone()
+        return row[0] if row else None
 
 
     def plot_water_level(self, river_name, station_name=None):
@@ -192,15 +1030,10 @@ class RiverDataAnalyzer:
             title = f'{river_name} - {station_name} 水位变化曲线'
         else:
             # 如果未指定站点，获取该河流的第一个站点
-            conn = self._get_connection()
-            cursor = conn.cursor()
-            cursor.execute("SELECT station_name FROM river_data WHERE river_name=? LIMIT 1", (river_name,))
-            row = cursor.fetchone()
-            conn.close()
-            if not row:
+            station_name = self._first_station(river_name)
+            if not station_name:
                 print(f"错误: 未找到 {river_name} 的数据!")
                 return
-            station_name = row[0]
             data = self.get_data_by_river_and_station(river_name, station_name)
             title = f'{river_name} - {station_name} 水位变化曲线'
 
@@ -209,6 +1042,7 @@ class RiverDataAnalyzer:
         levels = [item[1] for item in data]
 
         # 创建图表
+        plt, mdates = _pyplot()
         plt.figure(figsize=(12, 6))
         plt.plot(dates, levels, '-b', linewidth=1)
         plt.scatter(dates, levels, s=10, c='r')
@@ -243,15 +1077,10 @@ class RiverDataAnalyzer:
             title = f'{river_name} - {station_name} 流量变化曲线'
         else:
             # 如果未指定站点，获取该河流的第一个站点
-            conn = self._get_connection()
-            cursor = conn.cursor()
-            cursor.execute("SELECT station_name FROM river_data WHERE river_name=? LIMIT 1", (river_name,))
-            row = cursor.fetchone()
-            conn.close()
-            if not row:
+            station_name = self._first_station(river_name)
+            if not station_name:
                 print(f"错误: 未找到 {river_name} 的数据!")
                 return
-            station_name = row[0]
             data = self.get_data_by_river_and_station(river_name, station_name)
             title = f'{river_name} - {station_name} 流量变化曲线'
 
@@ -260,6 +1089,7 @@ class RiverDataAnalyzer:
         flows = [item[2] for item in data]
 
         # 创建图表
+        plt, mdates = _pyplot()
         plt.figure(figsize=(12, 6))
         plt.plot(dates, flows, '-g', linewidth=1)
         plt.scatter(dates, flows, s=10, c='purple')
@@ -294,15 +1124,10 @@ class RiverDataAnalyzer:
             title = f'{river_name} - {station_name} 水位与流量变化曲线'
         else:
             # 如果未指定站点，获取该河流的第一个站点
-            conn = self._get_connection()
-            cursor = conn.cursor()
-            cursor.execute("SELECT station_name FROM river_data WHERE river_name=? LIMIT 1", (river_name,))
-            row = cursor.fetchone()
-            conn.close()
-            if not row:
+            station_name = self._first_station(river_name)
+            if not station_name:
                 print(f"错误: 未找到 {river_name} 的数据!")
                 return
-            station_name = row[0]
             data = self.get_data_by_river_and_station(river_name, station_name)
             title = f'{river_name} - {station_name} 水位与流量变化曲线'
 
@@ -312,6 +1137,7 @@ class RiverDataAnalyzer:
         flows = [item[2] for item in data]
 
         # 创建图表和轴
+        plt, mdates = _pyplot()
         fig, ax1 = plt.subplots(figsize=(12, 6))
 
         # 绘制水位曲线
@@ -355,112 +1181,164 @@ class RiverDataAnalyzer:
         :param station_name: 站点名称
         :param years: 分析的年数
         :return: 包含分析结果的字典
+
+        直接读取汇总表：窗口内的完整月份用月度汇总，窗口起点所在月份从观测表现算，
+        年际变化用年度汇总，耗时只与周期数有关，与历史长度无关。
         """
-        from datetime import timedelta  # 确保导入timedelta
-        
-        # 获取数据
-        data = self.get_data_by_river_and_station(river_name, station_name)
-        if not data:
-            return {'error': f'未找到 {river_name} - {station_name} 的数据'}
-            
-        # 过滤掉无效数据
-        valid_data = [
-            (date, z, q) for date, z, q in data
-            if z > 0 and q > 0  # 确保水位和流量为正数
-        ]
-        
-        if not valid_data:
-            return {'error': '没有有效数据'}
-            
-        # 计算日期范围
-        end_date = max(date for date, _, _ in valid_data)
-        start_date = end_date - timedelta(days=365*years)
-        
-        # 季节定义
-        seasons = {
-            "春季": (3, 5),
-            "夏季": (6, 8),
-            "秋季": (9, 11),
-            "冬季": (12, 2)
-        }
-        
-        # 按年份和季节分组
-        seasonal_data = {season: [] for season in seasons}
-        
-        for date, z, q in valid_data:
-            if date < start_date:
-                continue
-                
-            month = date.month
-            for season, (start_month, end_month) in seasons.items():
-                # 冬季跨年处理
-                if season == "冬季":
-                    if month == 12 or month <= 2:
-                        seasonal_data[season].append((date, z, q))
-                elif start_month <= month <= end_month:
-                    seasonal_data[season].append((date, z, q))
-        
-        # 计算每个季节的平均值
-        results = {}
-        for season, data_points in seasonal_data.items():
-            if not data_points:
-                continue
-                
-            avg_z = sum(z for _, z, _ in data_points) / len(data_points)
-            avg_q = sum(q for _, _, q in data_points) / len(data_points)
-            results[season] = {
-                'avg_level': round(avg_z, 2),
-                'avg_flow': round(avg_q, 2)
-            }
-        
-        # 构建返回结果
-        analysis_result = {
+        not_found = {'error': f'未找到 {river_name} - {station_name} 的数据'}
+        with self.db.reader() as conn:
+            station_id = self._lookup_station_id(conn, river_name, station_name)
+            if station_id is None:
+                return not_found
+            rows = conn.execute(
+                "SELECT grain, period, n, z_sum, q_sum, last_date_int FROM rollups "
+                "WHERE station_id=? AND grain IN ('month', 'year') ORDER BY grain, period",
+                (station_id,)
+            ).fetchall()
+            month_rows = [row[1:] for row in rows if row[0] == 'month']
+            year_rows = [row[1:5] for row in rows if row[0] == 'year']
+            if not month_rows:
+                has_data = conn.execute('SELECT 1 FROM observations WHERE station_id=? LIMIT 1', (station_id,)).fetchone()
+                return {'error': '没有有效数据'} if has_data else not_found
+
+            end_date = int_to_datetime(max(row[4] for row in month_rows))
+            start_date = end_date - timedelta(days=365 * years)
+            start_int = int(start_date.strftime('%Y%m%d'))
+            start_month = start_int // 100
+            partial = conn.execute(
+                'SELECT COUNT(*), SUM(z_value), SUM(q_value) FROM observations '
+                'WHERE station_id=? AND date_int BETWEEN ? AND ? AND z_value > 0 AND q_value > 0',
+                (station_id, start_int, start_month * 100 + 31)
+            ).fetchone()
+
+        season_sums = [[0, 0.0, 0.0] for _ in SEASONS]
+        for period, n, z_sum, q_sum in [(start_month,) + partial] + [row[:4] for row in month_rows if row[0] > start_month]:
+            if n:
+                totals = season_sums[SEASON_OF_MONTH[period % 100]]
+                totals[0] += n
+                totals[1] += z_sum
+                totals[2] += q_sum
+        return trend_result(river_name, station_name, years, start_date.strftime('%Y-%m-%d'),
+                            end_date.strftime('%Y-%m-%d'), sum(row[1] for row in year_rows),
+                            season_sums, year_rows)
+
+    def analyze_river_seasonal_trends(self, river_name, station_names=None, years=3):
+        """
+        批量分析一条河流多个站点的季节性趋势
+        :param station_names: 站点名称列表，为空时分析该河流的全部站点
+        :return: {'river_name', 'years', 'stations': {站点名称: 单站分析结果}}
+        """
+        if not station_names:
+            station_names = self.get_stations_by_river(river_name)
+        return {
             'river_name': river_name,
-            'station_name': station_name,
             'years': years,
-            'start_date': start_date.strftime('%Y-%m-%d'),
-            'end_date': end_date.strftime('%Y-%m-%d'),
-            'valid_data_count': len(valid_data),
-            'seasonal_data': results,
-            'yearly_trends': []
+            'stations': {name: self.analyze_seasonal_trends(river_name, name, years) for name in station_names},
         }
-        
-        # 分析年际变化
-        if years >= 2:
-            yearly_data = {}
-            for date, z, q in valid_data:
-                year = date.year
-                if year not in yearly_data:
-                    yearly_data[year] = []
-                yearly_data[year].append((z, q))
-                
-            prev_avg_z = None
-            prev_avg_q = None
-            for year in sorted(yearly_data.keys()):
-                data_points = yearly_data[year]
-                avg_z = sum(z for z, _ in data_points) / len(data_points)
-                avg_q = sum(q for _, q in data_points) / len(data_points)
-                
-                trend = {
-                    'year': year,
-                    'avg_level': round(avg_z, 2),
-                    'avg_flow': round(avg_q, 2)
-                }
-                
-                if prev_avg_z is not None:
-                    z_diff = avg_z - prev_avg_z
-                    z_pct = (z_diff / prev_avg_z) * 100 if prev_avg_z != 0 else 0
-                    trend['level_change'] = f"{z_diff:+.2f}({z_pct:+.1f}%)"
-                    
-                    q_diff = avg_q - prev_avg_q
-                    q_pct = (q_diff / prev_avg_q) * 100 if prev_avg_q != 0 else 0
-                    trend['flow_change'] = f"{q_diff:+.2f}({q_pct:+.1f}%)"
-                
-                analysis_result['yearly_trends'].append(trend)
-                prev_avg_z = avg_z
-                prev_avg_q = avg_q
-        
-        return analysis_result
+
+    def compare_stations(self, river_name, station_names=None, start_date=None, end_date=None,
+                         max_lag=10, reference=None):
+        """
+        比较同一条河流的多个站点：把各站点对齐到逐日网格上，一次性以矩阵运算求
+        - 水位、流量的两两相关系数（逐对只用两站同时有数据的日期）
+        - 流量的滞后互相关：每对站点相关系数最大的滞后天数（上游 → 下游的传播时间）
+        - 各站点与参考站点的水位差、流量差序列
+        :param station_names: 站点名称列表，为空时比较该河流的全部站点
+        :param max_lag: 滞后互相关的最大滞后天数
+        :param reference: 差值序列的参考站点，默认第一个站点
+        :return: 分析结果字典；站点不足两个时返回 {'error': ...}
+        """
+        if not station_names:
+            station_names = self.get_stations_by_river(river_name)
+        dates, aligned = self.get_aligned_series([(river_name, name) for name in station_names],
+                                                 start_date, end_date)
+        names = [name for name in station_names if (river_name, name) in aligned]
+        if len(names) < 2 or not len(dates):
+            return {'error': f'{river_name} 可比较的站点不足两个'}
+        reference = reference if reference in names else names[0]
+
+        # 共同日期轴 -> 连续的逐日网格，滞后按天计算
+        grid = np.arange(dates[0], dates[-1] + np.timedelta64(1, 'D'), dtype='datetime64[D]')
+        rows = (dates - dates[0]).astype(np.int64)
+        levels = np.full((len(grid), len(names)), np.nan)
+        flows = np.full((len(grid), len(names)), np.nan)
+        for col, name in enumerate(names):
+            levels[rows, col], flows[rows, col] = aligned[(river_name, name)]
+
+        level_r, overlap = pairwise_correlation(levels, levels)
+        flow_r, _ = pairwise_correlation(flows, flows)
+        lags, lag_r = lagged_correlation(flows, max_lag)
+        # 全为 NaN 的站点对没有最佳滞后
+        valid = ~np.all(np.isnan(lag_r), axis=0)
+        best = np.argmax(np.where(np.isnan(lag_r), -np.inf, lag_r), axis=0)
+        best_lag = np.where(valid, lags[best], np.nan)
+        best_r = np.where(valid, np.take_along_axis(lag_r, best[None], axis=0)[0], np.nan)
+
+        ref = names.index(reference)
+        level_diff = levels - levels[:, [ref]]
+        flow_diff = flows - flows[:, [ref]]
+
+        return {
+            'river_name': river_name,
+            'stations': names,
+            'start_date': str(grid[0]),
+            'end_date': str(grid[-1]),
+            'overlap_days': overlap.tolist(),
+            'level_correlation': _matrix(level_r),
+            'flow_correlation': _matrix(flow_r),
+            'flow_lag': {
+                'max_lag': int(lags[-1]),
+                # lag_days[i][j] > 0：站点 j 的流量变化比站点 i 晚这么多天
+                'lag_days': [[None if v != v else int(v) for v in row] for row in best_lag],
+                'correlation': _matrix(best_r),
+            },
+            'reference': reference,
+            'dates': days_to_strings(grid),
+            'level_difference': {name: _column(level_diff[:, i]) for i, name in enumerate(names)},
+            'flow_difference': {name: _column(flow_diff[:, i]) for i, name in enumerate(names)},
+        }
+
+    def get_anomalies(self, river_name=None, station_name=None, start_date=None, end_date=None,
+                      variable=None, kind=None, limit=200):
+        """查询入库时检测出的异常（直接读 anomalies 表，不扫描历史数据），新的在前
+
+        :param river_name: 河流名称，为空时查询全部河流
+        :param station_name: 站点名称，为空时查询河流的全部站点
+        :return: [{'river_name', 'station_name', 'date', 'variable', 'kind', 'value', 'expected', 'score'}]
+        """
+        lo = date_to_int(start_date) if start_date else 0
+        hi = date_to_int(end_date) if end_date else 99999999
+        with self.db.reader() as conn:
+            station_ids = None
+            if river_name:
+                if station_name:
+                    station_id = self._lookup_station_id(conn, river_name, station_name)
+                    station_ids = [] if station_id is None else [station_id]
+                else:
+                    station_ids = [row[0] for row in conn.execute(
+                        'SELECT s.id FROM stations s JOIN rivers r ON r.id = s.river_id WHERE r.name=?', (river_name,))]
+                if not station_ids:
+                    return []
+            rows = self.anomaly_detector.query(conn, station_ids, lo, hi, variable, kind, limit)
+        return [{
+            'river_name': river, 'station_name': station,
+            'date': int_to_datetime(date_int).strftime('%Y-%m-%d'),
+            'variable': var, 'kind': anomaly_kind, 'value': value,
+            'expected': None if expected is None else round(expected, 4),
+            'score': None if score is None else round(score, 4),
+        } for river, station, date_int, var, anomaly_kind, value, expected, score in rows]
+
+    def rebuild_anomalies(self):
+        """按当前阈值配置重放全部观测，重建异常记录（修改阈值后使用），返回异常数"""
+        with self.db.writer() as conn:
+            conn.execute('BEGIN')
+            try:
+                count = self.anomaly_detector.rebuild(conn)
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+        return count
 
     def interactive_analysis(self):
         """交互式数据分析"""
@@ -589,14 +1467,45 @@ if __name__ == '__main__':
     
     parser = argparse.ArgumentParser(description='河流数据分析工具')
     parser.add_argument('--init-db', action='store_true', help='初始化数据库')
+    parser.add_argument('--rebuild-db', action='store_true', help='清空并从归档全量重建数据库')
+    parser.add_argument('--rebuild-anomalies', action='store_true', help='按当前阈值配置重建异常记录')
+    parser.add_argument('--workers', type=int, default=None, help='导入时的解析进程数（默认读取 IMPORT_WORKERS，0 表示全部 CPU 核）')
     
     args = parser.parse_args()
     
     if args.init_db:
         # 初始化数据库
-        analyzer = RiverDataAnalyzer()
-        analyzer.init_database()
+        from config import get_config
+        config = get_config()
+        analyzer = RiverDataAnalyzer(data_dir=config.data_dir, db_path=config.db_path,
+                                     anomaly_thresholds=config.anomaly_thresholds,
+                                     anomaly_window_days=config.anomaly_window_days,
+                                     anomaly_zscore=config.anomaly_zscore)
         print("数据库初始化完成")
+    elif args.rebuild_db:
+        # 全量重建数据库
+        import time
+        from config import get_config
+        logging.basicConfig(level=logging.INFO)
+        config = get_config()
+        analyzer = RiverDataAnalyzer(data_dir=config.data_dir, db_path=config.db_path,
+                                     import_workers=config.import_workers,
+                                     anomaly_thresholds=config.anomaly_thresholds,
+                                     anomaly_window_days=config.anomaly_window_days,
+                                     anomaly_zscore=config.anomaly_zscore)
+        started = time.time()
+        rows = analyzer.rebuild_database(workers=args.workers)
+        print(f"数据库重建完成：导入 {rows} 行，耗时 {time.time() - started:.1f} 秒")
+    elif args.rebuild_anomalies:
+        # 修改阈值配置后重建异常记录
+        from config import get_config
+        config = get_config()
+        analyzer = RiverDataAnalyzer(data_dir=config.data_dir, db_path=config.db_path,
+                                     anomaly_thresholds=config.anomaly_thresholds,
+                                     anomaly_window_days=config.anomaly_window_days,
+                                     anomaly_zscore=config.anomaly_zscore)
+        count = analyzer.rebuild_anomalies()
+        print(f"异常记录重建完成：共 {count} 条")
     else:
         # 默认行为：交互式分析
         logging.basicConfig(level=logging.INFO)
@@ -0,0 +1,185 @@
+import math
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 滚动统计状态：每个站点、每个变量（z 水位 / q 流量）一行指数加权均值和方差，
+#   base_* 为计入 last_date_int 这一天之前的统计，这一天被重新入库（更正）时据此回退后重算
+# 异常记录：kind 为 zscore（偏离滚动均值）、above_max / below_min（超出站点阈值）
+#   expected 为滚动均值或阈值，score 为 z 分数或超出阈值的量
+ANOMALY_DDL = [
+    """
+    CREATE TABLE IF NOT EXISTS anomaly_state (
+        station_id INTEGER NOT NULL,
+        variable TEXT NOT NULL,
+        last_date_int INTEGER NOT NULL,
+        n INTEGER NOT NULL,
+        mean REAL NOT NULL,
+        var REAL NOT NULL,
+        base_n INTEGER NOT NULL,
+        base_mean REAL NOT NULL,
+        base_var REAL NOT NULL,
+        PRIMARY KEY (station_id, variable)
+    ) WITHOUT ROWID
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS anomalies (
+        station_id INTEGER NOT NULL,
+        date_int INTEGER NOT NULL,
+        variable TEXT NOT NULL,
+        kind TEXT NOT NULL,
+        value REAL NOT NULL,
+        expected REAL,
+        score REAL,
+        PRIMARY KEY (station_id, date_int, variable, kind)
+    ) WITHOUT ROWID
+    """,
+]
+
+VARIABLES = ('z', 'q')
+KINDS = ('zscore', 'above_max', 'below_min')
+# 滚动统计至少积累这么多个样本后才做 z 分数判断
+MIN_SAMPLES = 10
+
+STATE_COLUMNS = 'station_id, variable, last_date_int, n, mean, var, base_n, base_mean, base_var'
+STATE_UPSERT_SQL = f'INSERT OR REPLACE INTO anomaly_state ({STATE_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)'
+ANOMALY_INSERT_SQL = 'INSERT OR REPLACE INTO anomalies VALUES (?, ?, ?, ?, ?, ?, ?)'
+# 与观测表一样逐站点按主键定位某一天
+DAY_ROWS_SQL = 'SELECT station_id, z_value, q_value FROM observations WHERE station_id IN (SELECT id FROM stations) AND date_int=?'
+DELETE_DAY_SQL = 'DELETE FROM anomalies WHERE station_id IN (SELECT id FROM stations) AND date_int=?'
+
+
+def _get_limit(limits, key):
+    value = limits.get(key)
+    return None if value is None else float(value)
+
+
+class AnomalyDetector:
+    """入库时的流式异常检测。
+
+    每个站点的水位、流量各维护一份指数加权滚动均值/方差（窗口约 window_days 个样本），
+    新的一天入库时每条观测先与滚动统计和站点阈值比较，再以 O(1) 更新统计，结果写入 anomalies 表。
+    重新入库最近一天时先回退到这一天之前的统计再重算；更早日期的观测（补下载、更正）只做判断、
+    不更新滚动统计，需要按日期顺序精确重算时调用 rebuild()。
+
+    阈值配置（ANOMALY_THRESHOLDS_JSON）的键为 "河流" 或 "河流/站点"，站点覆盖河流，河流覆盖全局默认：
+        {"永定河": {"zscore": 5}, "永定河/三家店": {"z_max": 110.5, "q_max": 800}}
+    可用字段：zscore（0 关闭 z 分数判断）、z_min、z_max、q_min、q_max。
+    """
+
+    def __init__(self, thresholds=None, window_days: float = 30, zscore: float = 4.0):
+        self.alpha = 2.0 / (max(window_days, 1) + 1)
+        self.defaults = {'zscore': zscore}
+        self.thresholds = {}
+        for key, limits in (thresholds or {}).items():
+            if isinstance(limits, dict):
+                self.thresholds[key] = limits
+            else:
+                logger.warning(f"忽略无效的异常阈值配置 {key}: {limits!r}")
+
+    def limits_for(self, river_name, station_name) -> dict:
+        return {**self.defaults, **self.thresholds.get(river_name, {}),
+                **self.thresholds.get(f'{river_name}/{station_name}', {})}
+
+    def _station_limits(self, conn):
+        """站点 id -> 阈值；没有按河流/站点配置时所有站点都用默认值（返回 None）"""
+        if not self.thresholds:
+            return None
+        rows = conn.execute('SELECT s.id, r.name, s.name FROM stations s JOIN rivers r ON r.id = s.river_id')
+        return {station_id: self.limits_for(river, station) for station_id, river, station in rows}
+
+    def _scan(self, rows, state, station_limits, dirty, found):
+        """按日期顺序处理观测 (station_id, date_int, z, q)：判断异常并更新滚动统计
+
+        :param state: {(station_id, variable): [last_date_int, n, mean, var, base_n, base_mean, base_var]}，原地更新
+        :param dirty: 收集更新过的状态键
+        :param found: 收集异常记录
+        """
+        alpha = self.alpha
+        for station_id, date_int, z, q in rows:
+            limits = self.defaults if station_limits is None else station_limits.get(station_id, self.defaults)
+            for variable, value in (('z', z), ('q', q)):
+                # 与汇总统计一致，非正数视为缺测
+                if value is None or value <= 0:
+                    continue
+                key = (station_id, variable)
+                st = state.get(key)
+                if st is None:
+                    st = state[key] = [date_int, 0, 0.0, 0.0, 0, 0.0, 0.0]
+                elif date_int == st[0]:
+                    # 最近一天被重新入库：回退到这一天之前的统计
+                    st[1:4] = st[4:7]
+                n, mean, var = st[1:4]
+
+                if n >= MIN_SAMPLES and var > 0 and limits.get('zscore'):
+                    score = (value - mean) / math.sqrt(var)
+                    if abs(score) >= float(limits['zscore']):
+                        found.append((station_id, date_int, variable, 'zscore', value, mean, score))
+                upper = _get_limit(limits, variable + '_max')
+                if upper is not None and value > upper:
+                    found.append((station_id, date_int, variable, 'above_max', value, upper, value - upper))
+                lower = _get_limit(limits, variable + '_min')
+                if lower is not None and value < lower:
+                    found.append((station_id, date_int, variable, 'below_min', value, lower, value - lower))
+
+                if date_int < st[0]:
+                    continue
+                # 指数加权均值/方差的增量更新
+                st[4:7] = n, mean, var
+                if n == 0:
+                    mean, var = value, 0.0
+                else:
+                    diff = value - mean
+                    incr = alpha * diff
+                    mean += incr
+                    var = (1 - alpha) * (var + diff * incr)
+                st[0:4] = date_int, n + 1, mean, var
+                dirty.add(key)
+
+    def update(self, conn, date_ints):
+        """检测整体替换过的日期（在写入事务内、新数据写入后调用），返回新发现的异常数"""
+        state = {(row[0], row[1]): list(row[2:]) for row in conn.execute(f'SELECT {STATE_COLUMNS} FROM anomaly_state')}
+        station_limits = self._station_limits(conn)
+        dirty, found = set(), []
+        for date_int in sorted(date_ints):
+            conn.execute(DELETE_DAY_SQL, (date_int,))
+            rows = conn.execute(DAY_ROWS_SQL, (date_int,)).fetchall()
+            self._scan(((station_id, date_int, z, q) for station_id, z, q in rows),
+                       state, station_limits, dirty, found)
+        conn.executemany(STATE_UPSERT_SQL, [(*key, *state[key]) for key in dirty])
+        conn.executemany(ANOMALY_INSERT_SQL, found)
+        return len(found)
+
+    def rebuild(self, conn):
+        """按日期顺序重放全部观测，重建滚动统计和异常记录（在写入事务内调用），返回异常数"""
+        conn.execute('DELETE FROM anomaly_state')
+        conn.execute('DELETE FROM anomalies')
+        state, dirty, found = {}, set(), []
+        rows = conn.execute('SELECT station_id, date_int, z_value, q_value FROM observations ORDER BY station_id, date_int')
+        self._scan(rows, state, self._station_limits(conn), dirty, found)
+        conn.executemany(STATE_UPSERT_SQL, [(*key, *value) for key, value in state.items()])
+        conn.executemany(ANOMALY_INSERT_SQL, found)
+        return len(found)
+
+    def query(self, conn, station_ids=None, lo=0, hi=99999999, variable=None, kind=None, limit=200) -> list:
+        """按站点、日期范围查询异常记录（新的在前），返回
+        [(河流, 站点, date_int, variable, kind, value, expected, score)]
+        """
+        if station_ids is None:
+            where, params = 'a.station_id IN (SELECT id FROM stations)', []
+        else:
+            where, params = f"a.station_id IN ({', '.join('?' * len(station_ids))})", list(station_ids)
+        where += ' AND a.date_int BETWEEN ? AND ?'
+        params += [lo, hi]
+        if variable:
+            where += ' AND a.variable = ?'
+            params.append(variable)
+        if kind:
+            where += ' AND a.kind = ?'
+            params.append(kind)
+        return conn.execute(
+            'SELECT r.name, s.name, a.date_int, a.variable, a.kind, a.value, a.expected, a.score '
+            'FROM anomalies a JOIN stations s ON s.id = a.station_id JOIN rivers r ON r.id = s.river_id '
+            f'WHERE {where} ORDER BY a.date_int DESC, r.name, s.name LIMIT ?',
+            (*params, limit)
+        ).fetchall()
@@ -1,72 +1,47 @@
 import os
 import json
+import time
 import logging
+import threading
 from datetime import datetime
-import matplotlib
-matplotlib.use('Agg')
 
 from flask import Flask, render_template, jsonify, request
 from logging.handlers import RotatingFileHandler
 
-# 验证宋体可用性
-from matplotlib import font_manager
-try:
-    songti_path = font_manager.findfont('Songti SC')
-    print(f"成功找到宋体路径: {songti_path}")
-except Exception as e:
-    print(f"宋体加载失败: {str(e)}")
-
-import matplotlib.pyplot as plt
-import matplotlib.dates as mdates
-from matplotlib.font_manager import FontProperties
-import io
 import base64
 import hashlib
-import time
 
 from config import get_config
-from request_river_data import sync_to_latest
+from request_river_data import sync_into
 
 # 导入现有的RiverDataAnalyzer类
 from analyze_river_data import RiverDataAnalyzer
+from series_store import downsample, days_to_strings, pack_series, SERIES_MIMETYPE
+from result_cache import ResultCache
+from plot_render import PlotRenderer, RenderTimeout, PLOT_FORMATS
+from sync_scheduler import SyncScheduler, FileLock
+from sync_jobs import SyncJobs
+from anomaly_detector import VARIABLES as ANOMALY_VARIABLES, KINDS as ANOMALY_KINDS
 
 # 创建Flask应用
 app = Flask(__name__)
 
-# 确保使用系统宋体（直接指定字体族）
-plt.rcParams['font.sans-serif'] = ['Songti SC', 'STSong', 'SimSun', 'Microsoft YaHei', 'SimHei']
-plt.rcParams['font.family'] = 'sans-serif'
-plt.rcParams['axes.unicode_minus'] = False  # 解决负号显示问题
-print("✅ 已配置中文字体: Songti SC, STSong, SimSun")
-
 config = get_config()
 
-# 启动时确保数据已同步至当天
-try:
-    sync_to_latest(refresh_cookie_on_fail=True)
-except Exception:
-    pass
+# 初始化数据分析器（只打开数据库，导入和同步见下方的启动预热）
+analyzer = RiverDataAnalyzer(data_dir=config.data_dir, db_path=config.db_path,
+                             import_workers=config.import_workers,
+                             read_pool_size=config.db_read_pool_size, mmap_size_mb=config.db_mmap_mb,
+                             cache_size_mb=config.db_cache_mb, series_cache_mb=config.series_cache_mb,
+                             anomaly_thresholds=config.anomaly_thresholds,
+                             anomaly_window_days=config.anomaly_window_days, anomaly_zscore=config.anomaly_zscore)
 
-# 初始化数据分析器并加载数据
-analyzer = RiverDataAnalyzer(data_dir=config.data_dir, db_path=config.db_path)
-analyzer.load_data()
+# 各 worker 共享的结果缓存：键中带数据代数，新数据入库后立即失效；按字节数 LRU 淘汰
+result_cache = ResultCache(config.result_cache_path, config.result_cache_mb * 1024 * 1024,
+                           ttl_seconds=config.cache_ttl_seconds)
 
-# 简单TTL缓存
-_CACHE = {}
-
-def _cache_get(key):
-    item = _CACHE.get(key)
-    if not item:
-        return None
-    expire_ts, value = item
-    if expire_ts < time.time():
-        _CACHE.pop(key, None)
-        return None
-    return value
-
-def _cache_set(key, value, ttl_sec=None):
-    ttl = ttl_sec if ttl_sec is not None else config.cache_ttl_seconds
-    _CACHE[key] = (time.time() + ttl, value)
+# 图表渲染进程池：绘图不占用 Web 进程，慢图表超时后返回 503，不拖住其他接口
+plot_renderer = PlotRenderer(workers=config.plot_workers, timeout=config.plot_timeout_seconds)
 
 # 配置日志
 log_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'logs')
@@ -99,6 +74,100 @@ root_logger.addHandler(console_handler)
 # 创建应用日志器
 logger = logging.getLogger(__name__)
 
+def _run_sync(on_progress=None):
+    # 每天的响应到达后直接入库，无需再扫描数据目录
+    # 写入的归档随即登记到导入台账；没能直接入库的日期在同步结束时从归档增量补入
+    return sync_into(analyzer, refresh_cookie_on_fail=True, on_progress=on_progress)
+
+# 定时同步：各 worker 通过文件锁选出一个 leader 负责同步（启动时先同步一次），
+# 其他 worker 定期按数据代数刷新河流目录和缓存
+sync_scheduler = SyncScheduler(_run_sync, config.db_path, interval_minutes=config.sync_interval_minutes,
+                               anchor=config.sync_at, poll_seconds=config.sync_poll_seconds,
+                               on_poll=analyzer.refresh)
+
+# /sync_now 提交的后台同步任务：进度保存在数据库中，任何 worker 都能查询；与定时同步共用同步锁
+sync_jobs = SyncJobs(analyzer.db, lambda on_progress: sync_scheduler.run_now(on_progress=on_progress))
+
+# 启动预热：导入归档中尚未入库的数据，然后启动定时同步。
+# FAST_START 开启时在每个 worker 的后台线程中执行（gunicorn fork 后由 gunicorn.conf.py 启动，
+# 第一个请求和 __main__ 也会兜底启动），进程导入后立即可以响应请求，已入库的数据照常可查；
+# 关闭时在导入阶段同步执行。
+WARMUP_LOCK_PATH = config.db_path + '.warmup.lock'
+warmup_status = {'state': 'pending', 'error': None, 'started_at': None, 'ready_at': None, 'pid': None}
+_warmup_lock = threading.Lock()
+
+def _run_warmup():
+    # 导入本地归档：各 worker 依次进行，后进入的 worker 按导入台账发现已无新文件
+    try:
+        with FileLock(WARMUP_LOCK_PATH):
+            analyzer.load_data()
+    except Exception as e:
+        logger.exception('预热导入数据失败')
+        warmup_status.update(state='failed', error=str(e))
+        return
+    warmup_status.update(state='ready', ready_at=time.time())
+    logger.info(f"预热完成，耗时 {warmup_status['ready_at'] - warmup_status['started_at']:.2f} 秒")
+
+def start_warmup(background=True):
+    """在当前进程启动预热和定时同步（每个进程只执行一次）"""
+    pid = os.getpid()
+    if warmup_status['pid'] == pid:
+        return
+    with _warmup_lock:
+        if warmup_status['pid'] == pid:
+            return
+        warmup_status['pid'] = pid
+        # FAST_START=0 时数据已在 fork 前的主进程中导入
+        imported = warmup_status['state'] == 'ready'
+        if not imported:
+            warmup_status.update(state='warming', started_at=time.time())
+    if not imported:
+        if background:
+            threading.Thread(target=_run_warmup, name='warmup', daemon=True).start()
+        else:
+            _run_warmup()
+    sync_scheduler.start()
+
+if not config.fast_start:
+    # 在导入阶段阻塞完成数据导入和一次同步；定时同步仍由各 worker 启动
+    warmup_status['started_at'] = time.time()
+    _run_warmup()
+    try:
+        sync_scheduler.run_now()
+    except Exception as e:
+        logger.warning(f"启动同步失败: {e}")
+
+@app.before_request
+def _ensure_warmup():
+    # 未通过 gunicorn.conf.py 启动时（例如其他 WSGI 服务器），由第一个请求启动预热
+    start_warmup()
+
+def _parse_date_range(start_date_str, end_date_str):
+    """校验日期输入，返回 (错误响应或 None)"""
+    try:
+        start_date = datetime.strptime(start_date_str, '%Y-%m-%d') if start_date_str else None
+        end_date = datetime.strptime(end_date_str, '%Y-%m-%d') if end_date_str else None
+    except ValueError:
+        return jsonify({'error': '日期格式无效，应为 YYYY-MM-DD'}), 400
+    if start_date and end_date and start_date > end_date:
+        return jsonify({'error': '开始日期不能晚于结束日期'}), 400
+    return None
+
+# /plot 未指定 max_points 时的点数上限（图片宽约 1200 像素，再多的点也画不出来）
+PLOT_MAX_POINTS = 2000
+
+def _parse_max_points(value, default=None):
+    """校验 max_points，返回 (点数上限或 None, 错误响应或 None)"""
+    if value in (None, ''):
+        return default, None
+    try:
+        max_points = int(value)
+    except (TypeError, ValueError):
+        max_points = 0
+    if max_points < 10:
+        return None, (jsonify({'error': 'max_points 应为不小于 10 的整数'}), 400)
+    return max_points, None
+
 @app.route('/')
 def index():
     # 获取所有河流名称
@@ -111,6 +180,11 @@ def get_stations():
     stations = analyzer.get_stations_by_river(river_name)
     return jsonify(stations)
 
+def _render_plot(river_name, station_name, plot_type, dates, levels, flows, fmt='png'):
+    """在渲染进程池中绘制水文图表，返回图片字节；超时抛出 RenderTimeout"""
+    return plot_renderer.render(f'{river_name} - {station_name} 水文数据', plot_type,
+                                dates, levels, flows, fmt)
+
 @app.route('/plot', methods=['POST'])
 def plot():
     river_name = request.json.get('river_name')
@@ -118,152 +192,328 @@ def plot():
     plot_type = request.json.get('plot_type', 'level')  # 'level', 'flow', or 'both'
     start_date_str = request.json.get('start_date')
     end_date_str = request.json.get('end_date')
+    max_points, error = _parse_max_points(request.json.get('max_points'), PLOT_MAX_POINTS)
+    if error:
+        return error
 
     # 缓存键
+    generation = analyzer.data_generation()
     key_src = json.dumps({
         'r': river_name, 's': station_name, 't': plot_type,
-        'start': start_date_str, 'end': end_date_str
+        'start': start_date_str, 'end': end_date_str, 'n': max_points, 'g': generation
     }, sort_keys=True)
     key = 'plot:' + hashlib.md5(key_src.encode('utf-8')).hexdigest()
-    cached = _cache_get(key)
+    cached = result_cache.get(key)
     if cached:
-        return jsonify({'image': cached})
-
-    # 获取数据
-    data = analyzer.get_data_by_river_and_station(river_name, station_name)
-    if not data:
-        return jsonify({'error': '未找到数据'}), 400
-
-    # 解析日期和过滤数据
-    dates = []
-    levels = []
-    flows = []
+        return jsonify(cached)
 
     # 校验日期输入
-    start_date = None
-    end_date = None
-    try:
-        if start_date_str:
-            start_date = datetime.strptime(start_date_str, '%Y-%m-%d')
-        if end_date_str:
-            end_date = datetime.strptime(end_date_str, '%Y-%m-%d')
-        if start_date and end_date and start_date > end_date:
-            return jsonify({'error': '开始日期不能晚于结束日期'}), 400
-    except ValueError:
-        return jsonify({'error': '日期格式无效，应为 YYYY-MM-DD'}), 400
-
-    for item in data:
-        date = item[0]
-        if start_date and date < start_date:
-            continue
-        if end_date and date > end_date:
-            continue
-        dates.append(date)
-        levels.append(item[1])
-        flows.append(item[2])
-
-    # 创建图表
-    fig, ax = plt.subplots(figsize=(12, 6))
-
-    if plot_type == 'level' or plot_type == 'both':
-        ax.plot(dates, levels, 'b-', label='水位 (m)')
-        ax.set_ylabel('水位 (m)', color='b')
-        ax.tick_params('y', colors='b')
-
-    if plot_type == 'flow' or plot_type == 'both':
-        if plot_type == 'both':
-            ax2 = ax.twinx()
-            ax2.plot(dates, flows, 'r-', label='流量 (m³/s)')
-            ax2.set_ylabel('流量 (m³/s)', color='r')
-            ax2.tick_params('y', colors='r')
-            lines = ax.get_lines() + ax2.get_lines()
-            labels = [line.get_label() for line in lines]
-            ax.legend(lines, labels, loc='upper right')
-        else:
-            ax.plot(dates, flows, 'r-', label='流量 (m³/s)')
-            ax.set_ylabel('流量 (m³/s)', color='r')
-            ax.tick_params('y', colors='r')
-            ax.legend()
-
-    ax.set_xlabel('日期')
-    ax.set_title(f'{river_name} - {station_name} 水文数据')
-    ax.grid(True)
+    error = _parse_date_range(start_date_str, end_date_str)
+    if error:
+        return error
 
-    # 设置日期格式
-    ax.xaxis.set_major_formatter(mdates.DateFormatter('%Y-%m-%d'))
-    fig.autofmt_xdate()
+    # 获取数据（内存列式缓存 + 二分查找日期范围）
+    series = analyzer.get_series_arrays(river_name, station_name, start_date_str, end_date_str)
+    if series is None:
+        return jsonify({'error': '未找到数据'}), 400
+    dates, levels, flows, downsampled = downsample(*series, max_points)
 
     # 将图表转换为base64编码
-    buf = io.BytesIO()
-    plt.savefig(buf, format='png', bbox_inches='tight')
-    buf.seek(0)
-    image_base64 = base64.b64encode(buf.getvalue()).decode('utf-8')
-    plt.close(fig)
+    try:
+        image = _render_plot(river_name, station_name, plot_type, dates, levels, flows)
+    except RenderTimeout:
+        return jsonify({'error': '图表生成超时，请缩小日期范围后重试'}), 503
+    image_base64 = base64.b64encode(image).decode('utf-8')
+
+    resp = {'image': image_base64, 'downsampled': downsampled, 'total_points': len(series[0])}
+    result_cache.set(key, resp, generation)
+    return jsonify(resp)
 
-    _cache_set(key, image_base64)
-    return jsonify({'image': image_base64})
+@app.route('/plot_image')
+def plot_image():
+    """图表图片（GET，参数同 /plot，另有 format=png|svg），可被浏览器和代理缓存
+
+    ETag 由数据代数和请求参数生成；数据没有变化时重新验证直接返回 304，不查询也不绘图。
+    """
+    river_name = request.args.get('river_name')
+    station_name = request.args.get('station_name')
+    plot_type = request.args.get('plot_type', 'level')
+    start_date_str = request.args.get('start_date')
+    end_date_str = request.args.get('end_date')
+    fmt = request.args.get('format', 'png')
+    if fmt not in PLOT_FORMATS:
+        return jsonify({'error': 'format 应为 png 或 svg'}), 400
+    max_points, error = _parse_max_points(request.args.get('max_points'), PLOT_MAX_POINTS)
+    if error:
+        return error
+    error = _parse_date_range(start_date_str, end_date_str)
+    if error:
+        return error
+
+    generation = analyzer.data_generation()
+    key_src = json.dumps({
+        'r': river_name, 's': station_name, 't': plot_type,
+        'start': start_date_str, 'end': end_date_str, 'n': max_points,
+        'f': fmt, 'g': generation
+    }, sort_keys=True)
+    etag = hashlib.md5(key_src.encode('utf-8')).hexdigest()
+    headers = {'Cache-Control': 'public, no-cache'}
+    if etag in request.if_none_match:
+        response = app.response_class(status=304, headers=headers)
+        response.set_etag(etag)
+        return response
+
+    key = 'img:' + etag
+    image = result_cache.get(key)
+    if image is None:
+        series = analyzer.get_series_arrays(river_name, station_name, start_date_str, end_date_str)
+        if series is None:
+            return jsonify({'error': '未找到数据'}), 400
+        dates, levels, flows, _ = downsample(*series, max_points)
+        try:
+            image = _render_plot(river_name, station_name, plot_type, dates, levels, flows, fmt)
+        except RenderTimeout:
+            return jsonify({'error': '图表生成超时，请缩小日期范围后重试'}), 503
+        result_cache.set(key, image, generation)
+
+    response = app.response_class(image, mimetype=PLOT_FORMATS[fmt], headers=headers)
+    response.set_etag(etag)
+    return response
 
 @app.route('/timeseries', methods=['POST'])
 def timeseries():
+    """站点时序。默认返回 JSON；请求头 Accept: application/octet-stream 时返回紧凑的二进制列式格式
+    （格式见 series_store.pack_series），体积和编码开销都远小于 JSON
+    """
     river_name = request.json.get('river_name')
     station_name = request.json.get('station_name')
     start_date_str = request.json.get('start_date')
     end_date_str = request.json.get('end_date')
+    max_points, error = _parse_max_points(request.json.get('max_points'))
+    if error:
+        return error
+    binary = request.accept_mimetypes.best_match(['application/json', SERIES_MIMETYPE]) == SERIES_MIMETYPE
 
     # 缓存键
+    generation = analyzer.data_generation()
     key_src = json.dumps({
         'r': river_name, 's': station_name,
-        'start': start_date_str, 'end': end_date_str
+        'start': start_date_str, 'end': end_date_str, 'n': max_points, 'g': generation
     }, sort_keys=True)
-    key = 'ts:' + hashlib.md5(key_src.encode('utf-8')).hexdigest()
-    cached = _cache_get(key)
+    key = ('tsb:' if binary else 'ts:') + hashlib.md5(key_src.encode('utf-8')).hexdigest()
+    cached = result_cache.get(key)
     if cached:
-        return jsonify(cached)
+        return _timeseries_response(cached, binary)
 
-    data = analyzer.get_data_by_river_and_station(river_name, station_name)
-    if not data:
+    # 日期校验
+    error = _parse_date_range(start_date_str, end_date_str)
+    if error:
+        return error
+
+    series = analyzer.get_series_arrays(river_name, station_name, start_date_str, end_date_str)
+    if series is None:
         return jsonify({'error': '未找到数据'}), 400
+    dates, levels, flows, downsampled = downsample(*series, max_points)
+
+    if binary:
+        resp = pack_series(dates, levels, flows, downsampled, len(series[0]))
+    else:
+        resp = {
+            'river_name': river_name,
+            'station_name': station_name,
+            'dates': days_to_strings(dates),
+            'levels': levels.tolist(),
+            'flows': flows.tolist(),
+            'downsampled': downsampled,
+            'total_points': len(series[0])
+        }
+    result_cache.set(key, resp, generation)
+    return _timeseries_response(resp, binary)
+
+def _timeseries_response(resp, binary):
+    response = app.response_class(resp, mimetype=SERIES_MIMETYPE) if binary else jsonify(resp)
+    response.vary.add('Accept')
+    return response
+
+# /batch_timeseries 一次最多查询的站点数
+BATCH_MAX_STATIONS = 100
+
+def _nan_to_none(values):
+    return [None if v != v else v for v in values.tolist()]
+
+def _valid_station_names(names):
+    """站点名称列表：非空字符串组成的列表，最多 BATCH_MAX_STATIONS 个"""
+    return (isinstance(names, list) and len(names) <= BATCH_MAX_STATIONS
+            and all(isinstance(name, str) and name for name in names))
+
+def _parse_station_pairs(stations):
+    """校验 stations：每项为 {"river_name": ..., "station_name": ...} 或 [河流, 站点]，
+    名称都是非空字符串；返回 [(河流, 站点)]，格式无效时返回 None"""
+    if not isinstance(stations, list):
+        return None
+    pairs = []
+    for item in stations:
+        if isinstance(item, dict):
+            pair = (item.get('river_name'), item.get('station_name'))
+        elif isinstance(item, list) and len(item) == 2:
+            pair = tuple(item)
+        else:
+            return None
+        if not all(isinstance(name, str) and name for name in pair):
+            return None
+        pairs.append(pair)
+    return pairs
+
+@app.route('/batch_timeseries', methods=['POST'])
+def batch_timeseries():
+    """批量时序：多个站点（或整条河流的全部站点）在同一日期范围内的数据，对齐到共同的日期轴
+
+    一次请求代替逐站点调用 /get_stations 和 /timeseries；站点在某天没有数据时值为 null。
+    """
+    stations = request.json.get('stations')
+    river_name = request.json.get('river_name')
+    start_date_str = request.json.get('start_date')
+    end_date_str = request.json.get('end_date')
 
-    # 日期校验
-    start_date = None
-    end_date = None
-    try:
-        if start_date_str:
-            start_date = datetime.strptime(start_date_str, '%Y-%m-%d')
-        if end_date_str:
-            end_date = datetime.strptime(end_date_str, '%Y-%m-%d')
-        if start_date and end_date and start_date > end_date:
-            return jsonify({'error': '开始日期不能晚于结束日期'}), 400
-    except ValueError:
-        return jsonify({'error': '日期格式无效，应为 YYYY-MM-DD'}), 400
+    if stations is not None:
+        pairs = _parse_station_pairs(stations)
+        if pairs is None:
+            return jsonify({'error': 'stations 应为 [{"river_name": ..., "station_name": ...}, ...]'}), 400
+    elif river_name:
+        pairs = [(river_name, station) for station in analyzer.get_stations_by_river(river_name)]
+    else:
+        return jsonify({'error': '请提供 stations 或 river_name'}), 400
+    pairs = list(dict.fromkeys(pairs))
+    if len(pairs) > BATCH_MAX_STATIONS:
+        return jsonify({'error': f'一次最多查询 {BATCH_MAX_STATIONS} 个站点'}), 400
+
+    error = _parse_date_range(start_date_str, end_date_str)
+    if error:
+        return error
 
-    dates = []
-    levels = []
-    flows = []
-    for dt, z, q in data:
-        if start_date and dt < start_date:
-            continue
-        if end_date and dt > end_date:
-            continue
-        dates.append(dt.strftime('%Y-%m-%d'))
-        levels.append(z)
-        flows.append(q)
+    # 缓存键
+    generation = analyzer.data_generation()
+    key_src = json.dumps({
+        'p': pairs, 'start': start_date_str, 'end': end_date_str, 'g': generation
+    }, sort_keys=True, ensure_ascii=False)
+    key = 'batch:' + hashlib.md5(key_src.encode('utf-8')).hexdigest()
+    cached = result_cache.get(key)
+    if cached:
+        return jsonify(cached)
 
+    dates, aligned = analyzer.get_aligned_series(pairs, start_date_str, end_date_str)
     resp = {
-        'river_name': river_name,
-        'station_name': station_name,
-        'dates': dates,
-        'levels': levels,
-        'flows': flows
+        'start_date': start_date_str,
+        'end_date': end_date_str,
+        'dates': days_to_strings(dates),
+        'series': [
+            {'river_name': river, 'station_name': station,
+             'levels': _nan_to_none(levels), 'flows': _nan_to_none(flows)}
+            for (river, station), (levels, flows) in aligned.items()
+        ],
+        'missing': [{'river_name': river, 'station_name': station}
+                    for river, station in pairs if (river, station) not in aligned],
     }
-    _cache_set(key, resp)
+    result_cache.set(key, resp, generation)
+    return jsonify(resp)
+
+# /compare_stations 滞后互相关的最大滞后天数上限
+COMPARE_MAX_LAG = 60
+
+@app.route('/compare_stations', methods=['POST'])
+def compare_stations():
+    """同一河流多个站点的比较：水位/流量相关矩阵、流量滞后互相关（传播时间）和相对参考站点的差值序列"""
+    river_name = request.json.get('river_name')
+    station_names = request.json.get('station_names') or None
+    start_date_str = request.json.get('start_date')
+    end_date_str = request.json.get('end_date')
+    reference = request.json.get('reference')
+
+    if not river_name:
+        return jsonify({'error': '请提供 river_name'}), 400
+    if station_names is not None:
+        if not _valid_station_names(station_names):
+            return jsonify({'error': f'station_names 应为站点名称列表，最多 {BATCH_MAX_STATIONS} 个'}), 400
+        station_names = list(dict.fromkeys(station_names))
+    try:
+        max_lag = int(request.json.get('max_lag', 10))
+    except (TypeError, ValueError):
+        max_lag = -1
+    if not 0 <= max_lag <= COMPARE_MAX_LAG:
+        return jsonify({'error': f'max_lag 应为 0 到 {COMPARE_MAX_LAG} 之间的整数'}), 400
+
+    error = _parse_date_range(start_date_str, end_date_str)
+    if error:
+        return error
+
+    # 缓存键
+    generation = analyzer.data_generation()
+    key_src = json.dumps({
+        'r': river_name, 's': station_names, 'start': start_date_str, 'end': end_date_str,
+        'lag': max_lag, 'ref': reference, 'g': generation
+    }, sort_keys=True, ensure_ascii=False)
+    key = 'cmp:' + hashlib.md5(key_src.encode('utf-8')).hexdigest()
+    cached = result_cache.get(key)
+    if cached:
+        return jsonify(cached)
+
+    resp = analyzer.compare_stations(river_name, station_names, start_date_str, end_date_str,
+                                     max_lag=max_lag, reference=reference)
+    if 'error' in resp:
+        return jsonify(resp), 400
+    result_cache.set(key, resp, generation)
     return jsonify(resp)
 
+# /anomalies 一次最多返回的异常数
+ANOMALY_MAX_LIMIT = 1000
+
+@app.route('/anomalies')
+def anomalies():
+    """入库时检测出的异常（直接读异常表）：?river_name=&station_name=&start_date=&end_date=&variable=z|q&kind=&limit="""
+    start_date_str = request.args.get('start_date')
+    end_date_str = request.args.get('end_date')
+    variable = request.args.get('variable') or None
+    kind = request.args.get('kind') or None
+    if variable not in (None, *ANOMALY_VARIABLES) or kind not in (None, *ANOMALY_KINDS):
+        return jsonify({'error': f"variable 应为 {'/'.join(ANOMALY_VARIABLES)}，kind 应为 {'/'.join(ANOMALY_KINDS)}"}), 400
+    try:
+        limit = int(request.args.get('limit', 200))
+    except ValueError:
+        limit = 0
+    if not 1 <= limit <= ANOMALY_MAX_LIMIT:
+        return jsonify({'error': f'limit 应为 1 到 {ANOMALY_MAX_LIMIT} 之间的整数'}), 400
+
+    error = _parse_date_range(start_date_str, end_date_str)
+    if error:
+        return error
+
+    items = analyzer.get_anomalies(request.args.get('river_name'), request.args.get('station_name'),
+                                   start_date_str, end_date_str, variable, kind, limit)
+    return jsonify({'count': len(items), 'anomalies': items})
+
+# /seasonal_analysis 最多分析的年数
+SEASONAL_MAX_YEARS = 100
+
 @app.route('/seasonal_analysis', methods=['POST'])
 def seasonal_analysis():
-    river_name = request.json.get('river_name')
-    station_name = request.json.get('station_name')
-    years = int(request.json.get('years', 3))
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        return jsonify({'error': '请求体应为 JSON 对象'}), 400
+    river_name = body.get('river_name')
+    station_name = body.get('station_name')
+    try:
+        years = int(body.get('years', 3))
+    except (TypeError, ValueError):
+        years = 0
+    if not 1 <= years <= SEASONAL_MAX_YEARS:
+        return jsonify({'error': f'years 应为 1 ~ {SEASONAL_MAX_YEARS} 的整数'}), 400
+
+    # 批量分析：station_names 为站点列表，空列表表示整条河流
+    station_names = body.get('station_names')
+    if station_names is not None:
+        if not _valid_station_names(station_names):
+            return jsonify({'error': f'station_names 应为站点名称列表，最多 {BATCH_MAX_STATIONS} 个'}), 400
+        return jsonify(analyzer.analyze_river_seasonal_trends(river_name, station_names, years))
     
     # 调用分析方法
     result = analyzer.analyze_seasonal_trends(river_name, station_name, years)
@@ -275,19 +525,56 @@ def seasonal_analysis():
 
 @app.route('/sync_now', methods=['POST'])
 def sync_now():
+    """提交后台同步任务，立即返回任务 id；已有排队或运行中的任务时直接返回该任务"""
     try:
-        result = sync_to_latest(refresh_cookie_on_fail=True)
-        # 同步后刷新内存中的河流列表
-        analyzer.load_data()
-        return jsonify({"ok": True, **result})
+        job, created = sync_jobs.submit()
     except Exception as e:
         return jsonify({"ok": False, "error": str(e)}), 500
+    response = jsonify({"ok": True, "job_id": job['id'], "created": created, "job": job})
+    response.status_code = 202
+    response.headers['Location'] = f"/sync_jobs/{job['id']}"
+    return response
+
+@app.route('/sync_jobs')
+def sync_job_list():
+    """最近的同步任务"""
+    return jsonify(sync_jobs.recent())
+
+@app.route('/sync_jobs/<job_id>')
+def sync_job_status(job_id):
+    """同步任务进度：状态、已完成天数/总天数、失败天数、入库行数与吞吐量"""
+    job = sync_jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': '任务不存在'}), 404
+    return jsonify(job)
+
+@app.route('/stats')
+def stats():
+    """缓存占用报告"""
+    return jsonify({
+        'series_cache': analyzer.series_cache.stats(),
+        'result_cache': result_cache.stats(),
+        'sync_scheduler': sync_scheduler.status(),
+    })
 
 # 添加健康检查路由
 @app.route('/health')
 def health_check():
     return jsonify({'status': 'healthy'}), 200
 
+@app.route('/livez')
+def livez():
+    """存活检查：进程能处理请求即返回 200，不依赖数据和上游"""
+    return jsonify({'status': 'alive'}), 200
+
+@app.route('/readyz')
+def readyz():
+    """就绪检查：本进程的启动预热（导入本地数据）完成后返回 200，之前返回 503"""
+    status = {key: warmup_status[key] for key in ('state', 'error')}
+    status['sync'] = sync_scheduler.status()
+    return jsonify(status), 200 if warmup_status['state'] == 'ready' else 503
+
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5001))
+    start_warmup()
     app.run(host='0.0.0.0', port=port, debug=True)
\ No newline at end of file
@@ -0,0 +1,132 @@
+"""合成河流数据归档生成器（基准测试用）
+
+按官方接口响应的结构（data.river_data[].river_detail[]）生成逐日数据：
+每个水系若干条河流，每条河流若干个站点；流量由季节变化 + 随机洪水过程 + 对数正态扰动组成，
+下游站点比上游晚一天、流量更大，水位由流量经水位-流量关系换算。同一组参数和种子总是生成相同的数据。
+
+    python benchmarks/generate_archive.py /tmp/river_bench --years 3 --systems 4 --rivers 4 --stations 6
+"""
+import os
+import sys
+import argparse
+from datetime import datetime, timedelta
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from river_archive import RiverArchive, FORMAT_JSON, FORMAT_BUNDLE  # noqa: E402
+
+
+class SyntheticRivers:
+    """一组确定性的合成河流时序，按天取出接口响应格式的数据"""
+
+    def __init__(self, start_date='2020-01-01', days=365, systems=2, rivers=3, stations=4,
+                 missing_rate=0.02, seed=0):
+        """
+        :param days: 总天数
+        :param systems: 水系数
+        :param rivers: 每个水系的河流数
+        :param stations: 每条河流的站点数
+        :param missing_rate: 每个 Z/Q 值为 '--' 的概率
+        """
+        self.start = datetime.strptime(start_date, '%Y-%m-%d')
+        self.days = days
+        rng = np.random.default_rng(seed)
+        doy = (np.arange(days) + self.start.timetuple().tm_yday) % 365
+
+        self.layout = []  # [(水系, 河流, 站点, 测站编码)]
+        levels, flows = [], []
+        for s in range(systems):
+            for r in range(rivers):
+                river = f'水系{s}河{r}'
+                base_q = rng.uniform(5, 200)
+                # 汛期（约 7、8 月）的季节峰
+                season = 1 + 2.5 * np.maximum(0, np.sin(2 * np.pi * (doy - 150) / 365)) ** 3
+                # 洪水过程：随机起涨，指数退水
+                pulses = np.where(rng.random(days + stations) < 0.02, rng.exponential(3, days + stations), 0)
+                flood = np.zeros(days + stations)
+                for t in range(1, len(flood)):
+                    flood[t] = flood[t - 1] * 0.7 + pulses[t]
+                noise = np.exp(rng.normal(0, 0.08, days + stations))
+                upstream = base_q * np.concatenate([np.full(stations, season[0]), season]) * (1 + flood) * noise
+
+                z0 = rng.uniform(20, 400)
+                for k in range(stations):
+                    # 第 k 个站点比源头晚 k 天，汇入支流后流量逐站增大
+                    q = upstream[stations - k:stations - k + days] * (1 + 0.3 * k)
+                    z = z0 - 3.0 * k + 0.35 * q ** 0.45 + rng.normal(0, 0.02, days)
+                    flows.append(q)
+                    levels.append(z)
+                    self.layout.append((f'水系{s}', river, f'{river}站{k}', f'{len(self.layout):08d}'))
+
+        self.levels = np.array(levels)
+        self.flows = np.array(flows)
+        self.missing_z = rng.random(self.levels.shape) < missing_rate
+        self.missing_q = rng.random(self.flows.shape) < missing_rate
+
+    @property
+    def station_names(self):
+        """[(河流, 站点)]"""
+        return [(river, station) for _, river, station, _ in self.layout]
+
+    def date_str(self, i: int) -> str:
+        return (self.start + timedelta(days=i)).strftime('%Y-%m-%d')
+
+    def day(self, i: int) -> dict:
+        """第 i 天的接口响应"""
+        date_str = self.date_str(i)
+        systems = {}
+        for j, (system, river, station, code) in enumerate(self.layout):
+            systems.setdefault(system, []).append({
+                'river': river,
+                'river_name': station,
+                'Z': '--' if self.missing_z[j, i] else f'{self.levels[j, i]:.2f}',
+                'Q': '--' if self.missing_q[j, i] else f'{self.flows[j, i]:.2f}',
+                'tm': f'{date_str} 08:00',
+                'stcd': code,
+            })
+        return {
+            'code': 0,
+            'message': 'ok',
+            'data': {'river_data': [{'river_system': system, 'river_detail': details}
+                                    for system, details in systems.items()]},
+        }
+
+    def write(self, data_dir: str, first: int = 0, last: int = None, fmt: str = FORMAT_JSON) -> int:
+        """把第 first ~ last-1 天写入数据目录，返回写入的天数
+
+        fmt=bundle 时先写单日 JSON 再合并为月度归档（与 --pack-archive 相同），
+        已有月度归档时追加的日期会合并进对应月份。
+        """
+        last = self.days if last is None else last
+        os.makedirs(data_dir, exist_ok=True)
+        archive = RiverArchive(data_dir, FORMAT_JSON)
+        for i in range(first, last):
+            archive.write_day(self.date_str(i), self.day(i))
+        if fmt == FORMAT_BUNDLE:
+            RiverArchive(data_dir).pack()
+        return last - first
+
+
+def main():
+    parser = argparse.ArgumentParser(description='生成合成河流数据归档')
+    parser.add_argument('data_dir', help='输出目录')
+    parser.add_argument('--start', default='2020-01-01', help='起始日期')
+    parser.add_argument('--years', type=float, default=1, help='年数')
+    parser.add_argument('--systems', type=int, default=2, help='水系数')
+    parser.add_argument('--rivers', type=int, default=3, help='每个水系的河流数')
+    parser.add_argument('--stations', type=int, default=4, help='每条河流的站点数')
+    parser.add_argument('--missing-rate', type=float, default=0.02, help="Z/Q 为 '--' 的比例")
+    parser.add_argument('--seed', type=int, default=0, help='随机种子')
+    parser.add_argument('--format', choices=(FORMAT_JSON, FORMAT_BUNDLE), default=FORMAT_JSON,
+                        help='json: 每天一个 river_data_YYYY-MM-DD.json；bundle: 月度压缩归档')
+    args = parser.parse_args()
+
+    rivers = SyntheticRivers(args.start, int(args.years * 365), args.systems, args.rivers, args.stations,
+                             args.missing_rate, args.seed)
+    days = rivers.write(args.data_dir, fmt=args.format)
+    print(f"已生成 {days} 天 × {len(rivers.layout)} 个站点的数据到 {args.data_dir}")
+
+
+if __name__ == '__main__':
+    main()
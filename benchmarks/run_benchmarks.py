@@ -0,0 +1,258 @@
+"""性能基准测试
+
+在几档数据规模上用合成归档（generate_archive.py）计时：
+- 冷启动导入（空库 load_data）、增量导入（load_data 导入新增文件）、逐日入库（同步使用的 ingest_day）
+- 单站点全量读取（get_data_by_river_and_station）、日期范围查询（get_series_arrays，内存缓存开/关）
+- 季节分析（analyze_seasonal_trends）
+- 图表渲染（范围查询 + 降采样 + 绘制 PNG，与 /plot 相同的流程，在当前进程内渲染）
+
+结果写成 JSON，可与之前的结果比较：
+
+    python benchmarks/run_benchmarks.py --sizes small medium --output before.json
+    python benchmarks/run_benchmarks.py --sizes small medium --output after.json --baseline before.json
+    python benchmarks/run_benchmarks.py --compare before.json after.json
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import platform
+import sqlite3
+import argparse
+import tempfile
+import warnings
+import subprocess
+from datetime import datetime
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+from analyze_river_data import RiverDataAnalyzer  # noqa: E402
+from series_store import downsample  # noqa: E402
+from river_archive import FORMAT_JSON, FORMAT_BUNDLE  # noqa: E402
+from generate_archive import SyntheticRivers  # noqa: E402
+
+# 数据规模：年数、水系数、每个水系的河流数、每条河流的站点数
+SIZES = {
+    'small': {'years': 1, 'systems': 2, 'rivers': 3, 'stations': 4},
+    'medium': {'years': 3, 'systems': 4, 'rivers': 4, 'stations': 6},
+    'large': {'years': 8, 'systems': 6, 'rivers': 5, 'stations': 8},
+}
+# 增量导入的新增文件天数与逐日入库的天数（从生成的数据末尾留出）
+INCREMENTAL_DAYS = 7
+INGEST_DAYS = 7
+# 每项查询轮流使用的站点数
+SAMPLE_STATIONS = 8
+# 与 /plot 默认的点数上限一致
+PLOT_MAX_POINTS = 2000
+
+RESULT_VERSION = 1
+
+
+def _stats(samples):
+    ms = np.asarray(samples) * 1000
+    return {
+        'n': len(ms),
+        'median_ms': round(float(np.median(ms)), 4),
+        'min_ms': round(float(ms.min()), 4),
+        'p95_ms': round(float(np.percentile(ms, 95)), 4),
+        'mean_ms': round(float(ms.mean()), 4),
+    }
+
+
+def measure(fn, args_list, repeat):
+    """对 args_list 中的参数轮流调用 fn，共 repeat 次，返回每次的耗时（秒）"""
+    samples = []
+    for i in range(repeat):
+        args = args_list[i % len(args_list)]
+        started = time.perf_counter()
+        fn(*args)
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def _render(analyzer, river, station, start, end):
+    from plot_render import render_chart
+    dates, levels, flows = analyzer.get_series_arrays(river, station, start, end)
+    dates, levels, flows, _ = downsample(dates, levels, flows, PLOT_MAX_POINTS)
+    return render_chart(f'{river} - {station} 水文数据', 'both', dates, levels, flows)
+
+
+def run_size(name, spec, workdir, repeat, fmt, import_workers, seed, skip_plot):
+    """在一档数据规模上运行全部基准，返回结果列表"""
+    days = int(spec['years'] * 365) + INCREMENTAL_DAYS + INGEST_DAYS
+    rivers = SyntheticRivers('2015-01-01', days, spec['systems'], spec['rivers'], spec['stations'], seed=seed)
+    data_dir = os.path.join(workdir, name, 'data')
+    db_path = os.path.join(workdir, name, 'bench.db')
+    history = days - INCREMENTAL_DAYS - INGEST_DAYS
+    # 每次都从空目录和空库开始
+    shutil.rmtree(os.path.join(workdir, name), ignore_errors=True)
+
+    started = time.perf_counter()
+    rivers.write(data_dir, 0, history, fmt)
+    print(f"[{name}] 生成 {history} 天 × {len(rivers.layout)} 个站点，耗时 {time.perf_counter() - started:.1f} 秒")
+
+    results = []
+
+    def record(benchmark, samples, **extra):
+        item = {'size': name, 'benchmark': benchmark, **_stats(samples), **extra}
+        results.append(item)
+        print(f"[{name}] {benchmark:<32} 中位数 {item['median_ms']:>10.3f} ms  (n={item['n']})")
+
+    # 导入
+    analyzer = RiverDataAnalyzer(data_dir=data_dir, db_path=db_path, import_workers=import_workers)
+    started = time.perf_counter()
+    rows = analyzer.load_data()
+    elapsed = time.perf_counter() - started
+    record('ingest_cold', [elapsed], rows=rows, rows_per_second=round(rows / elapsed, 1))
+
+    rivers.write(data_dir, history, history + INCREMENTAL_DAYS, fmt)
+    started = time.perf_counter()
+    rows = analyzer.load_data()
+    elapsed = time.perf_counter() - started
+    record('ingest_incremental', [elapsed], rows=rows, rows_per_second=round(rows / elapsed, 1))
+
+    new_days = [(rivers.date_str(i), rivers.day(i)) for i in range(history + INCREMENTAL_DAYS, days)]
+    record('ingest_day', measure(analyzer.ingest_day, new_days, INGEST_DAYS))
+
+    # 查询：按站点顺序等间隔取样，各规模下取到的站点固定
+    names = rivers.station_names
+    sample = [names[i] for i in np.linspace(0, len(names) - 1, min(SAMPLE_STATIONS, len(names))).astype(int)]
+    last_year = (rivers.date_str(days - 365), rivers.date_str(days - 1))
+    last_quarter = (rivers.date_str(days - 90), rivers.date_str(days - 1))
+
+    uncached = RiverDataAnalyzer(data_dir=data_dir, db_path=db_path, series_cache_mb=0)
+    record('station_history', measure(analyzer.get_data_by_river_and_station, sample, repeat))
+    record('range_90d_nocache', measure(uncached.get_series_arrays,
+                                        [(*s, *last_quarter) for s in sample], repeat))
+    record('range_full_nocache', measure(uncached.get_series_arrays, sample, repeat))
+    analyzer.series_cache.invalidate(analyzer.data_generation())
+    record('range_full_cache_miss', measure(analyzer.get_series_arrays, sample, len(sample)))
+    record('range_90d_cache_hit', measure(analyzer.get_series_arrays,
+                                          [(*s, *last_quarter) for s in sample], repeat))
+    record('seasonal_analysis', measure(analyzer.analyze_seasonal_trends, [(*s, 3) for s in sample], repeat))
+
+    if not skip_plot:
+        # 先画一张加载 matplotlib 和字体（与渲染进程启动时的预热相同），不计时
+        _render(analyzer, *sample[0], *last_year)
+        record('plot_1y_png', measure(_render, [(analyzer, *s, *last_year) for s in sample], max(3, repeat // 4)))
+        record('plot_full_png', measure(_render, [(analyzer, *s, None, None) for s in sample], max(3, repeat // 4)))
+
+    analyzer.db.close()
+    uncached.db.close()
+    db_size = sum(os.path.getsize(db_path + suffix) for suffix in ('', '-wal') if os.path.exists(db_path + suffix))
+    for item in results:
+        item.update(stations=len(names), days=days)
+    results.append({'size': name, 'benchmark': 'db_size_bytes', 'value': db_size, 'stations': len(names), 'days': days})
+    return results
+
+
+def _git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BENCH_DIR, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def compare(baseline, current, threshold=0.1):
+    """按 (规模, 基准) 比较两次结果的中位数，打印对比表，返回变慢的项"""
+    def index(report):
+        return {(item['size'], item['benchmark']): item for item in report['results'] if 'median_ms' in item}
+
+    old, new = index(baseline), index(current)
+    # 规模只决定比较哪些项，其余参数不同时结果不可直接比较
+    options = [{k: v for k, v in report['meta'].get('options', {}).items() if k != 'sizes'} for report in (baseline, current)]
+    if options[0] != options[1]:
+        print(f"注意：两次运行的参数不同 {options[0]} -> {options[1]}")
+    print(f"\n对比 {baseline['meta'].get('git_revision')} ({baseline['meta']['timestamp']}) -> "
+          f"{current['meta'].get('git_revision')} ({current['meta']['timestamp']})，阈值 ±{threshold:.0%}")
+    print(f"{'规模':<8}{'基准':<32}{'之前 ms':>12}{'现在 ms':>12}{'比值':>8}")
+    regressions = []
+    for key in sorted(old.keys() & new.keys()):
+        before, after = old[key]['median_ms'], new[key]['median_ms']
+        ratio = after / before if before > 0 else float('inf')
+        mark = ''
+        if ratio > 1 + threshold:
+            mark = '  变慢'
+            regressions.append({'size': key[0], 'benchmark': key[1], 'before_ms': before, 'after_ms': after,
+                                'ratio': round(ratio, 3)})
+        elif ratio < 1 - threshold:
+            mark = '  变快'
+        print(f"{key[0]:<8}{key[1]:<32}{before:>12.3f}{after:>12.3f}{ratio:>8.2f}{mark}")
+    for key in sorted(old.keys() ^ new.keys()):
+        print(f"{key[0]:<8}{key[1]:<32}  仅在{'之前' if key in old else '现在'}的结果中")
+    return regressions
+
+
+def _load(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='河流数据应用性能基准测试')
+    parser.add_argument('--sizes', nargs='+', choices=list(SIZES), default=['small', 'medium'], help='数据规模')
+    parser.add_argument('--repeat', type=int, default=20, help='每项查询的重复次数')
+    parser.add_argument('--format', choices=(FORMAT_JSON, FORMAT_BUNDLE), default=FORMAT_JSON, help='归档格式')
+    parser.add_argument('--import-workers', type=int, default=1, help='冷启动导入的解析进程数（0 为全部 CPU 核）')
+    parser.add_argument('--seed', type=int, default=0, help='合成数据的随机种子')
+    parser.add_argument('--skip-plot', action='store_true', help='跳过图表渲染')
+    parser.add_argument('--workdir', help='生成数据和数据库的目录（默认临时目录，结束后删除）')
+    parser.add_argument('--output', help='结果 JSON 路径（默认 benchmarks/results/<时间>.json）')
+    parser.add_argument('--baseline', help='运行后与该结果文件比较')
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'), help='只比较两个已有的结果文件')
+    parser.add_argument('--threshold', type=float, default=0.1, help='比较时视为变化的相对幅度')
+    parser.add_argument('--fail-on-regression', action='store_true', help='有变慢的项时以退出码 1 结束')
+    args = parser.parse_args()
+
+    if args.compare:
+        regressions = compare(_load(args.compare[0]), _load(args.compare[1]), args.threshold)
+        sys.exit(1 if regressions and args.fail_on_regression else 0)
+
+    # 合成数据中的 '--' 会产生大量跳过警告；图表中的中文字体缺失警告也不影响计时
+    logging.basicConfig(level=logging.ERROR)
+    warnings.filterwarnings('ignore', message='Glyph .* missing from font', category=UserWarning)
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='river_bench_')
+    report = {
+        'meta': {
+            'version': RESULT_VERSION,
+            'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'git_revision': _git_revision(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'options': {'sizes': args.sizes, 'repeat': args.repeat, 'format': args.format,
+                        'import_workers': args.import_workers, 'seed': args.seed},
+            'size_specs': {name: SIZES[name] for name in args.sizes},
+        },
+        'results': [],
+    }
+    try:
+        for name in args.sizes:
+            report['results'].extend(run_size(name, SIZES[name], workdir, args.repeat, args.format,
+                                              args.import_workers, args.seed, args.skip_plot))
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    output = args.output or os.path.join(BENCH_DIR, 'results', datetime.now().strftime('%Y%m%d-%H%M%S') + '.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n结果已写入 {output}")
+
+    if args.baseline:
+        regressions = compare(_load(args.baseline), report, args.threshold)
+        if regressions and args.fail_on_regression:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -24,10 +24,44 @@ class AppConfig:
         self.data_dir = os.getenv('DATA_DIR', 'river_data')
         self.db_path = os.getenv('DB_PATH', 'river_data.db')
         self.cache_ttl_seconds = int(os.getenv('CACHE_TTL_SECONDS', '600'))
+        # 快速启动：数据导入和启动同步放到后台预热线程中，应用导入后立即可以响应请求
+        self.fast_start = os.getenv('FAST_START', '1').lower() not in ('0', 'false', 'no', 'off')
+        # 各 worker 共享的结果缓存文件与大小上限（MB，0 关闭）
+        self.result_cache_path = os.getenv('RESULT_CACHE_PATH', 'result_cache.db')
+        self.result_cache_mb = int(os.getenv('RESULT_CACHE_MB', '64'))
+        # 初次/全量导入的解析进程数，0 表示使用全部 CPU 核
+        self.import_workers = int(os.getenv('IMPORT_WORKERS', '0'))
+        # 原始数据归档格式: bundle（按月 gzip 压缩归档）或 json（每天一个文件）
+        self.archive_format = os.getenv('ARCHIVE_FORMAT', 'bundle')
+        # 数据库读连接：空闲连接池大小、内存映射大小与页缓存大小（MB）
+        self.db_read_pool_size = int(os.getenv('DB_READ_POOL_SIZE', '4'))
+        self.db_mmap_mb = int(os.getenv('DB_MMAP_MB', '256'))
+        self.db_cache_mb = int(os.getenv('DB_CACHE_MB', '32'))
+        # 站点时序内存缓存上限（MB，每个 worker 进程各一份；0 关闭）
+        self.series_cache_mb = int(os.getenv('SERIES_CACHE_MB', '128'))
+        # 图表渲染进程数（每个 worker 进程各一组；0 表示在 Web 进程内渲染）与单张图的超时（秒）
+        self.plot_workers = int(os.getenv('PLOT_WORKERS', '2'))
+        self.plot_timeout_seconds = float(os.getenv('PLOT_TIMEOUT_SECONDS', '20'))
+        # 入库时异常检测：滚动统计窗口（天）、z 分数阈值（0 关闭）、按河流/站点的阈值（JSON）
+        self.anomaly_window_days = float(os.getenv('ANOMALY_WINDOW_DAYS', '30'))
+        self.anomaly_zscore = float(os.getenv('ANOMALY_ZSCORE', '4'))
+        self.anomaly_thresholds = _get_json_env('ANOMALY_THRESHOLDS_JSON', {})
 
         # 下载相关
         self.headers = _get_json_env('REQUEST_HEADERS_JSON', {})
         self.cookies = _get_json_env('REQUEST_COOKIES_JSON', {})
+        # 并发下载：最大并发请求数、每秒请求上限（<=0 不限速）
+        self.sync_workers = int(os.getenv('SYNC_WORKERS', '4'))
+        self.sync_rate_limit = float(os.getenv('SYNC_RATE_LIMIT', '2'))
+        # 单日最多下载尝试次数，超过后不再重试（<=0 不限）
+        self.sync_max_attempts = int(os.getenv('SYNC_MAX_ATTEMPTS', '5'))
+        # 定时同步：间隔（分钟，0 关闭）、每天的基准时间（同步时间为基准时间 + k × 间隔）、
+        # 非 leader 的 worker 检查数据变化和接管 leader 的轮询间隔（秒）
+        self.sync_interval_minutes = float(os.getenv('SYNC_INTERVAL_MINUTES', '1440'))
+        self.sync_at = os.getenv('SYNC_AT', '12:00')
+        self.sync_poll_seconds = float(os.getenv('SYNC_POLL_SECONDS', '30'))
+        # 边下载边入库时原始归档的写法: async（后台写）、sync（立即写）、off（不写归档）
+        self.sync_archive_mode = os.getenv('SYNC_ARCHIVE_MODE', 'async')
 
 
 def get_config() -> AppConfig:
@@ -0,0 +1,131 @@
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+# 读连接 PRAGMA：只读、内存映射读取、较大的页缓存、临时表放内存
+READ_PRAGMAS = [
+    'PRAGMA query_only=ON',
+    'PRAGMA temp_store=MEMORY',
+]
+
+# 写连接 PRAGMA：WAL 允许写入期间并发读，NORMAL 同步在 WAL 下仍然安全
+WRITE_PRAGMAS = [
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA cache_size=-65536',
+]
+
+# 写连接等待其他进程（另一个 worker 的启动导入、命令行同步等）释放写锁的最长时间（秒）；
+# 默认的 5 秒在批量导入提交一批数据期间不够用，入库会报 database is locked
+WRITE_BUSY_TIMEOUT = 60
+
+# fork 前的进程留下的连接：子进程中既不能使用也不能关闭（关闭会动到父进程的锁和 WAL 共享内存），
+# 只保留引用，防止被垃圾回收时关闭
+_inherited = []
+
+
+class ConnectionManager:
+    """SQLite 连接管理。
+
+    - 读连接：连接池，用完归还，复用已解析的 schema 和热页缓存；
+      按需新建，空闲连接最多保留 pool_size 个（Flask 开发服务器每个请求一个线程，不宜按线程持有）
+    - 写连接：整个进程一个，通过 writer() 加锁独占使用
+    - 进程安全：检测到 pid 变化（gunicorn --preload 之后 fork 出的 worker）时，
+      丢弃继承来的连接，在新进程中重新打开
+    """
+
+    def __init__(self, db_path: str, pool_size: int = 4, mmap_size_mb: int = 256, cache_size_mb: int = 32):
+        self.db_path = db_path
+        self.pool_size = max(1, pool_size)
+        self.read_pragmas = READ_PRAGMAS + [
+            f'PRAGMA mmap_size={max(0, mmap_size_mb) * 1024 * 1024}',
+            f'PRAGMA cache_size=-{max(1, cache_size_mb) * 1024}',
+        ]
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._idle = []
+        self._idle_lock = threading.Lock()
+        self._writer = None
+        self._writer_lock = threading.RLock()
+
+    def _check_fork(self):
+        if os.getpid() != self._pid:
+            _inherited.extend(self._idle)
+            if self._writer is not None:
+                _inherited.append(self._writer)
+            self._reset()
+
+    def _open_reader(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, isolation_level=None, check_same_thread=False)
+        for pragma in self.read_pragmas:
+            conn.execute(pragma)
+        return conn
+
+    @contextmanager
+    def reader(self):
+        """借用一个只读连接（自动提交模式，查询结束后不持有读事务），退出时归还连接池"""
+        self._check_fork()
+        pid = self._pid
+        with self._idle_lock:
+            conn = self._idle.pop() if self._idle else None
+        if conn is None:
+            conn = self._open_reader()
+        try:
+            yield conn
+        finally:
+            with self._idle_lock:
+                keep = pid == self._pid and len(self._idle) < self.pool_size
+                if keep:
+                    self._idle.append(conn)
+            if not keep:
+                conn.close()
+
+    @contextmanager
+    def writer(self):
+        """独占使用进程内唯一的写连接（自动提交模式，事务由调用方 BEGIN/COMMIT）"""
+        self._check_fork()
+        with self._writer_lock:
+            if self._writer is None:
+                conn = sqlite3.connect(self.db_path, timeout=WRITE_BUSY_TIMEOUT, isolation_level=None,
+                                       check_same_thread=False)
+                for pragma in WRITE_PRAGMAS:
+                    conn.execute(pragma)
+                self._writer = conn
+            try:
+                yield self._writer
+            finally:
+                # 调用方异常退出时不要把未结束的事务留给下一个使用者
+                if self._writer.in_transaction:
+                    self._writer.execute('ROLLBACK')
+
+    @contextmanager
+    def short_writer(self, timeout: float = 30):
+        """临时打开一个独立的写连接，退出时关闭（自动提交模式）。
+
+        不经过 writer() 的进程内锁，用于少量簿记写入（同步任务状态等），不必排在长时间占用写连接的
+        导入后面；与其他写事务的冲突交给 SQLite 的忙等待（最多 timeout 秒）。
+        """
+        conn = sqlite3.connect(self.db_path, timeout=timeout, isolation_level=None)
+        try:
+            conn.execute('PRAGMA synchronous=NORMAL')
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            conn.close()
+
+    def close(self):
+        """关闭当前进程打开的空闲读连接和写连接"""
+        self._check_fork()
+        with self._idle_lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+        with self._writer_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
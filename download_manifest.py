@@ -0,0 +1,160 @@
+import os
+import json
+import hashlib
+import threading
+from datetime import datetime, timedelta
+
+from river_archive import RiverArchive, DAY_FILE_PATTERN, iter_bundle_lines
+
+MANIFEST_NAME = 'manifest.json'
+
+STATUS_OK = 'ok'
+STATUS_FAILED = 'failed'
+
+
+def sha256_bytes(raw: bytes) -> str:
+    return hashlib.sha256(raw).hexdigest()
+
+
+def sha256_file(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class DownloadManifest:
+    """下载清单：持久化记录每一天的下载状态、字节数、内容哈希与尝试次数。
+
+    清单保存在数据目录下的 manifest.json 中，同步时只需读取这一个文件，
+    不再扫描整个目录；同时可据此找出中间失败/缺失的日期并重新下载。
+    """
+
+    def __init__(self, path: str, days: dict = None):
+        self.path = path
+        self.days = days or {}
+        self._lock = threading.Lock()
+        # 保存文件时持有：多个下载线程同时触发自动保存时依次写入
+        self._save_lock = threading.Lock()
+        self._dirty = 0
+        self._last_ok = max((d for d, e in self.days.items() if e.get('status') == STATUS_OK), default=None)
+
+    @classmethod
+    def load(cls, data_dir: str) -> 'DownloadManifest':
+        """读取清单；若不存在则扫描一次目录生成（仅首次）。"""
+        path = os.path.join(data_dir, MANIFEST_NAME)
+        if os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    raw = json.load(f)
+                return cls(path, raw.get('days', {}))
+            except (OSError, ValueError):
+                pass
+        manifest = cls(path, cls._scan_directory(data_dir))
+        manifest.save()
+        return manifest
+
+    @staticmethod
+    def _scan_directory(data_dir: str) -> dict:
+        days = {}
+        if not os.path.isdir(data_dir):
+            return days
+        for entry in os.scandir(data_dir):
+            match = DAY_FILE_PATTERN.match(entry.name)
+            if not match:
+                continue
+            try:
+                datetime.strptime(match.group(1), '%Y-%m-%d')
+            except ValueError:
+                continue
+            days[match.group(1)] = {
+                'status': STATUS_OK,
+                'size': entry.stat().st_size,
+                'sha256': sha256_file(entry.path),
+                'attempts': 1,
+            }
+        # 已合并进月度归档的日期
+        for path in RiverArchive(data_dir).bundles():
+            for date_str, line in iter_bundle_lines(path):
+                days[date_str] = {
+                    'status': STATUS_OK,
+                    'size': len(line),
+                    'sha256': sha256_bytes(line),
+                    'attempts': 1,
+                }
+        return days
+
+    def save(self, min_dirty: int = 0):
+        """原子写入清单文件（先写临时文件再替换），并发调用时依次写入。
+
+        :param min_dirty: 未落盘的记录少于这么多条时不写（自动保存用：排队期间已被其他线程保存过就跳过）
+        """
+        with self._save_lock:
+            with self._lock:
+                if self._dirty < min_dirty:
+                    return
+                payload = json.dumps({'version': 1, 'days': self.days}, ensure_ascii=False, sort_keys=True)
+                dirty = self._dirty
+            tmp_path = f'{self.path}.{os.getpid()}-{threading.get_ident()}.tmp'
+            try:
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    f.write(payload)
+                os.replace(tmp_path, self.path)
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+            with self._lock:
+                # 生成快照之后新增的记录仍算未落盘
+                self._dirty -= dirty
+
+    def record(self, date_str: str, ok: bool, size: int = None, sha256: str = None, autosave_every: int = 50):
+        """记录一次下载尝试的结果（线程安全），每累计 autosave_every 条落盘一次。"""
+        with self._lock:
+            entry = self.days.setdefault(date_str, {'attempts': 0})
+            entry['attempts'] = entry.get('attempts', 0) + 1
+            entry['updated_at'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            if ok:
+                entry['status'] = STATUS_OK
+                entry['size'] = size
+                entry['sha256'] = sha256
+                if self._last_ok is None or date_str > self._last_ok:
+                    self._last_ok = date_str
+            elif entry.get('status') != STATUS_OK:
+                entry['status'] = STATUS_FAILED
+            self._dirty += 1
+            need_save = autosave_every and self._dirty >= autosave_every
+        if need_save:
+            self.save(min_dirty=autosave_every)
+
+    def is_ok(self, date_str: str) -> bool:
+        entry = self.days.get(date_str)
+        return bool(entry) and entry.get('status') == STATUS_OK
+
+    def last_ok_date(self):
+        """最后一个成功下载的日期（datetime），没有则返回 None。"""
+        return datetime.strptime(self._last_ok, '%Y-%m-%d') if self._last_ok else None
+
+    def first_date(self):
+        return datetime.strptime(min(self.days), '%Y-%m-%d') if self.days else None
+
+    def plan(self, default_start: datetime, end_date: datetime, max_attempts: int = 0) -> list:
+        """生成一次同步要下载的日期列表：历史区间内的空洞/失败日期 + 尾部新日期。
+
+        :param default_start: 清单为空时的起始日期
+        :param max_attempts: 单日最多尝试次数，达到后不再重试（<=0 表示不限）
+        """
+        start = self.first_date() or default_start
+        dates = []
+        current = start
+        while current <= end_date:
+            date_str = current.strftime('%Y-%m-%d')
+            entry = self.days.get(date_str)
+            if not entry:
+                dates.append(date_str)
+            elif entry.get('status') != STATUS_OK:
+                if max_attempts <= 0 or entry.get('attempts', 0) < max_attempts:
+                    dates.append(date_str)
+            current += timedelta(days=1)
+        return dates
@@ -0,0 +1,14 @@
+# gunicorn 配置（命令行参数见 start.sh）
+import os
+
+# 线程 worker：/plot、/plot_image 等待渲染进程时只占用一个线程，同一 worker 的其他线程继续处理 JSON 接口，
+# 慢图表不会占满全部 worker。渲染进程池、结果缓存和数据库连接管理都是线程安全的
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', '8'))
+
+
+def post_fork(server, worker):
+    # 每个 worker fork 后在后台线程中预热（导入数据、同步至当天），worker 立即开始接受请求；
+    # 线程不会跨 fork 保留，所以不能在 --preload 的主进程中启动
+    import app
+    app.start_warmup()
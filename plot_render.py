@@ -0,0 +1,166 @@
+import io
+import os
+import signal
+import logging
+import threading
+import multiprocessing
+
+logger = logging.getLogger(__name__)
+
+# 图表使用的中文字体（按顺序回退）
+PLOT_FONTS = ['Songti SC', 'STSong', 'SimSun', 'Microsoft YaHei', 'SimHei']
+PLOT_FORMATS = {'png': 'image/png', 'svg': 'image/svg+xml'}
+FIGSIZE = (12, 6)
+# fork 出的渲染进程会继承父进程（gunicorn worker）为这些信号注册的处理函数，需恢复默认处理
+INHERITED_SIGNALS = ('SIGTERM', 'SIGINT', 'SIGQUIT', 'SIGUSR1', 'SIGWINCH', 'SIGABRT')
+
+# 渲染进程内复用的 Figure 与 Agg 画布（每个渲染进程一份，使用前清空）
+_figure = None
+
+
+class RenderTimeout(Exception):
+    """渲染超时"""
+
+
+def _setup_matplotlib():
+    import matplotlib
+    matplotlib.use('Agg')
+    matplotlib.rcParams['font.sans-serif'] = PLOT_FONTS
+    matplotlib.rcParams['font.family'] = 'sans-serif'
+    matplotlib.rcParams['axes.unicode_minus'] = False  # 解决负号显示问题
+
+
+def _get_figure():
+    """取得复用的 Figure（不经过 pyplot，没有全局状态）"""
+    global _figure
+    if _figure is None:
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        _figure = Figure(figsize=FIGSIZE)
+        FigureCanvasAgg(_figure)
+    else:
+        _figure.clear()
+    return _figure
+
+
+def render_chart(title, plot_type, dates, levels, flows, fmt='png'):
+    """绘制水文图表，返回图片字节
+
+    :param plot_type: 'level'、'flow' 或 'both'
+    :param dates: datetime64[D] 数组
+    """
+    import matplotlib.dates as mdates
+
+    fig = _get_figure()
+    ax = fig.add_subplot()
+
+    if plot_type == 'level' or plot_type == 'both':
+        ax.plot(dates, levels, 'b-', label='水位 (m)')
+        ax.set_ylabel('水位 (m)', color='b')
+        ax.tick_params('y', colors='b')
+
+    if plot_type == 'flow' or plot_type == 'both':
+        if plot_type == 'both':
+            ax2 = ax.twinx()
+            ax2.plot(dates, flows, 'r-', label='流量 (m³/s)')
+            ax2.set_ylabel('流量 (m³/s)', color='r')
+            ax2.tick_params('y', colors='r')
+            lines = ax.get_lines() + ax2.get_lines()
+            labels = [line.get_label() for line in lines]
+            ax.legend(lines, labels, loc='upper right')
+        else:
+            ax.plot(dates, flows, 'r-', label='流量 (m³/s)')
+            ax.set_ylabel('流量 (m³/s)', color='r')
+            ax.tick_params('y', colors='r')
+            ax.legend()
+
+    ax.set_xlabel('日期')
+    ax.set_title(title)
+    ax.grid(True)
+
+    # 设置日期格式
+    ax.xaxis.set_major_formatter(mdates.DateFormatter('%Y-%m-%d'))
+    fig.autofmt_xdate()
+
+    buf = io.BytesIO()
+    fig.savefig(buf, format=fmt, bbox_inches='tight')
+    return buf.getvalue()
+
+
+def _init_worker():
+    """渲染进程初始化：导入 matplotlib、解析字体并试画一张图，让第一次请求不再承担这些开销"""
+    # gunicorn 的 SIGTERM 处理函数只标记 worker 退出，不恢复的话渲染进程收到 pool.terminate() 发出的
+    # SIGTERM 后不会退出，terminate() 会一直等下去
+    for name in INHERITED_SIGNALS:
+        signal.signal(getattr(signal, name), signal.SIG_DFL)
+    import numpy as np
+    import warnings
+    warnings.filterwarnings('ignore', category=UserWarning, module='matplotlib')
+    _setup_matplotlib()
+    dates = np.arange('2024-01-01', '2024-01-08', dtype='datetime64[D]')
+    values = np.arange(len(dates), dtype=np.float64)
+    render_chart('预热 水位 流量', 'both', dates, values, values)
+
+
+class PlotRenderer:
+    """图表渲染进程池。
+
+    - 每个渲染在独立进程中完成，不占用 Web 进程的 GIL，也不共享 pyplot 全局状态
+    - 渲染进程启动时预热字体并复用 Figure
+    - 每次渲染有超时；超时后终止整个进程池（卡住的进程无法单独回收），下次渲染时重建
+    - workers <= 0 时在当前进程内渲染（命令行、调试用）
+    - 进程池在首次使用时创建；gunicorn fork 出的 worker 各自创建自己的进程池
+    """
+
+    def __init__(self, workers: int = 2, timeout: float = 20):
+        self.workers = workers
+        self.timeout = timeout
+        self._pool = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._inline_ready = False
+
+    def start(self):
+        """提前创建进程池并开始预热（可选，否则在首次渲染时创建）"""
+        if self.workers > 0:
+            self._get_pool()
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None or self._pid != os.getpid():
+                # 使用 fork：子进程不会重新执行 Web 应用的 __main__ 模块
+                ctx = multiprocessing.get_context('fork')
+                self._pool = ctx.Pool(self.workers, initializer=_init_worker)
+                self._pid = os.getpid()
+            return self._pool
+
+    def _reset_pool(self, pool):
+        with self._lock:
+            if self._pool is pool:
+                self._pool = None
+        pool.terminate()
+
+    def render(self, title, plot_type, dates, levels, flows, fmt='png') -> bytes:
+        """渲染图表，返回图片字节；超时抛出 RenderTimeout"""
+        args = (title, plot_type, dates, levels, flows, fmt)
+        if self.workers <= 0:
+            if not self._inline_ready:
+                _setup_matplotlib()
+                self._inline_ready = True
+            with self._lock:
+                return render_chart(*args)
+
+        pool = self._get_pool()
+        result = pool.apply_async(render_chart, args)
+        try:
+            return result.get(self.timeout)
+        except multiprocessing.TimeoutError:
+            logger.warning(f"图表渲染超过 {self.timeout} 秒，重建渲染进程池")
+            self._reset_pool(pool)
+            raise RenderTimeout(f'图表渲染超时（{self.timeout} 秒）')
+
+    def close(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None and self._pid == os.getpid():
+            pool.terminate()
@@ -4,7 +4,13 @@ import urllib3
 from datetime import datetime, timedelta
 import os
 import time
+import threading
+import queue
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
 from config import get_config
+from download_manifest import DownloadManifest, sha256_file
+from river_archive import RiverArchive
 
 # 忽略SSL警告
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
@@ -29,25 +35,20 @@ os.makedirs(config.data_dir, exist_ok=True)
 # 获取当前日期
 end_date = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
 
+def _default_start_date():
+    """没有任何下载记录时的起始日期：三年前。"""
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    return today - timedelta(days=3*365)
+
 # 查找最后下载的日期
 def find_last_downloaded_date(directory='river_data'):
+    """读取下载清单得到最后成功下载的日期，不再扫描目录。"""
     directory = directory or config.data_dir
-    files = os.listdir(directory)
-    date_pattern = r'river_data_(\d{4}-\d{2}-\d{2})\.json'
-    dates = []
-    for file in files:
-        match = re.match(date_pattern, file)
-        if match:
-            try:
-                date = datetime.strptime(match.group(1), '%Y-%m-%d')
-                dates.append(date)
-            except ValueError:
-                continue
-    if dates:
-        return max(dates)
-    else:
-        # 如果没有找到任何数据文件，返回三年前的日期
-        return end_date - timedelta(days=3*365)
+    last_date = DownloadManifest.load(directory).last_ok_date()
+    if last_date:
+        return last_date
+    # 如果没有找到任何数据文件，返回三年前的日期
+    return _default_start_date()
 
 import re
 
@@ -84,24 +85,49 @@ logger.setLevel(logging.INFO)
 logger.addHandler(file_handler)
 logger.addHandler(console_handler)
 
-def download_one_day(session: requests.Session, date_str: str, data_dir: str, use_headers: dict, use_cookies: dict) -> bool:
-    """下载某一天的数据，成功返回 True，失败返回 False。"""
-    filename = f'{data_dir}/river_data_{date_str}.json'
-    if os.path.exists(filename):
-        return True
+class RateLimiter:
+    """线程安全的限速器：保证相邻两次请求的发起间隔不小于 1/rate 秒。"""
+
+    def __init__(self, rate: float = 0):
+        self.interval = 1.0 / rate if rate and rate > 0 else 0.0
+        self._lock = threading.Lock()
+        self._next_ts = 0.0
+
+    def wait(self):
+        if self.interval <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start_ts = max(now, self._next_ts)
+            self._next_ts = start_ts + self.interval
+        delay = start_ts - now
+        if delay > 0:
+            time.sleep(delay)
+
+
+def make_session(pool_size: int = 1) -> requests.Session:
+    """创建带 keep-alive 连接池的会话，连接池大小与并发数一致，供所有下载线程共享。"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(1, pool_size))
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def fetch_one_day(session: requests.Session, date_str: str, data_dir: str, use_headers: dict, use_cookies: dict,
+                  limiter: RateLimiter = None):
+    """请求某一天的数据，成功返回解析后的响应 dict，失败返回 None（不写归档）。"""
     payload = {"queryDate": date_str}
+    if limiter is not None:
+        limiter.wait()
     try:
         response = session.post(url, headers=use_headers, cookies=use_cookies, json=payload, verify=False, timeout=30)
         if response.status_code == 200:
             try:
                 data = response.json()
                 if data.get('code') == 0:
-                    with open(filename, 'w', encoding='utf-8') as f:
-                        json.dump(data, f, ensure_ascii=False, indent=2)
-                    print(f'  数据已保存到 {filename}')
-                    return True
-                else:
-                    print(f'  请求成功但返回错误码: {data.get("code")}, 消息: {data.get("message")}')
+                    return data
+                print(f'  请求成功但返回错误码: {data.get("code")}, 消息: {data.get("message")}')
             except json.JSONDecodeError:
                 raw_filename = f'{data_dir}/raw_response_{date_str}.txt'
                 with open(raw_filename, 'w', encoding='utf-8') as f:
@@ -111,36 +137,233 @@ def download_one_day(session: requests.Session, date_str: str, data_dir: str, us
             print(f'  请求失败，状态码: {response.status_code}')
     except requests.exceptions.RequestException as e:
         print(f'  请求发生错误: {e}')
-    return False
+    return None
 
-def sync_to_latest(refresh_cookie_on_fail: bool = True) -> dict:
-    """同步数据到当天；仅使用 .env 中的 Cookie/Headers。返回 {success:int, fail:int}."""
-    session = requests.Session()
+
+def _record_existing(archive: RiverArchive, manifest: DownloadManifest, date_str: str):
+    """归档里已有该日期但清单中没有记录时，补记为成功。"""
+    if manifest is None or manifest.is_ok(date_str):
+        return
+    filename = archive.day_path(date_str)
+    if os.path.exists(filename):
+        manifest.record(date_str, True, os.path.getsize(filename), sha256_file(filename))
+    else:
+        manifest.record(date_str, True)
+
+
+def download_one_day(session: requests.Session, date_str: str, data_dir: str, use_headers: dict, use_cookies: dict,
+                     limiter: RateLimiter = None, manifest: DownloadManifest = None,
+                     archive: RiverArchive = None) -> bool:
+    """下载某一天的数据，成功返回 True，失败返回 False；传入 manifest 时记录本次结果。"""
+    archive = archive or RiverArchive(data_dir, config.archive_format)
+    if archive.has_day(date_str):
+        _record_existing(archive, manifest, date_str)
+        return True
+    data = fetch_one_day(session, date_str, data_dir, use_headers, use_cookies, limiter)
+    if data is None:
+        if manifest is not None:
+            manifest.record(date_str, False)
+        return False
+    size, digest = archive.write_day(date_str, data)
+    if manifest is not None:
+        manifest.record(date_str, True, size, digest)
+    print(f'  数据已保存到 {archive.path_for(date_str)}')
+    return True
+
+
+def _file_state(path: str):
+    """文件的 (mtime, 大小)，不存在时为 None"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime, st.st_size
+
+
+def archive_day(archive: RiverArchive, manifest: DownloadManifest, date_str: str, data: dict,
+                rows: int = None, on_archived=None):
+    """写入一天的原始归档并记入下载清单。
+
+    rows 不为 None 表示这一天已经入库，此时调用 on_archived(归档路径, 写入前的 (mtime, 大小), rows)
+    登记导入台账，避免下次 load_data 重新导入这个文件；入库失败（rows 为 None）的日期在清单中记为失败，
+    下次同步会重试，数据则由同步结束时的增量导入从归档补入。
+    """
+    path = archive.path_for(date_str)
+    previous = _file_state(path)
+    size, digest = archive.write_day(date_str, data)
+    manifest.record(date_str, rows is not None, size, digest)
+    if rows is not None and on_archived is not None:
+        try:
+            on_archived(path, previous, rows)
+        except Exception as e:
+            print(f'  {date_str} 登记导入台账失败: {e}')
+
+
+class ArchiveWriter:
+    """后台归档线程：入库之后再异步写原始归档，不占用同步主流程的时间。"""
+
+    def __init__(self, archive: RiverArchive, manifest: DownloadManifest, on_archived=None):
+        self.archive = archive
+        self.manifest = manifest
+        self.on_archived = on_archived
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='archive-writer', daemon=True)
+        self._thread.start()
+
+    def submit(self, date_str: str, data: dict, rows: int = None):
+        """rows 为这一天已入库的行数，未入库时为 None"""
+        self._queue.put((date_str, data, rows))
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            date_str, data, rows = item
+            try:
+                archive_day(self.archive, self.manifest, date_str, data, rows, self.on_archived)
+            except Exception as e:
+                print(f'  {date_str} 写入归档失败: {e}')
+                self.manifest.record(date_str, False)
+
+    def close(self):
+        """等待队列中的归档全部写完。"""
+        self._queue.put(None)
+        self._thread.join()
+
+
+def sync_to_latest(refresh_cookie_on_fail: bool = True, workers: int = None, rate_limit: float = None,
+                   on_day=None, archive_mode: str = None, on_progress=None, on_archived=None) -> dict:
+    """同步数据到当天；仅使用 .env 中的 Cookie/Headers。返回 {success:int, fail:int}.
+
+    :param workers: 最大并发请求数（默认取配置 SYNC_WORKERS），<=1 时逐日串行下载
+    :param rate_limit: 每秒最多发起的请求数（默认取配置 SYNC_RATE_LIMIT），<=0 表示不限速
+    :param on_day: 流式入库回调 on_day(date_str, data) -> 写入行数；每收到一天的响应就在当前线程调用，
+                   此时返回结果中额外包含 rows（入库行数）
+    :param archive_mode: 流式入库时原始归档的写法：async（后台线程写）、sync（立即写）、off（不写），
+                         默认取配置 SYNC_ARCHIVE_MODE；不传 on_day 时总是先写归档
+    :param on_progress: 进度回调 on_progress(已完成天数, 总天数, counts)，开始时和每完成一天时在调用线程中调用
+    :param on_archived: 已入库的日期写入归档后的回调 on_archived(归档路径, 写入前的 (mtime, 大小), 入库行数)，
+                        用于登记导入台账（RiverDataAnalyzer.record_archived）
+    """
+    workers = config.sync_workers if workers is None else workers
+    rate_limit = config.sync_rate_limit if rate_limit is None else rate_limit
+    archive_mode = archive_mode or config.sync_archive_mode
+    workers = max(1, int(workers))
+
+    session = make_session(workers)
+    limiter = RateLimiter(rate_limit)
     use_cookies = config.cookies or {}
     use_headers = headers
 
     data_dir = config.data_dir
-    last_date = find_last_downloaded_date(data_dir)
-    start_date = last_date + timedelta(days=1)
+    manifest = DownloadManifest.load(data_dir)
+    archive = RiverArchive(data_dir, config.archive_format)
     end_date = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
 
-    total_days = (end_date - start_date).days + 1
+    # 一个批次同时覆盖尾部新日期和历史区间中失败/缺失的日期
+    date_strs = manifest.plan(_default_start_date(), end_date, config.sync_max_attempts)
+    total_days = len(date_strs)
+    counts = {"success": 0, "fail": 0, "rows": 0}
+    if on_progress is not None:
+        on_progress(0, total_days, counts)
     if total_days <= 0:
-        return {"success": 0, "fail": 0}
-
-    success_count = 0
-    fail_count = 0
-    current_date = start_date
-    while current_date <= end_date:
-        date_str = current_date.strftime('%Y-%m-%d')
-        print(f'同步 {date_str} ...')
-        ok = download_one_day(session, date_str, data_dir, use_headers, use_cookies)
-        if ok:
-            success_count += 1
+        return {"success": 0, "fail": 0, "rows": 0} if on_day else {"success": 0, "fail": 0}
+
+    writer = ArchiveWriter(archive, manifest, on_archived) if on_day and archive_mode == 'async' else None
+
+    def task(date_str):
+        """在下载线程中执行：返回 (是否成功, 需要交给主线程入库的数据)"""
+        if on_day is None:
+            return download_one_day(session, date_str, data_dir, use_headers, use_cookies, limiter, manifest, archive), None
+        if archive.has_day(date_str):
+            # 归档里已有的数据由同步结束时的增量导入（sync_into）导入
+            _record_existing(archive, manifest, date_str)
+            return True, None
+        data = fetch_one_day(session, date_str, data_dir, use_headers, use_cookies, limiter)
+        if data is None:
+            manifest.record(date_str, False)
+        return data is not None, data
+
+    def deliver(date_str, data):
+        """在调用线程中执行：先入库，再按 archive_mode 写归档。入库失败即算失败（归档照写，下次同步重试）"""
+        try:
+            rows = on_day(date_str, data) or 0
+            counts["rows"] += rows
+        except Exception as e:
+            print(f'  {date_str} 入库失败: {e}')
+            rows = None
+        if writer is not None:
+            writer.submit(date_str, data, rows)
+        elif archive_mode == 'sync':
+            archive_day(archive, manifest, date_str, data, rows, on_archived)
+        else:
+            manifest.record(date_str, rows is not None)
+        return rows is not None
+
+    def finish(date_str, ok, data):
+        if ok and data is not None:
+            ok = deliver(date_str, data)
+        counts["success" if ok else "fail"] += 1
+        if on_progress is not None:
+            on_progress(counts["success"] + counts["fail"], total_days, counts)
+
+    try:
+        if workers == 1:
+            for date_str in date_strs:
+                print(f'同步 {date_str} ...')
+                finish(date_str, *task(date_str))
         else:
-            fail_count += 1
-        current_date += timedelta(days=1)
-    return {"success": success_count, "fail": fail_count}
+            print(f'并发同步 {date_strs[0]} ~ {date_strs[-1]}，共 {total_days} 天（并发 {workers}，限速 {rate_limit or "不限"} 次/秒）')
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = {executor.submit(task, date_str): date_str for date_str in date_strs}
+                for future in as_completed(futures):
+                    date_str = futures[future]
+                    try:
+                        ok, data = future.result()
+                    except Exception as e:
+                        print(f'  {date_str} 下载异常: {e}')
+                        manifest.record(date_str, False)
+                        ok, data = False, None
+                    finish(date_str, ok, data)
+    finally:
+        if writer is not None:
+            writer.close()
+        manifest.save()
+    if on_day is None:
+        counts.pop("rows")
+    return counts
+
+def sync_into(analyzer, **kwargs) -> dict:
+    """边下载边入库同步到最新，返回同 sync_to_latest（rows 含补入的行数）。
+
+    入库失败的日期和归档中已有、未经 on_day 入库的日期，在同步结束后由一次增量导入（按导入台账，
+    只读取未登记的文件）从归档补入；这次补入没成功的，下次同步结束时会再补。
+    """
+    result = sync_to_latest(on_day=analyzer.ingest_day, on_archived=analyzer.record_archived, **kwargs)
+    result['rows'] = result.get('rows', 0) + analyzer.load_data()
+    return result
+
+
+def _open_analyzer():
+    from analyze_river_data import RiverDataAnalyzer
+    return RiverDataAnalyzer(data_dir=config.data_dir, db_path=config.db_path,
+                             import_workers=config.import_workers,
+                             read_pool_size=config.db_read_pool_size, mmap_size_mb=config.db_mmap_mb,
+                             cache_size_mb=config.db_cache_mb, series_cache_mb=config.series_cache_mb,
+                             anomaly_thresholds=config.anomaly_thresholds,
+                             anomaly_window_days=config.anomaly_window_days, anomaly_zscore=config.anomaly_zscore)
+
+
+def _sync_lock():
+    """与 Web 应用的定时同步共用的同步锁，避免同时下载同一批日期"""
+    from sync_scheduler import FileLock, sync_lock_path
+    lock = FileLock(sync_lock_path(config.db_path))
+    if not lock.acquire(blocking=False):
+        print('正在等待其他同步任务结束...')
+        lock.acquire()
+    return lock
+
 
 def main():
     import argparse
@@ -149,6 +372,9 @@ def main():
     parser.add_argument('--check-update', action='store_true', help='检查数据是否需要更新')
     parser.add_argument('--sync', action='store_true', help='同步数据到最新')
     parser.add_argument('--init-db', action='store_true', help='初始化数据库')
+    parser.add_argument('--workers', type=int, default=None, help='最大并发请求数（默认读取 SYNC_WORKERS）')
+    parser.add_argument('--rate', type=float, default=None, help='每秒最多请求数（默认读取 SYNC_RATE_LIMIT）')
+    parser.add_argument('--pack-archive', action='store_true', help='把单日 JSON 文件合并为压缩的月度归档')
     
     args = parser.parse_args()
     
@@ -161,23 +387,32 @@ def main():
             
             if days_behind > 0:
                 print(f"数据落后 {days_behind} 天，需要更新")
-                result = sync_to_latest(refresh_cookie_on_fail=True)
-                print(f"数据更新完成！成功: {result['success']}, 失败: {result['fail']}")
+                with _sync_lock():
+                    result = sync_into(_open_analyzer(), refresh_cookie_on_fail=True, workers=args.workers,
+                                       rate_limit=args.rate)
+                print(f"数据更新完成！成功: {result['success']}, 失败: {result['fail']}, 入库: {result['rows']} 行")
             else:
                 print("数据已是最新")
         elif args.sync:
             # 同步数据
-            result = sync_to_latest(refresh_cookie_on_fail=True)
-            print(f"数据同步完成！成功: {result['success']}, 失败: {result['fail']}")
+            with _sync_lock():
+                result = sync_into(_open_analyzer(), refresh_cookie_on_fail=True, workers=args.workers,
+                                   rate_limit=args.rate)
+            print(f"数据同步完成！成功: {result['success']}, 失败: {result['fail']}, 入库: {result['rows']} 行")
+        elif args.pack_archive:
+            # 转换旧的单日 JSON 为月度压缩归档
+            stats = RiverArchive(config.data_dir).pack()
+            saved = stats['bytes_before'] - stats['bytes_after']
+            print(f"归档完成！合并 {stats['days']} 天到 {stats['months']} 个月度归档，"
+                  f"失败 {stats['failed']}，节省 {saved / 1024 / 1024:.1f} MB")
         elif args.init_db:
             # 初始化数据库
-            from analyze_river_data import RiverDataAnalyzer
-            analyzer = RiverDataAnalyzer(data_dir=config.data_dir, db_path=config.db_path)
+            analyzer = _open_analyzer()
             analyzer.init_database()
             print("数据库初始化完成")
         else:
             # 默认行为：同步数据
-            result = sync_to_latest(refresh_cookie_on_fail=True)
+            result = sync_to_latest(refresh_cookie_on_fail=True, workers=args.workers, rate_limit=args.rate)
             print(f"数据下载完成！成功: {result['success']}, 失败: {result['fail']}")
     except KeyboardInterrupt:
         print('程序被用户中断')
@@ -0,0 +1,188 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+KIND_JSON = 0
+KIND_BYTES = 1
+
+SCHEMA_DDL = [
+    """
+    CREATE TABLE IF NOT EXISTS entries (
+        key TEXT PRIMARY KEY,
+        kind INTEGER NOT NULL,
+        value BLOB NOT NULL,
+        size INTEGER NOT NULL,
+        generation INTEGER NOT NULL,
+        accessed REAL NOT NULL,
+        expires REAL
+    )
+    """,
+    'CREATE INDEX IF NOT EXISTS idx_entries_accessed ON entries (accessed)',
+    # 条目总字节数由触发器维护，写入时不必扫描全表就能判断是否超出上限
+    'CREATE TABLE IF NOT EXISTS cache_meta (id INTEGER PRIMARY KEY CHECK (id = 1), bytes INTEGER NOT NULL)',
+    """
+    CREATE TRIGGER IF NOT EXISTS entries_bytes_insert AFTER INSERT ON entries BEGIN
+        UPDATE cache_meta SET bytes = bytes + NEW.size WHERE id = 1;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS entries_bytes_delete AFTER DELETE ON entries BEGIN
+        UPDATE cache_meta SET bytes = bytes - OLD.size WHERE id = 1;
+    END
+    """,
+    # 旧版本的缓存文件：按现有条目初始化总字节数
+    'INSERT OR IGNORE INTO cache_meta (id, bytes) SELECT 1, COALESCE(SUM(size), 0) FROM entries',
+]
+
+# fork 前的进程留下的连接：子进程中不使用也不关闭，只保留引用
+_inherited = []
+
+# 超出上限时淘汰到上限的这个比例，避免缓存写满后每次写入都触发淘汰
+EVICT_TARGET = 0.9
+
+
+class ResultCache:
+    """各 worker 进程共享的结果缓存（本地 SQLite 文件）。
+
+    - 值可以是可 JSON 序列化的对象或 bytes（例如图片）
+    - 按字节数做 LRU 淘汰：总字节数由触发器维护，超过 max_bytes 时才按访问时间从旧到新淘汰到上限的 90%
+    - 条目带数据代数；写入更新代数的条目时，旧代数的条目立即清除，新数据入库后结果随即刷新
+    - 缓存文件只是加速用，任何读写错误都当作未命中处理
+    """
+
+    # 命中时最多每隔这么多秒更新一次访问时间，避免每次读取都产生写事务
+    TOUCH_INTERVAL = 30
+
+    def __init__(self, path: str, max_bytes: int, ttl_seconds: int = None):
+        self.path = path
+        self.max_bytes = max(0, max_bytes)
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+        self._generation = None
+
+    def _connection(self) -> sqlite3.Connection:
+        # gunicorn --preload 之后 fork 出的 worker 重新打开连接
+        if self._conn is None or self._pid != os.getpid():
+            if self._conn is not None:
+                _inherited.append(self._conn)
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=OFF')
+            # INSERT OR REPLACE 删除旧条目时也触发删除触发器，总字节数才准确
+            conn.execute('PRAGMA recursive_triggers=ON')
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                for ddl in SCHEMA_DDL:
+                    conn.execute(ddl)
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+            self._conn = conn
+            self._pid = os.getpid()
+        return self._conn
+
+    def get(self, key: str):
+        """返回缓存的值，未命中或已过期时返回 None"""
+        if not self.max_bytes:
+            return None
+        now = time.time()
+        try:
+            with self._lock:
+                conn = self._connection()
+                row = conn.execute(
+                    'SELECT kind, value, accessed, expires FROM entries WHERE key=?', (key,)
+                ).fetchone()
+                if row is None:
+                    return None
+                kind, value, accessed, expires = row
+                if expires is not None and expires < now:
+                    conn.execute('DELETE FROM entries WHERE key=?', (key,))
+                    return None
+                if now - accessed > self.TOUCH_INTERVAL:
+                    conn.execute('UPDATE entries SET accessed=? WHERE key=?', (now, key))
+        except sqlite3.Error as e:
+            logger.warning(f"读取结果缓存失败: {e}")
+            return None
+        return bytes(value) if kind == KIND_BYTES else json.loads(value)
+
+    def set(self, key: str, value, generation: int = 0):
+        """写入缓存；generation 为结果对应的数据代数"""
+        if not self.max_bytes:
+            return
+        if isinstance(value, (bytes, bytearray)):
+            kind, blob = KIND_BYTES, bytes(value)
+        else:
+            kind, blob = KIND_JSON, json.dumps(value, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        if len(blob) > self.max_bytes:
+            return
+        now = time.time()
+        expires = now + self.ttl_seconds if self.ttl_seconds else None
+        try:
+            with self._lock:
+                conn = self._connection()
+                conn.execute('BEGIN IMMEDIATE')
+                try:
+                    if self._generation is None or generation > self._generation:
+                        # 数据已更新，旧代数的结果不会再被命中
+                        conn.execute('DELETE FROM entries WHERE generation < ?', (generation,))
+                        self._generation = generation
+                    conn.execute(
+                        'INSERT OR REPLACE INTO entries (key, kind, value, size, generation, accessed, expires) '
+                        'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                        (key, kind, blob, len(blob), generation, now, expires)
+                    )
+                    total = conn.execute('SELECT bytes FROM cache_meta WHERE id = 1').fetchone()[0]
+                    if total > self.max_bytes:
+                        self._evict(conn)
+                    conn.execute('COMMIT')
+                except Exception:
+                    conn.execute('ROLLBACK')
+                    raise
+        except sqlite3.Error as e:
+            logger.warning(f"写入结果缓存失败: {e}")
+
+    def _evict(self, conn):
+        """按访问时间从旧到新删除条目，直到总大小不超过上限的 EVICT_TARGET（在写事务内调用）
+
+        同时按实际条目重算总字节数，纠正可能的计数偏差。
+        """
+        total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+        excess = total - int(self.max_bytes * EVICT_TARGET)
+        doomed = []
+        cursor = conn.execute('SELECT key, size FROM entries ORDER BY accessed')
+        for key, size in cursor:
+            if excess <= 0:
+                break
+            doomed.append((key,))
+            excess -= size
+            total -= size
+        cursor.close()
+        conn.executemany('DELETE FROM entries WHERE key=?', doomed)
+        conn.execute('UPDATE cache_meta SET bytes=? WHERE id = 1', (total,))
+
+    def clear(self):
+        try:
+            with self._lock:
+                self._connection().execute('DELETE FROM entries')
+        except sqlite3.Error as e:
+            logger.warning(f"清空结果缓存失败: {e}")
+
+    def stats(self) -> dict:
+        """条目数与占用字节数"""
+        try:
+            with self._lock:
+                count, size = self._connection().execute(
+                    'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries'
+                ).fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f"读取结果缓存统计失败: {e}")
+            count, size = None, None
+        return {'entries': count, 'bytes': size, 'max_bytes': self.max_bytes}
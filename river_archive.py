@@ -0,0 +1,272 @@
+import os
+import re
+import gzip
+import zlib
+import json
+import hashlib
+import logging
+import calendar
+import threading
+
+ARCHIVE_SUBDIR = 'archive'
+FORMAT_JSON = 'json'
+FORMAT_BUNDLE = 'bundle'
+
+DAY_FILE_PATTERN = re.compile(r'river_data_(\d{4}-\d{2}-\d{2})\.json$')
+BUNDLE_PATTERN = re.compile(r'river_data_(\d{4}-\d{2})\.jsonl\.gz$')
+
+logger = logging.getLogger(__name__)
+
+
+def encode_day(date_str: str, data: dict) -> bytes:
+    """把一天的数据编码为归档中的一行: 'YYYY-MM-DD\\t<紧凑JSON>\\n'。"""
+    payload = json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+    return f'{date_str}\t{payload}\n'.encode('utf-8')
+
+
+def read_day_file(path: str):
+    """读取单日 JSON 文件，返回 [(date_str, data)]。"""
+    match = DAY_FILE_PATTERN.search(os.path.basename(path))
+    if not match:
+        return []
+    with open(path, 'r', encoding='utf-8') as f:
+        return [(match.group(1), json.load(f))]
+
+
+def iter_bundle_lines(path: str, strict: bool = False):
+    """逐行读取月度归档的原始内容，产出 (date_str, line_bytes)，不解析 JSON。
+
+    归档可以由多个 gzip 成员拼接而成（逐日追加）；末尾不完整或损坏的成员（追加时进程中断）被忽略，
+    strict=True 时抛出 EOFError。
+    """
+    with gzip.open(path, 'rb') as f:
+        try:
+            for line in f:
+                yield line.partition(b'\t')[0].decode('ascii'), line
+        except (EOFError, zlib.error, gzip.BadGzipFile) as e:
+            if strict:
+                raise EOFError(str(e)) from e
+            logger.warning(f"归档 {os.path.basename(path)} 末尾不完整，已忽略: {e}")
+
+
+def iter_bundle(path: str, since: str = None):
+    """流式读取月度归档，逐行产出 (date_str, data)；只解析日期大于 since 的行。"""
+    for date_str, line in iter_bundle_lines(path):
+        if since and date_str <= since:
+            continue
+        try:
+            data = json.loads(line.partition(b'\t')[2])
+        except ValueError as e:
+            logger.error(f"归档 {os.path.basename(path)} 中 {date_str} 解析失败: {e}")
+            continue
+        yield date_str, data
+
+
+def read_source(path: str, since: str = None):
+    """按文件类型读取一个数据源（单日 JSON 或月度归档），产出 (date_str, data)。"""
+    if BUNDLE_PATTERN.search(os.path.basename(path)):
+        yield from iter_bundle(path, since)
+    else:
+        for date_str, data in read_day_file(path):
+            if not since or date_str > since:
+                yield date_str, data
+
+
+class RiverArchive:
+    """原始数据归档。
+
+    - json:   每天一个带缩进的 river_data_YYYY-MM-DD.json（旧格式）
+    - bundle: 每月一个 gzip 压缩的 archive/river_data_YYYY-MM.jsonl.gz，每行一天
+
+    读取时两种格式都支持，可以混用；pack() 把旧的单日文件合并进月度归档。
+    逐日写入月度归档时把新的一天作为独立的 gzip 成员追加到文件末尾，写入该月最后一天时
+    （或写入的日期不在末尾时）再把整月重新压缩为一个成员。
+    """
+
+    def __init__(self, data_dir: str, fmt: str = FORMAT_BUNDLE):
+        self.data_dir = data_dir
+        self.fmt = fmt if fmt in (FORMAT_JSON, FORMAT_BUNDLE) else FORMAT_BUNDLE
+        self.bundle_dir = os.path.join(data_dir, ARCHIVE_SUBDIR)
+        self._lock = threading.RLock()
+        self._bundle_dates = {}
+
+    def day_path(self, date_str: str) -> str:
+        return os.path.join(self.data_dir, f'river_data_{date_str}.json')
+
+    def bundle_path(self, month: str) -> str:
+        return os.path.join(self.bundle_dir, f'river_data_{month}.jsonl.gz')
+
+    def path_for(self, date_str: str) -> str:
+        """按当前写入格式，某天数据所在的文件。"""
+        if self.fmt == FORMAT_JSON:
+            return self.day_path(date_str)
+        return self.bundle_path(date_str[:7])
+
+    def _read_bundle_lines(self, month: str) -> dict:
+        """读取某月归档的原始行 {date_str: line_bytes}，不解析 JSON。"""
+        path = self.bundle_path(month)
+        if not os.path.exists(path):
+            return {}
+        return dict(iter_bundle_lines(path))
+
+    def _bundle_state(self, month: str):
+        try:
+            st = os.stat(self.bundle_path(month))
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def _scan_bundle(self, month: str):
+        """某月归档中已有的日期及归档是否完整 (dates, complete)；按文件 mtime/大小缓存，文件被改写过时重新读取"""
+        state = self._bundle_state(month)
+        cached = self._bundle_dates.get(month)
+        if cached is None or cached[0] != state:
+            dates, complete = set(), True
+            if state:
+                try:
+                    for date_str, _ in iter_bundle_lines(self.bundle_path(month), strict=True):
+                        dates.add(date_str)
+                except EOFError:
+                    complete = False
+            cached = self._bundle_dates[month] = (state, dates, complete)
+        return cached[1], cached[2]
+
+    def _dates_in_bundle(self, month: str) -> set:
+        return self._scan_bundle(month)[0]
+
+    def has_day(self, date_str: str) -> bool:
+        if os.path.exists(self.day_path(date_str)):
+            return True
+        with self._lock:
+            return date_str in self._dates_in_bundle(date_str[:7])
+
+    def write_day(self, date_str: str, data: dict):
+        """写入一天的数据，返回 (写入字节数, sha256)。"""
+        if self.fmt == FORMAT_JSON:
+            raw = json.dumps(data, ensure_ascii=False, indent=2).encode('utf-8')
+            with open(self.day_path(date_str), 'wb') as f:
+                f.write(raw)
+            return len(raw), hashlib.sha256(raw).hexdigest()
+        line = encode_day(date_str, data)
+        month = date_str[:7]
+        with self._lock:
+            dates, complete = self._scan_bundle(month)
+            year, mon = int(month[:4]), int(month[5:])
+            last_day = f'{month}-{calendar.monthrange(year, mon)[1]:02d}'
+            # 更正已有日期、补写较早的日期、写入月末或归档末尾损坏时整月重写，否则追加
+            if not complete or date_str in dates or date_str == last_day or (dates and date_str < max(dates)):
+                self._write_bundle_lines(month, {date_str: line})
+            else:
+                self._append_bundle_line(month, date_str, line)
+        return len(line), hashlib.sha256(line).hexdigest()
+
+    def _append_bundle_line(self, month: str, date_str: str, line: bytes):
+        """把新的一天作为独立的 gzip 成员追加到该月归档末尾（日期晚于归档中已有的全部日期时使用）"""
+        os.makedirs(self.bundle_dir, exist_ok=True)
+        member = gzip.compress(line, compresslevel=6)
+        with open(self.bundle_path(month), 'ab') as f:
+            size = f.tell()
+            try:
+                f.write(member)
+                f.flush()
+            except BaseException:
+                f.truncate(size)
+                raise
+        dates = self._dates_in_bundle(month) | {date_str}
+        self._bundle_dates[month] = (self._bundle_state(month), dates, True)
+
+    def _write_bundle_lines(self, month: str, new_lines: dict):
+        """合并新行并整体重写该月归档（按日期排序，原子替换）。
+
+        整月一起压缩为一个 gzip 成员，能最大程度消除每天重复的河流/站点结构。
+        临时文件名带进程号和线程号，并发的写入不会共用同一个临时文件。
+        """
+        os.makedirs(self.bundle_dir, exist_ok=True)
+        with self._lock:
+            lines = self._read_bundle_lines(month)
+            lines.update(new_lines)
+            path = self.bundle_path(month)
+            tmp_path = f'{path}.{os.getpid()}-{threading.get_ident()}.tmp'
+            try:
+                with gzip.open(tmp_path, 'wb', compresslevel=6) as f:
+                    for date_str in sorted(lines):
+                        f.write(lines[date_str])
+                os.replace(tmp_path, path)
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+            self._bundle_dates[month] = (self._bundle_state(month), set(lines), True)
+
+    def bundles(self) -> list:
+        """所有月度归档路径，按月份排序。"""
+        keyed = []
+        if os.path.isdir(self.bundle_dir):
+            for entry in os.scandir(self.bundle_dir):
+                match = BUNDLE_PATTERN.match(entry.name)
+                if match:
+                    keyed.append((match.group(1), entry.path))
+        return [path for _, path in sorted(keyed)]
+
+    def sources(self, since: str = None) -> list:
+        """所有数据源文件路径（月度归档 + 单日 JSON），按日期排序。
+
+        since 为 'YYYY-MM-DD' 时，跳过早于其所在月份的归档和不晚于它的单日文件。
+        """
+        since_month = since[:7] if since else None
+        keyed = []
+        for path in self.bundles():
+            month = BUNDLE_PATTERN.search(os.path.basename(path)).group(1)
+            if not since_month or month >= since_month:
+                keyed.append((month, path))
+        if os.path.isdir(self.data_dir):
+            for entry in os.scandir(self.data_dir):
+                match = DAY_FILE_PATTERN.match(entry.name)
+                if match and (not since or match.group(1) > since):
+                    keyed.append((match.group(1), entry.path))
+        return [path for _, path in sorted(keyed)]
+
+    def iter_days(self, since: str = None):
+        """流式产出 (date_str, data)；since 为 'YYYY-MM-DD' 时跳过该日期及之前的数据。
+
+        早于 since 所在月份的归档文件不会被打开。
+        """
+        for path in self.sources(since):
+            try:
+                yield from read_source(path, since)
+            except (OSError, ValueError, EOFError) as e:
+                logger.error(f"读取 {os.path.basename(path)} 出错: {e}")
+
+    def pack(self, remove_loose: bool = True) -> dict:
+        """把目录下所有单日 JSON 合并进月度归档，返回转换统计。"""
+        by_month = {}
+        for entry in os.scandir(self.data_dir):
+            match = DAY_FILE_PATTERN.match(entry.name)
+            if match:
+                by_month.setdefault(match.group(1)[:7], []).append((match.group(1), entry.path))
+
+        stats = {'days': 0, 'months': 0, 'bytes_before': 0, 'bytes_after': 0, 'failed': 0}
+        for month in sorted(by_month):
+            new_lines = {}
+            packed_paths = []
+            for date_str, path in sorted(by_month[month]):
+                try:
+                    with open(path, 'r', encoding='utf-8') as f:
+                        data = json.load(f)
+                except (OSError, ValueError) as e:
+                    logger.error(f"无法读取 {path}: {e}")
+                    stats['failed'] += 1
+                    continue
+                new_lines[date_str] = encode_day(date_str, data)
+                packed_paths.append(path)
+                stats['bytes_before'] += os.path.getsize(path)
+            if not new_lines:
+                continue
+            self._write_bundle_lines(month, new_lines)
+            stats['days'] += len(new_lines)
+            stats['months'] += 1
+            stats['bytes_after'] += os.path.getsize(self.bundle_path(month))
+            if remove_loose:
+                for path in packed_paths:
+                    os.remove(path)
+        return stats
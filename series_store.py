@@ -0,0 +1,299 @@
+import struct
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+# 每行占用：int32 日期 + float64 水位 + float64 流量
+ROW_BYTES = 4 + 8 + 8
+MIN_CAPACITY = 64
+
+
+def date_ints_to_days(date_ints) -> np.ndarray:
+    """YYYYMMDD 整数 -> 距 1970-01-01 的天数（int32）"""
+    d = np.asarray(date_ints, dtype=np.int64)
+    months = (d // 10000 - 1970) * 12 + (d // 100 % 100 - 1)
+    days = months.astype('datetime64[M]').astype('datetime64[D]') + (d % 100 - 1)
+    return days.astype(np.int64).astype(np.int32)
+
+
+def date_str_to_day(date_str: str) -> int:
+    """'YYYY-MM-DD' -> 距 1970-01-01 的天数"""
+    return int(np.datetime64(date_str, 'D').astype(np.int64))
+
+
+def days_to_strings(days) -> list:
+    """天数（或 datetime64[D]）数组 -> ['YYYY-MM-DD', ...]"""
+    return np.datetime_as_string(np.asarray(days).astype('datetime64[D]'), unit='D').tolist()
+
+
+class StationSeries:
+    """单个站点的列式时序：按日期升序的 days/z/q 三个数组，预留容量以便原地追加。
+
+    (days, z, q, n) 作为一个元组整体替换，读取方拿到的总是一致的快照；
+    追加只写入快照长度之外的预留空间，不会改动已交给调用方的视图。
+    """
+
+    __slots__ = ('_state',)
+
+    def __init__(self, days, z, q):
+        n = len(days)
+        capacity = max(MIN_CAPACITY, n)
+        buffers = (np.empty(capacity, dtype=np.int32),
+                   np.empty(capacity, dtype=np.float64),
+                   np.empty(capacity, dtype=np.float64))
+        for buf, values in zip(buffers, (days, z, q)):
+            buf[:n] = values
+        self._state = buffers + (n,)
+
+    @property
+    def n(self) -> int:
+        return self._state[3]
+
+    @property
+    def nbytes(self) -> int:
+        return len(self._state[0]) * ROW_BYTES
+
+    def arrays(self):
+        """返回 (days, z, q) 视图"""
+        days, z, q, n = self._state
+        return days[:n], z[:n], q[:n]
+
+    def slice(self, lo_day=None, hi_day=None):
+        """二分查找 [lo_day, hi_day] 范围，返回 (days, z, q) 视图"""
+        days, z, q, n = self._state
+        days = days[:n]
+        lo = 0 if lo_day is None else int(np.searchsorted(days, lo_day, side='left'))
+        hi = n if hi_day is None else int(np.searchsorted(days, hi_day, side='right'))
+        return days[lo:hi], z[lo:hi], q[lo:hi]
+
+    def replace_days(self, replaced, days, z, q):
+        """整体替换若干日期的数据（与数据库中先删除该日再插入的语义一致）。
+
+        新日期都在已有数据之后时（日常增量）直接追加到预留容量中；否则重建数组。
+        """
+        cur_days, cur_z, cur_q = self.arrays()
+        n = len(cur_days)
+        last = cur_days[-1] if n else None
+        if last is None or (replaced.min() > last and (len(days) == 0 or days[0] > last)):
+            self._append(days, z, q)
+            return
+        keep = ~np.isin(cur_days, replaced)
+        all_days = np.concatenate([cur_days[keep], days])
+        order = np.argsort(all_days, kind='stable')
+        rebuilt = StationSeries(all_days[order],
+                                np.concatenate([cur_z[keep], z])[order],
+                                np.concatenate([cur_q[keep], q])[order])
+        self._state = rebuilt._state
+
+    def _append(self, days, z, q):
+        buffers, n = self._state[:3], self._state[3]
+        need = n + len(days)
+        if need > len(buffers[0]):
+            capacity = max(need, len(buffers[0]) * 2)
+            grown = []
+            for old in buffers:
+                buf = np.empty(capacity, dtype=old.dtype)
+                buf[:n] = old[:n]
+                grown.append(buf)
+            buffers = tuple(grown)
+        for buf, values in zip(buffers, (days, z, q)):
+            buf[n:need] = values
+        self._state = buffers + (need,)
+
+
+class SeriesStore:
+    """进程内的站点时序缓存（LRU，按内存预算淘汰）。
+
+    缓存与数据库的一致性由数据代数（data_generation）保证：
+    - 本进程写入后调用 apply()，把新数据原地合并进已缓存的站点，代数 +1
+    - 读取时带上数据库中的当前代数，若比缓存新（例如其他 gunicorn worker 写入过），整体清空
+    """
+
+    def __init__(self, budget_mb: int = 256):
+        self.budget_bytes = max(0, budget_mb) * 1024 * 1024
+        self.generation = None
+        self._series = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _sync_generation(self, generation):
+        if self.generation is None or generation > self.generation:
+            self._clear()
+            self.generation = generation
+
+    def _clear(self):
+        self._series.clear()
+        self._bytes = 0
+
+    def _evict(self):
+        while self._bytes > self.budget_bytes and self._series:
+            _, series = self._series.popitem(last=False)
+            self._bytes -= series.nbytes
+            self.evictions += 1
+
+    def get(self, station_id, generation, loader) -> StationSeries:
+        """取站点时序；未缓存时调用 loader() -> (date_ints, z, q) 从数据库加载"""
+        with self._lock:
+            self._sync_generation(generation)
+            series = self._series.get(station_id)
+            if series is not None and generation == self.generation:
+                self._series.move_to_end(station_id)
+                self.hits += 1
+                return series
+            self.misses += 1
+
+        date_ints, z, q = loader()
+        series = StationSeries(date_ints_to_days(date_ints), z, q)
+        with self._lock:
+            # 加载期间有新的写入时不缓存这份（可能已过期的）结果
+            if generation == self.generation and station_id not in self._series and self.budget_bytes:
+                self._series[station_id] = series
+                self._bytes += series.nbytes
+                self._evict()
+        return series
+
+    def station_ids(self) -> set:
+        """当前已缓存的站点（写入前记下，写入时只需收集这些站点的新数据）"""
+        with self._lock:
+            return set(self._series)
+
+    def apply(self, generation, replaced_date_ints, observations, tracked, base_generation=None):
+        """写入提交后调用：把 [(station_id, date_int, z, q)] 合并进已缓存的站点。
+
+        :param generation: 写入后的数据代数
+        :param base_generation: 这批变化之前的代数，默认 generation - 1（本进程的单次写入）；
+                                缓存不处于该代数时无法增量合并，直接清空
+        :param replaced_date_ints: 本次整体替换的日期
+        :param tracked: 写入开始时的 station_ids()，observations 只包含这些站点；
+                        写入期间才加载进缓存的站点可能缺少新数据，直接丢弃
+        """
+        with self._lock:
+            if base_generation is None:
+                base_generation = generation - 1
+            if self.generation is None or self.generation != base_generation:
+                # 中间有未见过的写入，无法增量合并
+                self._clear()
+                self.generation = generation
+                return
+            self.generation = generation
+            by_station = {}
+            for station_id, date_int, z, q in observations:
+                by_station.setdefault(station_id, []).append((date_int, z, q))
+            replaced = date_ints_to_days(sorted(replaced_date_ints))
+            no_rows = np.empty(0, dtype=np.int32)
+            for station_id in list(self._series):
+                series = self._series[station_id]
+                if station_id not in tracked:
+                    del self._series[station_id]
+                    self._bytes -= series.nbytes
+                    continue
+                rows = sorted(by_station.get(station_id, ()))
+                before = series.nbytes
+                if rows:
+                    date_ints, z, q = zip(*rows)
+                    series.replace_days(replaced, date_ints_to_days(date_ints), z, q)
+                else:
+                    series.replace_days(replaced, no_rows, (), ())
+                self._bytes += series.nbytes - before
+            self._evict()
+
+    def invalidate(self, generation=None):
+        with self._lock:
+            self._clear()
+            if generation is not None:
+                self.generation = generation
+
+    def stats(self) -> dict:
+        """内存占用报告"""
+        with self._lock:
+            rows = sum(series.n for series in self._series.values())
+            return {
+                'stations': len(self._series),
+                'rows': rows,
+                'bytes': self._bytes,
+                'budget_bytes': self.budget_bytes,
+                'generation': self.generation,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+def _minmax_pick(n: int, buckets: int, columns) -> np.ndarray:
+    """分成 buckets 个等长的桶，取每桶各列最小、最大值所在的下标和首尾两点（升序、去重）"""
+    size = -(-n // buckets)
+    buckets = -(-n // size)
+    pad = buckets * size - n
+    offsets = np.arange(buckets) * size
+    picked = [np.array([0, n - 1])]
+    for col in columns:
+        col = np.asarray(col, dtype=np.float64)
+        for fill, arg in ((np.inf, np.argmin), (-np.inf, np.argmax)):
+            grid = np.concatenate([col, np.full(pad, fill)]).reshape(buckets, size)
+            picked.append(offsets + arg(grid, axis=1))
+    return np.unique(np.concatenate(picked))
+
+
+def minmax_indices(n: int, max_points: int, *columns) -> np.ndarray:
+    """min/max 分桶降采样，返回要保留的下标（升序）。
+
+    按下标把序列等分成若干桶，每个桶保留每一列的最小值和最大值所在的点，
+    再加上首尾两点；峰值和谷值都不会被抹掉。结果不超过 max_points 个点，并尽量接近 max_points：
+    各列的极值常落在同一个点上（水位和流量同涨同落），每桶实际保留的点数少于 2 × 列数，
+    所以按实际点数二分查找桶数；桶长取整后剩下的名额再用均匀间隔的点补齐。
+    """
+    lo = max(1, (max_points - 2) // (2 * max(1, len(columns))))
+    best = _minmax_pick(n, lo, columns)
+    hi = max(lo, min(n, max_points - 2))
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        idx = _minmax_pick(n, mid, columns)
+        if len(idx) <= max_points:
+            lo, best = mid, idx
+        else:
+            hi = mid - 1
+    spare = min(max_points, n) - len(best)
+    if spare > 0:
+        rest = np.setdiff1d(np.arange(n), best, assume_unique=True)
+        fill = rest[np.linspace(0, len(rest) - 1, spare).round().astype(int)]
+        best = np.union1d(best, fill)
+    return best
+
+
+def downsample(dates, levels, flows, max_points=None):
+    """点数超过 max_points 时对 (dates, levels, flows) 做 min/max 分桶降采样。
+
+    返回 (dates, levels, flows, 是否降采样)。
+    """
+    n = len(dates)
+    if not max_points or n <= max_points:
+        return dates, levels, flows, False
+    idx = minmax_indices(n, max_points, levels, flows)
+    return dates[idx], levels[idx], flows[idx], True
+
+
+# /timeseries 二进制格式（小端）：
+#   16 字节头: magic 'RVTS' | uint16 版本 | uint16 标志（bit0 已降采样）| uint32 点数 n | uint32 降采样前点数
+#   int32[n] 距 1970-01-01 的天数 | float32[n] 水位 | float32[n] 流量
+# 各段都按 4 字节对齐，浏览器端可直接在 ArrayBuffer 上建 Int32Array/Float32Array 视图
+SERIES_MAGIC = b'RVTS'
+SERIES_VERSION = 1
+SERIES_HEADER = struct.Struct('<4sHHII')
+SERIES_MIMETYPE = 'application/octet-stream'
+
+
+def pack_series(dates, levels, flows, downsampled=False, total_points=None) -> bytes:
+    """把 (dates, levels, flows) 打包成上述二进制格式，各列直接写入输出缓冲区"""
+    n = len(dates)
+    buf = bytearray(SERIES_HEADER.size + n * 12)
+    SERIES_HEADER.pack_into(buf, 0, SERIES_MAGIC, SERIES_VERSION, 1 if downsampled else 0,
+                            n, n if total_points is None else total_points)
+    offset = SERIES_HEADER.size
+    for values, dtype in ((np.asarray(dates).view(np.int64), '<i4'), (levels, '<f4'), (flows, '<f4')):
+        np.frombuffer(buf, dtype=dtype, count=n, offset=offset)[:] = values
+        offset += n * 4
+    return bytes(buf)
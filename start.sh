@@ -22,19 +22,13 @@ if [ ! -f "$DB_PATH" ]; then
     python /app/analyze_river_data.py --init-db
 fi
 
-# 启动时检查数据是否需要更新
-echo "检查数据是否需要更新..."
-python /app/request_river_data.py --check-update
-
-# 启动cron服务（后台运行）
-echo "启动定时任务服务..."
-echo "0 12 * * * cd /app && python request_river_data.py --sync >> /var/log/app/cron.log 2>&1" | crontab -
-cron -f &
-CRON_PID=$!
+# 数据导入在各 worker 启动后的后台预热中进行（见 gunicorn.conf.py），不阻塞启动；
+# 定时同步由应用内的调度器完成（各 worker 选出一个 leader，见 sync_scheduler.py），不再使用 cron
 
 # 启动Web服务
 echo "启动Web服务..."
 exec gunicorn \
+    -c /app/gunicorn.conf.py \
     -w 2 \
     -b 0.0.0.0:5001 \
     --timeout 300 \
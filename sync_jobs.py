@@ -0,0 +1,165 @@
+import os
+import time
+import uuid
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+SYNC_JOBS_DDL = """
+CREATE TABLE IF NOT EXISTS sync_jobs (
+    id TEXT PRIMARY KEY,
+    state TEXT NOT NULL,
+    total_days INTEGER,
+    days_done INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0,
+    rows INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    owner_pid INTEGER,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+)
+"""
+
+JOB_COLUMNS = ('id', 'state', 'total_days', 'days_done', 'failed', 'rows', 'error',
+               'owner_pid', 'created_at', 'started_at', 'finished_at')
+ACTIVE_STATES = ('queued', 'running')
+
+
+def _pid_alive(pid) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, TypeError):
+        return True
+    return True
+
+
+def _format_job(row) -> dict:
+    job = dict(zip(JOB_COLUMNS, row))
+    job.pop('owner_pid')
+    started, finished = job['started_at'], job['finished_at']
+    elapsed = ((finished or time.time()) - started) if started else 0
+    job['elapsed_seconds'] = round(elapsed, 1)
+    job['days_per_second'] = round(job['days_done'] / elapsed, 2) if elapsed > 0 else None
+    job['rows_per_second'] = round(job['rows'] / elapsed, 1) if elapsed > 0 else None
+    for key in ('created_at', 'started_at', 'finished_at'):
+        if job[key]:
+            job[key] = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(job[key]))
+    return job
+
+
+class SyncJobs:
+    """后台同步任务：提交后立即返回任务 id，同步在后台线程中执行，进度写入数据库的 sync_jobs 表，
+    任何 worker 都能查询。
+
+    - 已有排队或运行中的任务时，重复提交直接返回该任务（跨 worker 去重）
+    - 执行任务的进程退出后，未结束的任务在下次读取时标记为 interrupted
+    - 进度最多每 progress_interval 秒写一次数据库
+    - 任务状态通过独立的短时写连接读写，不会被占用进程写连接的导入（如启动时的全量导入）阻塞
+    """
+
+    def __init__(self, db, run_sync, keep: int = 100, progress_interval: float = 1.0):
+        """
+        :param db: ConnectionManager
+        :param run_sync: run_sync(on_progress) -> 结果字典，on_progress 签名同 sync_to_latest
+        :param keep: 保留的历史任务数
+        """
+        self.db = db
+        self.run_sync = run_sync
+        self.keep = keep
+        self.progress_interval = progress_interval
+        with self.db.short_writer() as conn:
+            conn.execute(SYNC_JOBS_DDL)
+
+    def submit(self):
+        """提交同步任务，返回 (任务, 是否新建)"""
+        now = time.time()
+        with self.db.short_writer() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                self._expire_orphans(conn)
+                row = conn.execute(
+                    f"SELECT {', '.join(JOB_COLUMNS)} FROM sync_jobs WHERE state IN ('queued', 'running') "
+                    "ORDER BY created_at LIMIT 1"
+                ).fetchone()
+                if row is not None:
+                    conn.execute('COMMIT')
+                    return _format_job(row), False
+                job_id = uuid.uuid4().hex
+                conn.execute(
+                    'INSERT INTO sync_jobs (id, state, owner_pid, created_at) VALUES (?, ?, ?, ?)',
+                    (job_id, 'queued', os.getpid(), now)
+                )
+                conn.execute(
+                    'DELETE FROM sync_jobs WHERE id NOT IN (SELECT id FROM sync_jobs ORDER BY created_at DESC LIMIT ?)',
+                    (self.keep,)
+                )
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+        threading.Thread(target=self._run, args=(job_id,), name=f'sync-job-{job_id[:8]}', daemon=True).start()
+        return self.get(job_id), True
+
+    def get(self, job_id):
+        """查询任务进度，不存在时返回 None"""
+        with self.db.reader() as conn:
+            row = conn.execute(f"SELECT {', '.join(JOB_COLUMNS)} FROM sync_jobs WHERE id=?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        if row[1] in ACTIVE_STATES and not _pid_alive(row[7]):
+            self._expire_orphans()
+            return self.get(job_id)
+        return _format_job(row)
+
+    def recent(self, limit: int = 20) -> list:
+        """最近的任务（新的在前）"""
+        with self.db.reader() as conn:
+            rows = conn.execute(
+                f"SELECT {', '.join(JOB_COLUMNS)} FROM sync_jobs ORDER BY created_at DESC LIMIT ?", (limit,)
+            ).fetchall()
+        return [_format_job(row) for row in rows]
+
+    def _expire_orphans(self, conn=None):
+        # 执行进程已退出但状态仍为排队/运行中的任务
+        if conn is None:
+            with self.db.short_writer() as conn:
+                return self._expire_orphans(conn)
+        rows = conn.execute("SELECT id, owner_pid FROM sync_jobs WHERE state IN ('queued', 'running')").fetchall()
+        for job_id, pid in rows:
+            if not _pid_alive(pid):
+                conn.execute(
+                    "UPDATE sync_jobs SET state='interrupted', error=?, finished_at=? WHERE id=?",
+                    ('执行任务的进程已退出', time.time(), job_id)
+                )
+
+    def _update(self, job_id, **fields):
+        assignments = ', '.join(f'{key}=?' for key in fields)
+        with self.db.short_writer() as conn:
+            conn.execute(f'UPDATE sync_jobs SET {assignments} WHERE id=?', (*fields.values(), job_id))
+
+    def _run(self, job_id):
+        last_write = 0.0
+
+        def on_progress(done, total, counts):
+            nonlocal last_write
+            now = time.time()
+            if done == 0:
+                # 取得同步锁，开始执行
+                self._update(job_id, state='running', started_at=now, total_days=total)
+                last_write = now
+            elif now - last_write >= self.progress_interval or done == total:
+                self._update(job_id, days_done=done, failed=counts['fail'], rows=counts.get('rows', 0))
+                last_write = now
+
+        try:
+            result = self.run_sync(on_progress)
+            self._update(job_id, state='done', finished_at=time.time(),
+                         days_done=result.get('success', 0) + result.get('fail', 0),
+                         failed=result.get('fail', 0), rows=result.get('rows', 0))
+        except Exception as e:
+            logger.exception(f'同步任务 {job_id} 失败')
+            self._update(job_id, state='failed', error=str(e), finished_at=time.time())
@@ -0,0 +1,174 @@
+import os
+import time
+import logging
+import threading
+from datetime import datetime, timedelta
+
+try:
+    import fcntl  # 跨进程文件锁，Windows 上没有（此时退化为单进程语义）
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+def sync_lock_path(db_path: str) -> str:
+    """同步执行锁：定时同步、/sync_now 和命令行同步都在该锁内执行，互不重叠"""
+    return db_path + '.sync.lock'
+
+
+def leader_lock_path(db_path: str) -> str:
+    """调度 leader 锁：由 leader 进程一直持有，进程退出后自动释放"""
+    return db_path + '.sync-leader.lock'
+
+
+class FileLock:
+    """基于 flock 的跨进程排他锁（同一主机上的 gunicorn worker 与命令行工具之间）"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = None
+
+    @property
+    def held(self) -> bool:
+        return self._file is not None
+
+    def acquire(self, blocking: bool = True) -> bool:
+        lock_file = open(self.path, 'a')
+        if fcntl is not None:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                lock_file.close()
+                return False
+        self._file = lock_file
+        return True
+
+    def release(self):
+        if self._file is not None:
+            # 关闭文件即释放 flock
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        if not self.held:
+            self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+
+
+def next_run_time(now: datetime, interval: timedelta, anchor: str = None) -> datetime:
+    """下一次同步时间：从当天的 anchor（'HH:MM'）起每隔 interval 一次；没有 anchor 时为 now + interval"""
+    if not anchor:
+        return now + interval
+    hour, minute = (int(part) for part in anchor.split(':'))
+    start = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if start > now:
+        start -= timedelta(days=1)
+    periods = (now - start) // interval + 1
+    return start + periods * interval
+
+
+class SyncScheduler:
+    """进程内的定时增量同步，多个 worker 之间选出唯一的 leader。
+
+    - 每个 worker 各运行一个调度线程，非阻塞地争抢 leader 锁；取得锁的 worker 成为 leader，
+      立即同步一次（启动同步），之后按 interval/anchor 定时同步
+    - 其他 worker 每隔 poll_seconds 重试一次（leader 退出后锁自动释放，由它们接管），
+      并调用 on_poll 通过数据代数刷新本进程的河流目录和缓存
+    - 每次同步（定时、run_now、命令行）都在同步执行锁内进行，不会重叠下载
+    """
+
+    def __init__(self, run_sync, db_path: str, interval_minutes: float = 1440, anchor: str = None,
+                 poll_seconds: float = 30, on_poll=None):
+        """
+        :param run_sync: 执行一次同步的函数 run_sync(on_progress=None)，返回结果字典
+        :param interval_minutes: 同步间隔（分钟），<=0 表示不定时同步
+        :param anchor: 每天的基准时间 'HH:MM'，同步时间为 anchor + k * interval
+        :param on_poll: 每次轮询时调用（leader 和 follower 都会调用）
+        """
+        self.run_sync = run_sync
+        self.interval = timedelta(minutes=interval_minutes) if interval_minutes > 0 else None
+        self.anchor = anchor or None
+        self.poll_seconds = poll_seconds
+        self.on_poll = on_poll
+        self._leader_lock = FileLock(leader_lock_path(db_path))
+        self._sync_lock_path = sync_lock_path(db_path)
+        self._pid = None
+        self._start_lock = threading.Lock()
+        self.next_run = None
+        self.last_run = None
+        self.last_result = None
+        self.last_error = None
+        self.running = False
+
+    @property
+    def is_leader(self) -> bool:
+        return self._leader_lock.held and self._pid == os.getpid()
+
+    def start(self):
+        """在当前进程启动调度线程（每个进程只启动一次）"""
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            if self._pid is not None:
+                # fork 前的进程持有的锁属于父进程，子进程中只丢弃引用
+                self._leader_lock = FileLock(self._leader_lock.path)
+            self._pid = os.getpid()
+        threading.Thread(target=self._loop, name='sync-scheduler', daemon=True).start()
+
+    def run_now(self, **kwargs) -> dict:
+        """立即同步一次（等待正在进行的同步结束后执行），返回同步结果；kwargs 传给 run_sync"""
+        with FileLock(self._sync_lock_path):
+            self.running = True
+            try:
+                result = self.run_sync(**kwargs)
+                self.last_result, self.last_error = result, None
+                return result
+            except Exception as e:
+                self.last_error = str(e)
+                raise
+            finally:
+                self.running = False
+                self.last_run = datetime.now()
+
+    def _loop(self):
+        while True:
+            if self.interval is not None and not self.is_leader and self._leader_lock.acquire(blocking=False):
+                logger.info(f"进程 {os.getpid()} 成为同步 leader")
+                # 成为 leader 后先同步一次（启动前刚同步过时按计划时间进行）
+                if self.last_run is None:
+                    self.next_run = datetime.now()
+                else:
+                    self.next_run = next_run_time(datetime.now(), self.interval, self.anchor)
+            if self.is_leader and datetime.now() >= self.next_run:
+                try:
+                    result = self.run_now()
+                    logger.info(f"定时同步完成: {result}")
+                except Exception as e:
+                    logger.warning(f"定时同步失败: {e}")
+                self.next_run = next_run_time(datetime.now(), self.interval, self.anchor)
+            if self.on_poll is not None:
+                try:
+                    self.on_poll()
+                except Exception as e:
+                    logger.warning(f"刷新数据目录失败: {e}")
+            timeout = self.poll_seconds
+            if self.is_leader:
+                timeout = min(timeout, max(0.0, (self.next_run - datetime.now()).total_seconds()))
+            time.sleep(timeout)
+
+    def status(self) -> dict:
+        """本进程看到的调度状态"""
+        def fmt(value):
+            return value.strftime('%Y-%m-%d %H:%M:%S') if value else None
+        return {
+            'leader': self.is_leader,
+            'running': self.running,
+            'next_run': fmt(self.next_run) if self.is_leader else None,
+            'last_run': fmt(self.last_run),
+            'last_result': self.last_result,
+            'last_error': self.last_error,
+        }
@@ -0,0 +1,52 @@
+"""series_store 降采样测试：python -m unittest discover -s tests"""
+import os
+import sys
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from series_store import downsample, minmax_indices  # noqa: E402
+
+
+def _series(n, seed=0):
+    """多年日序列：季节性流量，水位随流量同涨同落（极值常落在同一天）"""
+    rng = np.random.default_rng(seed)
+    t = np.arange(n)
+    flows = 50 + 40 * np.sin(2 * np.pi * t / 365) + rng.gamma(1.0, 3.0, n)
+    levels = 40 + 0.05 * flows
+    return levels, flows
+
+
+class MinmaxIndicesTest(unittest.TestCase):
+    def test_count_close_to_budget(self):
+        for n in (400, 365 * 6, 20000):
+            levels, flows = _series(n)
+            for max_points in (10, 50, 200, 1000):
+                if max_points >= n:
+                    continue
+                idx = minmax_indices(n, max_points, levels, flows)
+                self.assertLessEqual(len(idx), max_points)
+                self.assertGreaterEqual(len(idx), 0.9 * max_points, (n, max_points))
+
+    def test_keeps_extremes_and_endpoints(self):
+        n = 365 * 6
+        levels, flows = _series(n)
+        idx = minmax_indices(n, 50, levels, flows)
+        self.assertTrue(np.all(np.diff(idx) > 0))
+        self.assertEqual((idx[0], idx[-1]), (0, n - 1))
+        for col in (levels, flows):
+            self.assertIn(col.argmax(), idx)
+            self.assertIn(col.argmin(), idx)
+
+    def test_downsample_passthrough_when_short(self):
+        levels, flows = _series(30)
+        dates = np.arange(30)
+        out = downsample(dates, levels, flows, max_points=50)
+        self.assertFalse(out[3])
+        self.assertEqual(len(out[0]), 30)
+
+
+if __name__ == '__main__':
+    unittest.main()